@@ -1,23 +1,29 @@
 import streamlit as st
 import os
-from langchain_ollama import OllamaEmbeddings, ChatOllama
 from langchain_community.vectorstores import FAISS
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.messages import HumanMessage, AIMessage
 
+from reranker import RerankingRetriever, make_scorer
+from gap_analyzer import GapAnalyzer, GapCache, GAP_CACHE_NAME, vectorstore_documents
+from providers import get_embeddings, get_chat_model
+
 
 # --- Configuration ---
 VECTOR_STORE_DIR = "vector_store/faiss_index"
 LLM_MODEL = "llama3.1:8b" 
 EMBEDDING_MODEL = "mxbai-embed-large"
 STATUS_FILE_PATH = "data/06_project_status_matrix.md"
+FETCH_K = 15  # Wide net for deeper analysis...
+RERANK_TOP_N = 6  # ...but only the best chunks reach the prompt
 
 class ProjectManagerAgent:
-    def __init__(self, llm, retriever, status_content):
+    def __init__(self, llm, retriever, status_content, gap_analyzer=None):
         self.llm = llm
         self.retriever = retriever
         self.status_content = status_content
+        self.gap_analyzer = gap_analyzer
 
     def invoke(self, inputs):
         # ... (Your existing invoke method for Drafting - Keep this as is) ...
@@ -57,46 +63,23 @@ class ProjectManagerAgent:
         })
 
     # --- NEW: GAP ANALYSIS FUNCTION ---
+    def stream_gaps(self):
+        """Progress events from the map-reduce gap analysis; see GapAnalyzer.stream."""
+        return self.gap_analyzer.stream()
+
     def analyze_gaps(self):
         """
         Scans the codebase/specs to find missing implementation details.
         """
-        # We retrieve broad context about architecture and requirements
-        docs = self.retriever.invoke("System Architecture Requirements vs Implementation Status")
-        context_text = "\n\n".join([f"[Source: {d.metadata.get('source', 'Unknown')}]\n{d.page_content}" for d in docs])
-        
-        gap_prompt = ChatPromptTemplate.from_template("""
-        You are a QA Architect and "Gap Analysis" Agent.
-        
-        YOUR TASK: 
-        Compare the "Requirements" (Architecture/Specs) against the "Implementation Status" (Matrix/Code) in the context below.
-        
-        CONTEXT:
-        {context}
-        
-        PROJECT STATUS:
-        {status}
-        
-        OUTPUT REPORT FORMAT:
-        1. **🔴 Critical Gaps:** (Features defined in specs but marked 'PENDING' or missing in code)
-        2. **⚠️ Inconsistencies:** (e.g., Spec says 'UUID' but code implies 'Integer', or 'Auth' is done but 'User Profile' is missing)
-        3. **✅ Alignment:** (Major modules that match perfectly)
-        
-        Be specific. Cite the files where you found the info.
-        """)
-        
-        chain = gap_prompt | self.llm | StrOutputParser()
-        return chain.invoke({
-            "context": context_text,
-            "status": self.status_content
-        })
+        # Every indexed chunk is checked, with the status matrix as the source of truth
+        return self.gap_analyzer.run()
 
 @st.cache_resource
 def get_rag_chain():
     # ... (Keep existing initialization logic) ...
     try:
-        llm = ChatOllama(model=LLM_MODEL, temperature=0.0, keep_alive="5m") 
-        embeddings = OllamaEmbeddings(model=EMBEDDING_MODEL)
+        llm = get_chat_model("ollama", LLM_MODEL, temperature=0.0, keep_alive="5m")
+        embeddings = get_embeddings("ollama", EMBEDDING_MODEL)
         
         if not os.path.exists(VECTOR_STORE_DIR):
              return None
@@ -106,14 +89,23 @@ def get_rag_chain():
             embeddings,
             allow_dangerous_deserialization=True
         )
-        retriever = vector_store.as_retriever(search_kwargs={"k": 15}) # Increase k for deeper analysis
+        retriever = vector_store.as_retriever(search_kwargs={"k": FETCH_K})
+        scorer = make_scorer()
+        if scorer:
+            retriever = RerankingRetriever(base_retriever=retriever, scorer=scorer, top_n=RERANK_TOP_N)
 
         status_content = "Status Matrix not found."
         if os.path.exists(STATUS_FILE_PATH):
             with open(STATUS_FILE_PATH, "r") as f:
                 status_content = f.read()
 
-        return ProjectManagerAgent(llm, retriever, status_content)
+        gap_analyzer = GapAnalyzer(
+            llm,
+            lambda: vectorstore_documents(vector_store),
+            cache=GapCache(os.path.join(os.path.dirname(VECTOR_STORE_DIR), GAP_CACHE_NAME)),
+            extra_context=status_content,
+        )
+        return ProjectManagerAgent(llm, retriever, status_content, gap_analyzer)
 
     except Exception as e:
         print(f"Error initializing Agent: {e}")
@@ -0,0 +1,129 @@
+import os
+import time
+import itertools
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# --- Configuration ---
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1") == "1"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))  # cosine similarity
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))  # seconds
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "512"))  # per snapshot
+ANSWER_CACHE_MAX_SNAPSHOTS = int(os.getenv("ANSWER_CACHE_MAX_SNAPSHOTS", "3"))
+
+def normalize(vector):
+    vector = np.asarray(vector, dtype="float32")
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+class _Namespace:
+    """The entries answered from one snapshot, plus their stacked vectors for lookup."""
+
+    def __init__(self):
+        self.entries = OrderedDict()  # id -> entry, least recently used first
+        self.matrix = None
+        self.matrix_ids = []
+
+    def expire(self, now, ttl):
+        expired = [entry_id for entry_id, entry in self.entries.items() if now - entry["created"] > ttl]
+        for entry_id in expired:
+            del self.entries[entry_id]
+        if expired:
+            self.matrix = None
+
+class AnswerCache:
+    """
+    In-process cache of generated answers, looked up by nearest neighbour on
+    the standalone question's embedding. Entries are kept per knowledge-base
+    snapshot, so sessions still on an older snapshot after a rebuild neither
+    see nor evict the newer snapshot's answers; only the `max_snapshots` most
+    recently used snapshots are kept. Entries also expire after `ttl`
+    seconds, and each snapshot keeps at most `max_entries`, least recently
+    used going first.
+    """
+
+    def __init__(self, threshold=ANSWER_CACHE_THRESHOLD, ttl=ANSWER_CACHE_TTL, max_entries=ANSWER_CACHE_MAX_ENTRIES,
+                 max_snapshots=ANSWER_CACHE_MAX_SNAPSHOTS):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_snapshots = max(1, max_snapshots)
+        self.namespaces = OrderedDict()  # snapshot -> _Namespace, least recently used first
+        self.hits = 0
+        self.misses = 0
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def _namespace(self, snapshot, create):
+        namespace = self.namespaces.get(snapshot)
+        if namespace is None and create:
+            namespace = self.namespaces[snapshot] = _Namespace()
+            while len(self.namespaces) > self.max_snapshots:
+                self.namespaces.popitem(last=False)
+        if namespace is not None:
+            self.namespaces.move_to_end(snapshot)
+        return namespace
+
+    def get(self, snapshot, vector):
+        """Returns the closest entry {"question", "answer", "documents", "similarity"} or None."""
+        now = time.time()
+        with self._lock:
+            namespace = self._namespace(snapshot, create=False)
+            if namespace is not None:
+                namespace.expire(now, self.ttl)
+            if namespace is None or not namespace.entries:
+                self.misses += 1
+                return None
+
+            if namespace.matrix is None:
+                namespace.matrix_ids = list(namespace.entries)
+                namespace.matrix = np.stack([namespace.entries[entry_id]["vector"] for entry_id in namespace.matrix_ids])
+            scores = namespace.matrix @ normalize(vector)
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            entry_id = namespace.matrix_ids[best]
+            namespace.entries.move_to_end(entry_id)
+            self.hits += 1
+            entry = namespace.entries[entry_id]
+            return {
+                "question": entry["question"],
+                "answer": entry["answer"],
+                "documents": entry["documents"],
+                "similarity": round(float(scores[best]), 4),
+            }
+
+    def put(self, snapshot, vector, question, answer, documents):
+        with self._lock:
+            namespace = self._namespace(snapshot, create=True)
+            namespace.entries[next(self._ids)] = {
+                "vector": normalize(vector),
+                "question": question,
+                "answer": answer,
+                "documents": documents,
+                "created": time.time(),
+            }
+            while len(namespace.entries) > self.max_entries:
+                namespace.entries.popitem(last=False)
+            namespace.matrix = None
+
+    def clear(self):
+        with self._lock:
+            self.namespaces.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        with self._lock:
+            entries = sum(len(namespace.entries) for namespace in self.namespaces.values())
+            snapshots = list(self.namespaces)
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "entries": entries,
+            "snapshots": snapshots,
+        }
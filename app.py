@@ -1,11 +1,14 @@
 import streamlit as st
-import time
 import os
+from functools import partial
 from dotenv import load_dotenv # Ensure .env is loaded
 from langchain_core.messages import HumanMessage, AIMessage
 from rag_backend import get_rag_chain
-from ingest import ingest_documents, DATA_DIR
-from export import create_pdf 
+from ingest import run_ingest, DATA_DIR
+from jobs import JobRunner, INGEST_STAGES
+from export import create_pdf, create_conversation_pdf
+from gap_analyzer import NO_FINDINGS
+import tracing
 
 
 
@@ -90,6 +93,76 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
+@st.cache_resource
+def get_job_runner():
+    return JobRunner()
+
+def format_stage(event):
+    text = f"{event['stage']}: {event['done']}/{event['total']}"
+    if event["rate"]:
+        text += f" · {event['rate']}/s"
+    if event["eta"] is not None:
+        text += f" · ETA {int(event['eta'])}s"
+    if event["message"]:
+        text += f" · {event['message']}"
+    return text
+
+def dismiss_ingest_result():
+    st.session_state.ingest_job = None
+
+@st.fragment(run_every=1)
+def ingest_progress(runner):
+    """Polls the current ingest job; only this fragment reruns while it works."""
+    job = runner.current
+    if job is None:
+        return
+    status = job.status()
+
+    if job.running:
+        for stage in INGEST_STAGES:
+            event = status["stages"].get(stage)
+            if event:
+                fraction = event["done"] / event["total"] if event["total"] else 1.0
+                st.progress(min(fraction, 1.0), text=format_stage(event))
+        if status["cancel_requested"]:
+            st.caption("Cancelling after the current step...")
+        elif st.button("Cancel rebuild", use_container_width=True, key=f"cancel_{job.id}"):
+            job.cancel()
+        st.session_state.watching_job = job.id
+        return
+
+    # The outcome is only shown to the session that asked for the rebuild, until it is dismissed.
+    if st.session_state.get("ingest_job") == job.id:
+        report = status["result"]
+        if status["state"] == "succeeded" and report:
+            st.success(
+                f"Knowledge Base Updated! {report['added']} added, {report['updated']} updated, "
+                f"{report['removed']} removed, {report['unchanged']} unchanged."
+            )
+            if report.get("failed"):
+                st.warning(f"{report['failed']} files could not be loaded (earlier versions stay indexed); see the ingest log.")
+        elif status["state"] == "succeeded":
+            st.warning("No documents found to ingest.")
+        elif status["state"] == "cancelled":
+            st.info("Rebuild cancelled; the previous knowledge base is still in use.")
+        else:
+            st.error(f"Ingestion failed: {status['error']}")
+        st.button("Dismiss", use_container_width=True, key=f"dismiss_{job.id}", on_click=dismiss_ingest_result)
+
+    # Rerun the whole app once so the chat picks up the newly published snapshot.
+    if st.session_state.get("watching_job") == job.id:
+        st.session_state.watching_job = None
+        st.rerun(scope="app")
+
+def source_names(docs):
+    """Distinct, human-readable origins of the retrieved documents, in rank order."""
+    names = []
+    for doc in docs:
+        name = os.path.basename(doc.metadata.get("source", ""))
+        if name and name not in names:
+            names.append(name)
+    return names
+
 col1, col2, col3 = st.columns([1, 2, 1]) 
 
 # ==========================================
@@ -142,18 +215,16 @@ with col1:
             st.toast(f"Saved {len(saved_files)} files.")
 
     # --- 3. Re-build Button ---
+    # Ingestion runs on a background worker shared by every session, so the
+    # UI stays responsive and concurrent clicks join the job already running.
+    runner = get_job_runner()
     if st.button("Re-build Knowledge Base", use_container_width=True, type="primary"):
-        with st.spinner("Ingesting Notion & Local Docs..."):
-            try:
-                ingest_documents()
-                get_rag_chain.clear() # Clear cache to force reload
-                st.success("Knowledge Base Updated!")
-                time.sleep(1)
-                st.rerun()
-            except Exception as e:
-                st.error(f"Ingestion failed: {e}")
+        job, started = runner.submit(run_ingest)
+        st.session_state.ingest_job = job.id
+        if not started:
+            st.toast("A rebuild is already running, showing its progress.")
 
-    
+    ingest_progress(runner)
 
 # ==========================================
 # COLUMN 2: CHAT
@@ -179,31 +250,39 @@ with col2:
     with st.container(height=700, border=True):
         for i, message in enumerate(st.session_state.messages):
             with st.chat_message(message["role"]):
+                if message.get("sources"):
+                    st.caption("Sources: " + ", ".join(message["sources"]))
                 st.markdown(message["content"])
                 if message["role"] == "assistant":
-                    # PDF Download Logic
-                    try:
-                        pdf_data = create_pdf(message["content"])
-                        st.download_button("📄 Download PDF", pdf_data, f"report_{i}.pdf", "application/pdf", key=f"dl_{i}")
-                    except: pass
+                    # PDF Download Logic: rendered only when the button is clicked
+                    st.download_button(
+                        "📄 Download PDF", partial(create_pdf, message["content"]), f"report_{i}.pdf",
+                        "application/pdf", key=f"dl_{i}", on_click="ignore",
+                    )
 
         if prompt := st.chat_input("Ask about your project docs..."):
             st.session_state.messages.append({"role": "user", "content": prompt})
             with st.chat_message("user"): st.markdown(prompt)
 
             with st.chat_message("assistant"):
-                with st.spinner("Analyzing Knowledge Base..."):
-                    if rag_chain:
-                        response = rag_chain.invoke({
+                if rag_chain:
+                    with tracing.span("chat_turn", turn=len(st.session_state.messages)):
+                        events = rag_chain.stream({
                             "input": prompt,
                             "chat_history": st.session_state.chat_history
                         })
-                        st.markdown(response)
-                        st.session_state.messages.append({"role": "assistant", "content": response})
-                        st.session_state.chat_history.extend([HumanMessage(content=prompt), AIMessage(content=response)])
-                        st.rerun()
-                    else:
-                        st.error("Please build the knowledge base first.")
+                        # The first event carries the retrieved sources; tokens follow.
+                        with st.spinner("Analyzing Knowledge Base..."):
+                            first = next(events)
+                        sources = source_names(first["documents"])
+                        if sources:
+                            st.caption("Sources: " + ", ".join(sources) + (" · cached answer" if first.get("cached") else ""))
+                        response = st.write_stream(event["text"] for event in events if event["type"] == "token")
+                    st.session_state.messages.append({"role": "assistant", "content": response, "sources": sources})
+                    st.session_state.chat_history.extend([HumanMessage(content=prompt), AIMessage(content=response)])
+                    st.rerun()
+                else:
+                    st.error("Please build the knowledge base first.")
 
 # ==========================================
 # COLUMN 3: STUDIO
@@ -214,9 +293,31 @@ with col3:
     with st.expander("🕵️ Gap Analyzer", expanded=True):
         st.markdown("Compare code vs. docs.")
         if st.button("Run Gap Analysis", type="primary", use_container_width=True):
-            if rag_chain and hasattr(rag_chain, 'analyze_gaps'):
-                with st.spinner("Analyzing..."):
-                    report = rag_chain.analyze_gaps()
+            if rag_chain and hasattr(rag_chain, 'stream_gaps'):
+                report, failed = None, False
+                with st.status("Analyzing...", expanded=True) as status:
+                    progress = st.progress(0.0)
+                    # Findings are shown per group as they finish; the report comes last.
+                    for event in rag_chain.stream_gaps():
+                        if event["type"] == "plan":
+                            status.update(label=f"Analyzing {event['groups']} sections ({event['cached']} unchanged)...")
+                        elif event["type"] == "finding":
+                            progress.progress(event["done"] / event["total"], text=f"{event['done']}/{event['total']} · {event['label']}")
+                            if "error" in event:
+                                st.warning(f"**{event['label']}**: {event['error']}")
+                            elif event["text"].strip().upper() != NO_FINDINGS:
+                                st.markdown(f"**{event['label']}**" + (" · cached" if event["cached"] else "") + f"\n\n{event['text']}")
+                        elif event["type"] == "reduce":
+                            status.update(label=f"Comparing findings from {event['groups']} sections...")
+                        elif event["type"] == "report":
+                            report, failed = event["text"], event.get("error", False)
+                    if report is None or failed:
+                        status.update(label="Gap analysis failed", state="error")
+                    else:
+                        status.update(label="Gap analysis complete", state="complete", expanded=False)
+                if report is None:
+                    st.error("Gap analysis ended without a report.")
+                else:
                     st.session_state.messages.append({"role": "assistant", "content": report})
                     st.session_state.chat_history.append(AIMessage(content=report))
                     st.rerun()
@@ -224,7 +325,41 @@ with col3:
                 st.error("Gap Analysis not available.")
 
     with st.expander("📊 Utils", expanded=False):
+        if rag_chain and rag_chain.answer_cache is not None:
+            cache_stats = rag_chain.answer_cache.stats()
+            st.caption(f"Answer cache: {cache_stats['hit_rate']:.0%} hit rate, {cache_stats['entries']} entries")
+        if any(message["role"] == "assistant" for message in st.session_state.messages):
+            st.download_button(
+                "📄 Export Conversation (PDF)", partial(create_conversation_pdf, list(st.session_state.messages)),
+                "conversation.pdf", "application/pdf", use_container_width=True, on_click="ignore",
+            )
         if st.button("Clear Chat History", use_container_width=True):
             st.session_state.messages = []
             st.session_state.chat_history = []
-            st.rerun()
\ No newline at end of file
+            st.rerun()
+
+    with st.expander("🔍 Debug", expanded=False):
+        # Tracing is process-wide; turning it on here records every session's requests.
+        record = st.toggle("Record traces", value=tracing.enabled())
+        if record != tracing.enabled():
+            tracing.set_enabled(record)
+        traces = tracing.recent_traces()
+        if not traces:
+            st.caption("No traces recorded yet." if record else "Enable to trace chat requests, ingests and exports.")
+        else:
+            labels = [f"{records[0]['name']} · {records[0]['durationMs']:.0f}ms" for records in traces]
+            selected = st.selectbox("Trace", range(len(traces)), format_func=labels.__getitem__)
+            records = traces[selected]
+            st.dataframe(
+                [
+                    {
+                        "span": "  " * depth + record["name"],
+                        "ms": record["durationMs"],
+                        "attributes": ", ".join(f"{k}={v}" for k, v in record["attributes"].items()),
+                    }
+                    for depth, record in tracing.span_tree(records)
+                ],
+                hide_index=True,
+                use_container_width=True,
+            )
+            st.download_button("Export traces (JSONL)", tracing.export_jsonl(), "traces.jsonl", "application/json")
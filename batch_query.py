@@ -0,0 +1,198 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from dotenv import load_dotenv
+
+from context_builder import count_tokens
+
+# --- Configuration ---
+env_path = os.path.join(os.path.dirname(__file__), '.env')
+load_dotenv(env_path)
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+QUERY_EMBED_BATCH = 100
+OFFLINE_ANSWER = "Offline answer: retrieval only, no model was called."
+
+# Runs many questions through the RAG application and reports latency, recall
+# and token usage. Input is JSONL, one object per line:
+#   {"id": "auth-1", "question": "How does login work?", "expected_sources": ["02_swagger_api.yaml"]}
+# `id` and `expected_sources` are optional; recall@k is only computed for
+# questions that list expected sources (matched by file name).
+
+# --- 1. Input ---
+def load_questions(path):
+    questions = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            if not item.get("question"):
+                raise ValueError(f"{path}:{line_number}: missing 'question'")
+            item.setdefault("id", str(line_number))
+            questions.append(item)
+    return questions
+
+# --- 2. Application Setup ---
+def offline_application(workdir, data_dir):
+    """Builds a throwaway index over `data_dir` with fake embeddings and a fake LLM; no network needed."""
+    from embedding_cache import CachedEmbeddings
+    from ingest import ingest_documents, EMBEDDING_MODEL
+    from providers import get_embeddings, get_chat_model
+    from rag_backend import build_rag_application
+    from snapshots import current_snapshot
+
+    fake_embeddings = get_embeddings("fake", EMBEDDING_MODEL)
+    if not ingest_documents(fake_embeddings, vector_store_dir=workdir, data_dir=data_dir, include_notion=False):
+        raise RuntimeError(f"Offline ingest of '{data_dir}' failed")
+    embeddings = CachedEmbeddings(fake_embeddings, EMBEDDING_MODEL, path=os.path.join(workdir, "embedding_cache.db"))
+    llm = get_chat_model("fake", "offline", responses=[OFFLINE_ANSWER])
+    return build_rag_application(embeddings, llm, current_snapshot(workdir), vector_store_dir=workdir, answer_cache=None)
+
+def live_application(use_answer_cache=False):
+    from embedding_cache import CachedEmbeddings
+    from providers import get_embeddings, get_chat_model
+    from rag_backend import build_rag_application, ANSWER_CACHE, EMBEDDING_MODEL, LLM_MODEL, VECTOR_STORE_DIR
+    from snapshots import current_snapshot
+
+    if "GOOGLE_API_KEY" not in os.environ:
+        raise RuntimeError("GOOGLE_API_KEY missing (use --offline to run without it)")
+    embeddings = CachedEmbeddings(get_embeddings("gemini", EMBEDDING_MODEL), EMBEDDING_MODEL)
+    llm = get_chat_model("gemini", LLM_MODEL, temperature=0.3, max_output_tokens=2048)
+    return build_rag_application(
+        embeddings, llm, current_snapshot(VECTOR_STORE_DIR),
+        answer_cache=ANSWER_CACHE if use_answer_cache else None,
+    )
+
+# --- 3. Running ---
+def source_name(doc):
+    return os.path.basename(doc.metadata.get("source", ""))
+
+def recall_at_k(expected, retrieved, k):
+    if not expected:
+        return None
+    found = {name for name in retrieved[:k]}
+    return sum(1 for name in expected if os.path.basename(name) in found) / len(expected)
+
+def run_question(app, item, k):
+    result = {"id": item["id"], "question": item["question"]}
+    start = time.perf_counter()
+    try:
+        sources, chunks, timings, context = [], [], {}, {}
+        for event in app.stream({"input": item["question"], "chat_history": []}):
+            if event["type"] == "sources":
+                sources = [source_name(doc) for doc in event["documents"]]
+            elif event["type"] == "token":
+                chunks.append(event["text"])
+            else:
+                timings, context = event["timings"], event.get("context", {})
+        answer = "".join(chunks)
+        result.update({
+            "answer": answer,
+            "sources": sources,
+            "recall": recall_at_k(item.get("expected_sources"), sources, k),
+            "timings": timings,
+            "context_tokens": context.get("tokens", 0),
+            "question_tokens": count_tokens(item["question"]),
+            "answer_tokens": count_tokens(answer),
+        })
+    except Exception as e:
+        result["error"] = str(e)
+    result["latency_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return result
+
+def run_batch(app, questions, concurrency=BATCH_CONCURRENCY, k=4):
+    """Runs every question with at most `concurrency` in flight; returns results in input order."""
+    # Embed all questions up front in a few batched requests; each query's
+    # own embed_query is then a cache hit.
+    texts = [item["question"] for item in questions]
+    if hasattr(app.embeddings, "embed_queries"):
+        for start in range(0, len(texts), QUERY_EMBED_BATCH):
+            app.embeddings.embed_queries(texts[start:start + QUERY_EMBED_BATCH])
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        return list(pool.map(lambda item: run_question(app, item, k), questions))
+
+def percentile(values, q):
+    return round(float(np.percentile(values, q)), 1) if values else None
+
+def summarize(results, wall_seconds, k):
+    ok = [r for r in results if "error" not in r]
+    latencies = [r["latency_ms"] for r in ok]
+    ttfts = [r["timings"]["ttft"] for r in ok if "ttft" in r["timings"]]
+    retrievals = [r["timings"]["retrieval"] for r in ok if "retrieval" in r["timings"]]
+    recalls = [r["recall"] for r in ok if r["recall"] is not None]
+    return {
+        "questions": len(results),
+        "errors": len(results) - len(ok),
+        "wall_seconds": round(wall_seconds, 2),
+        "questions_per_sec": round(len(results) / wall_seconds, 2) if wall_seconds else None,
+        "latency_ms": {"p50": percentile(latencies, 50), "p95": percentile(latencies, 95)},
+        "ttft_ms": {"p50": percentile(ttfts, 50), "p95": percentile(ttfts, 95)},
+        "retrieval_ms": {"p50": percentile(retrievals, 50), "p95": percentile(retrievals, 95)},
+        f"recall@{k}": round(sum(recalls) / len(recalls), 3) if recalls else None,
+        "tokens": {
+            "context": sum(r["context_tokens"] for r in ok),
+            "question": sum(r["question_tokens"] for r in ok),
+            "answer": sum(r["answer_tokens"] for r in ok),
+        },
+    }
+
+# --- 4. CLI ---
+def main():
+    parser = argparse.ArgumentParser(description="Run a JSONL file of questions through the RAG chain")
+    parser.add_argument("questions", help="JSONL file with one {\"question\": ...} per line")
+    parser.add_argument("--output", help="Write per-question results here (JSONL)")
+    parser.add_argument("--summary", help="Write the aggregate report here (JSON)")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    parser.add_argument("--k", type=int, default=4, help="Cut-off for recall@k")
+    parser.add_argument("--offline", action="store_true", help="Fake embeddings and LLM over a temporary index of --data-dir")
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--answer-cache", action="store_true", help="Allow semantic answer-cache hits (live mode)")
+    parser.add_argument("--min-recall", type=float, help="Exit non-zero if recall@k falls below this")
+    parser.add_argument("--max-p95-ms", type=float, help="Exit non-zero if p95 latency exceeds this")
+    args = parser.parse_args()
+
+    questions = load_questions(args.questions)
+    workdir = tempfile.mkdtemp(prefix="batch_query_") if args.offline else None
+    try:
+        app = offline_application(workdir, args.data_dir) if args.offline else live_application(args.answer_cache)
+        start = time.perf_counter()
+        results = run_batch(app, questions, args.concurrency, args.k)
+        summary = summarize(results, time.perf_counter() - start, args.k)
+    finally:
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            for result in results:
+                f.write(json.dumps(result) + "\n")
+    if args.summary:
+        with open(args.summary, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+    print(json.dumps(summary, indent=2))
+
+    failures = []
+    recall = summary[f"recall@{args.k}"]
+    if args.min_recall is not None and (recall is None or recall < args.min_recall):
+        failures.append(f"recall@{args.k} {recall} < {args.min_recall}")
+    p95 = summary["latency_ms"]["p95"]
+    if args.max_p95_ms is not None and (p95 is None or p95 > args.max_p95_ms):
+        failures.append(f"p95 {p95}ms > {args.max_p95_ms}ms")
+    if summary["errors"]:
+        failures.append(f"{summary['errors']} questions failed")
+    if failures:
+        print("❌ " + "; ".join(failures))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
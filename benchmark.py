@@ -0,0 +1,269 @@
+import os
+import sys
+import json
+import time
+import glob
+import shutil
+import random
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+
+import numpy as np
+
+# Synthetic-corpus benchmarks for the ingest, load and query paths. Embeddings
+# and the LLM are stubbed (deterministic fake embeddings, fixed-answer chat
+# model), so the numbers cover our own code: splitting, indexing, storage and
+# retrieval. Each scale runs in its own process so peak RSS is per scale.
+#
+#   python benchmark.py --scales 1000 10000 100000 --output bench.json
+
+DEFAULT_SCALES = [1_000, 10_000, 100_000]
+DEFAULT_DIM = 64  # Small vectors keep 1M-chunk runs within memory; pass --dim 768 for Gemini-sized ones.
+DEFAULT_QUERIES = 50
+SOURCE_DATA_DIR = "data"
+CORPUS_EXTENSIONS = (".md", ".yaml", ".yml", ".json", ".py", ".txt")
+QUESTIONS_PATH = os.path.join("eval", "questions.jsonl")
+
+# --- 1. Synthetic Corpora ---
+def source_files(source_dir=SOURCE_DATA_DIR):
+    return sorted(path for path in glob.glob(os.path.join(source_dir, "*")) if path.endswith(CORPUS_EXTENSIONS))
+
+def chunks_per_copy(paths):
+    from langchain_core.documents import Document
+    from local_loader import FILE_TYPES
+    from splitters import split_document
+
+    total = 0
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            doc = Document(page_content=f.read(), metadata={"source": path, "file_type": FILE_TYPES[os.path.splitext(path)[1]]})
+        total += sum(len(children) for _, children in split_document(doc))
+    return max(1, total)
+
+def write_corpus(target_dir, target_chunks, source_dir=SOURCE_DATA_DIR):
+    """
+    Writes enough numbered copies of the source documents to produce roughly
+    `target_chunks` child chunks, keeping each file's extension so the loader
+    and splitters treat copies like the originals. Each copy gets its own
+    `#` comment line so every file hashes (and embeds) differently; JSON has no
+    comments, so JSON copies are written unchanged. Returns the number of
+    files written.
+    """
+    paths = source_files(source_dir)
+    if not paths:
+        raise RuntimeError(f"No source documents in '{source_dir}'")
+    copies = max(1, round(target_chunks / chunks_per_copy(paths)))
+    os.makedirs(target_dir, exist_ok=True)
+    written = 0
+    for copy in range(copies):
+        subdir = os.path.join(target_dir, f"copy_{copy // 1000:04d}")
+        os.makedirs(subdir, exist_ok=True)
+        for path in paths:
+            with open(path, "r", encoding="utf-8") as f:
+                content = f.read()
+            stem, ext = os.path.splitext(os.path.basename(path))
+            if ext != ".json":
+                content = f"# Copy {copy} of {stem}{ext}\n\n{content}"
+            with open(os.path.join(subdir, f"{stem}.{copy:06d}{ext}"), "w", encoding="utf-8") as f:
+                f.write(content)
+            written += 1
+    return written
+
+def fake_notion_tree(pages, fanout=8, paragraphs=6, seed=0):
+    """A FakeNotionClient holding a `pages`-page tree with `fanout` children per page."""
+    from notion_loader import FakeNotionClient, paragraph_block, child_page_block
+
+    rng = random.Random(seed)
+    words = ["auth", "token", "deploy", "schema", "endpoint", "status", "pending", "react", "docker", "postgres"]
+    tree = {}
+    for index in range(pages):
+        page_id = f"page-{index:07d}"
+        blocks = [paragraph_block(" ".join(rng.choices(words, k=40))) for _ in range(paragraphs)]
+        for child in range(index * fanout + 1, min(pages, index * fanout + fanout + 1)):
+            blocks.append(child_page_block(f"page-{child:07d}", f"Page {child}"))
+        tree[page_id] = {"title": f"Page {index}", "blocks": blocks}
+    return FakeNotionClient(tree), "page-0000000"
+
+# --- 2. Measurements ---
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux and bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def directory_size(path):
+    sizes = {}
+    for name in os.listdir(path):
+        full = os.path.join(path, name)
+        if os.path.isfile(full):
+            sizes[name] = os.path.getsize(full)
+    return {"total_bytes": sum(sizes.values()), "files": sizes}
+
+def latency_summary(samples_ms):
+    return {
+        "p50": round(float(np.percentile(samples_ms, 50)), 3),
+        "p95": round(float(np.percentile(samples_ms, 95)), 3),
+        "mean": round(float(np.mean(samples_ms)), 3),
+    }
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+def load_benchmark_questions(count):
+    questions = ["What is the tech stack?", "How does login work?", "Which features are pending?"]
+    if os.path.exists(QUESTIONS_PATH):
+        with open(QUESTIONS_PATH, "r", encoding="utf-8") as f:
+            questions = [json.loads(line)["question"] for line in f if line.strip()]
+    return [questions[i % len(questions)] + ("" if i < len(questions) else f" ({i})") for i in range(count)]
+
+def run_scale(target_chunks, dim=DEFAULT_DIM, queries=DEFAULT_QUERIES, notion_pages=None, keep=False):
+    """Builds and measures one synthetic corpus; meant to run in a fresh process."""
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+    from langchain_core.language_models import FakeListChatModel
+    from embedding_cache import CachedEmbeddings
+    from ingest import run_ingest, EMBEDDING_MODEL, FAISS_INDEX_NAME
+    from index_store import load_index, build_index, flat_vectors, choose_index_kind, measure_cold_start
+    from notion_loader import NotionCrawler
+    from rag_backend import build_rag_application
+    from snapshots import current_snapshot, snapshot_dir
+
+    workdir = tempfile.mkdtemp(prefix="benchmark_")
+    data_dir = os.path.join(workdir, "data")
+    vector_store_dir = os.path.join(workdir, "vector_store")
+    result = {"target_chunks": target_chunks, "dim": dim}
+    try:
+        start = time.perf_counter()
+        result["files"] = write_corpus(data_dir, target_chunks)
+        result["corpus_seconds"] = round(time.perf_counter() - start, 3)
+
+        # Ingest: load, split, embed (fake), build and persist a snapshot.
+        fake_embeddings = DeterministicFakeEmbedding(size=dim)
+        report, ingest_ms = timed(run_ingest, fake_embeddings, vector_store_dir, data_dir=data_dir, include_notion=False)
+        snapshot = current_snapshot(vector_store_dir)
+        folder = snapshot_dir(snapshot, vector_store_dir)
+        embeddings = CachedEmbeddings(fake_embeddings, EMBEDDING_MODEL, path=os.path.join(vector_store_dir, "embedding_cache.db"))
+        store = load_index(embeddings, folder, FAISS_INDEX_NAME, mmap=False)
+        chunks = store.index.ntotal
+        result["chunks"] = chunks
+        result["ingest"] = {
+            "seconds": round(ingest_ms / 1000, 3),
+            "chunks_per_sec": round(chunks / (ingest_ms / 1000), 1),
+            "report": report,
+        }
+
+        # Index build on its own, for the kind the size policy picks.
+        vectors = flat_vectors(store, embeddings)
+        kind = choose_index_kind(chunks)
+        _, build_ms = timed(build_index, vectors, kind)
+        result["index_build"] = {"kind": kind, "seconds": round(build_ms / 1000, 3)}
+        del vectors, store
+
+        result["disk"] = directory_size(folder)
+        result["cold_start"] = measure_cold_start(folder, FAISS_INDEX_NAME)
+
+        # Query path: retrieval alone, parent docstore reads, and the full chain with a stub LLM.
+        llm = FakeListChatModel(responses=["Benchmark answer."])
+        app, load_ms = timed(build_rag_application, embeddings, llm, snapshot, vector_store_dir=vector_store_dir, answer_cache=None)
+        result["app_load_ms"] = round(load_ms, 1)
+        questions = load_benchmark_questions(queries)
+        embeddings.embed_queries(questions)
+        app.retriever.invoke(questions[0])  # warm-up
+
+        retrieval, docstore_reads, end_to_end = [], [], []
+        for question in questions:
+            docs, elapsed = timed(app.retriever.invoke, question)
+            retrieval.append(elapsed)
+        retriever = app.retriever
+        while hasattr(retriever, "base_retriever"):
+            retriever = retriever.base_retriever
+        keys = list(retriever.docstore.yield_keys())
+        rng = random.Random(0)
+        for _ in range(queries):
+            _, elapsed = timed(retriever.docstore.mget, rng.sample(keys, min(4, len(keys))))
+            docstore_reads.append(elapsed)
+        for question in questions:
+            _, elapsed = timed(app.invoke, {"input": question, "chat_history": []})
+            end_to_end.append(elapsed)
+        result["query_ms"] = {
+            "retrieval": latency_summary(retrieval),
+            "docstore_mget": latency_summary(docstore_reads),
+            "end_to_end": latency_summary(end_to_end),
+        }
+
+        # Notion crawl over a fake page tree (no rate limit, no latency).
+        pages = notion_pages if notion_pages is not None else min(2_000, max(10, target_chunks // 50))
+        if pages:
+            client, root = fake_notion_tree(pages)
+            crawler = NotionCrawler(client, requests_per_second=1_000_000)
+            docs, crawl_ms = timed(crawler.crawl, root)
+            result["notion_crawl"] = {
+                "pages": len(docs),
+                "seconds": round(crawl_ms / 1000, 3),
+                "pages_per_sec": round(len(docs) / (crawl_ms / 1000), 1),
+                "requests": crawler.stats["requests"],
+            }
+        result["peak_rss_mb"] = peak_rss_mb()
+        return result
+    finally:
+        if not keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+# --- 3. Driver ---
+def environment():
+    import faiss
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "faiss": faiss.__version__,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+def run_suite(scales, dim=DEFAULT_DIM, queries=DEFAULT_QUERIES, notion_pages=None):
+    """Runs each scale in a child process and collects the results."""
+    results = []
+    for scale in scales:
+        print(f"⏱️ Benchmarking {scale} chunks...", file=sys.stderr)
+        command = [sys.executable, os.path.abspath(__file__), "--child", str(scale), "--dim", str(dim), "--queries", str(queries)]
+        if notion_pages is not None:
+            command += ["--notion-pages", str(notion_pages)]
+        out = subprocess.run(command, capture_output=True, text=True)
+        if out.returncode != 0:
+            results.append({"target_chunks": scale, "error": out.stderr.strip().splitlines()[-1:] or ["unknown error"]})
+            continue
+        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return {"environment": environment(), "results": results}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark ingest, load and query on synthetic corpora")
+    parser.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES, help="Target child-chunk counts")
+    parser.add_argument("--dim", type=int, default=DEFAULT_DIM)
+    parser.add_argument("--queries", type=int, default=DEFAULT_QUERIES)
+    parser.add_argument("--notion-pages", type=int, help="Fake Notion tree size (default: scales with the corpus)")
+    parser.add_argument("--output", help="Write the JSON report here as well as to stdout")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        # Child process: keep stdout for the single JSON line.
+        real_stdout = sys.stdout
+        sys.stdout = sys.stderr
+        result = run_scale(args.child, args.dim, args.queries, args.notion_pages)
+        print(json.dumps(result), file=real_stdout)
+    else:
+        report = run_suite(args.scales, args.dim, args.queries, args.notion_pages)
+        text = json.dumps(report, indent=2)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                f.write(text)
+        print(text)
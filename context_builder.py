@@ -0,0 +1,92 @@
+import os
+import re
+import hashlib
+from functools import lru_cache
+
+# --- Configuration ---
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "6000"))
+GAP_CONTEXT_TOKEN_BUDGET = int(os.getenv("GAP_CONTEXT_TOKEN_BUDGET", "3000"))  # ~ the old 12000-character cut
+# Gemini's tokenizer isn't available offline; cl100k_base is a close enough proxy for budgeting.
+TOKEN_ENCODING = os.getenv("CONTEXT_TOKEN_ENCODING", "cl100k_base")
+SEPARATOR = "\n\n"
+
+@lru_cache(maxsize=1)
+def get_encoder():
+    """The tiktoken encoding, or None when it can't be loaded (not installed, or offline on first use)."""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(TOKEN_ENCODING)
+    except Exception as e:
+        print(f"⚠️ tiktoken unavailable ({e.__class__.__name__}), estimating tokens from length.")
+        return None
+
+def count_tokens(text):
+    encoder = get_encoder()
+    if encoder is None:
+        return len(text) // 4 + 1
+    return len(encoder.encode(text, disallowed_special=()))
+
+def content_key(doc):
+    return hashlib.sha256(" ".join(doc.page_content.split()).encode("utf-8")).hexdigest()
+
+def dedupe(docs):
+    """Drops documents whose text (ignoring whitespace) already appeared earlier in the list."""
+    seen = set()
+    unique = []
+    for doc in docs:
+        key = content_key(doc)
+        if key not in seen:
+            seen.add(key)
+            unique.append(doc)
+    return unique
+
+def _take_prefix(pieces, budget):
+    kept = []
+    used = 0
+    for piece in pieces:
+        cost = count_tokens(piece)
+        if used + cost > budget:
+            break
+        kept.append(piece)
+        used += cost
+    return "".join(kept).rstrip()
+
+def trim_to_budget(text, budget):
+    """Longest prefix of whole lines (or, for one huge line, whole words) that fits in `budget` tokens."""
+    return _take_prefix(text.splitlines(keepends=True), budget) or _take_prefix(re.findall(r"\S+\s*", text), budget)
+
+def build_context(docs, budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Joins retrieved documents into a prompt context of at most `budget` tokens.
+
+    Documents keep the retriever's ranking and duplicates are dropped. Only whole
+    documents are added; one that doesn't fit is skipped so smaller, lower-ranked
+    ones can still use the remaining budget. If not even the top document fits,
+    it is cut at a line (or word) boundary. Returns (text, info) where info records the
+    tokens actually sent.
+    """
+    unique = dedupe(docs)
+    separator_cost = count_tokens(SEPARATOR)
+    parts = []
+    used = 0
+    for doc in unique:
+        cost = count_tokens(doc.page_content) + (separator_cost if parts else 0)
+        if used + cost <= budget:
+            parts.append(doc.page_content)
+            used += cost
+
+    truncated = False
+    if not parts and unique:
+        parts = [trim_to_budget(unique[0].page_content, budget)]
+        used = count_tokens(parts[0])
+        truncated = True
+
+    info = {
+        "tokens": used,
+        "budget": budget,
+        "chunks": len(parts),
+        "retrieved": len(docs),
+        "duplicates": len(docs) - len(unique),
+        "truncated": truncated,
+    }
+    return SEPARATOR.join(parts), info
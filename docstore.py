@@ -0,0 +1,173 @@
+import os
+import sys
+import json
+import zlib
+import sqlite3
+import argparse
+import threading
+
+from langchain_core.documents import Document
+from langchain_core.stores import BaseStore
+
+# --- Optional zstd support ---
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# --- Configuration ---
+DOCSTORE_PATH = os.path.join("vector_store", "docstore.db")
+LEGACY_DOCSTORE_DIR = "docstore_data"
+DOCSTORE_COMPRESSION = os.getenv("DOCSTORE_COMPRESSION", "zlib")  # none | zlib | zstd
+SQLITE_MAX_VARIABLES = 900
+
+# Codec ids are stored per row, so stores written with different settings stay readable.
+CODEC_NONE, CODEC_ZLIB, CODEC_ZSTD = 0, 1, 2
+CODEC_IDS = {"none": CODEC_NONE, "zlib": CODEC_ZLIB, "zstd": CODEC_ZSTD}
+
+# --- 1. Serializers ---
+def serialize_document(doc: Document) -> bytes:
+    return json.dumps({
+        "page_content": doc.page_content,
+        "metadata": doc.metadata,
+    }).encode("utf-8")
+
+def deserialize_document(data: bytes) -> Document:
+    obj = json.loads(data.decode("utf-8"))
+    return Document(
+        page_content=obj["page_content"],
+        metadata=obj["metadata"],
+    )
+
+def compress(data, codec):
+    if codec == CODEC_ZLIB:
+        return zlib.compress(data, 6)
+    if codec == CODEC_ZSTD:
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return data
+
+def decompress(data, codec):
+    if codec == CODEC_ZLIB:
+        return zlib.decompress(data)
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("Docstore entry is zstd-compressed but 'zstandard' is not installed.")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+# --- 2. Packed Store ---
+class PackedDocStore(BaseStore[str, Document]):
+    """
+    Document store kept in a single SQLite file (key -> compressed JSON blob)
+    instead of one file per parent. mget/mset/mdelete each run as one batched
+    statement, so a retrieval is a single indexed lookup rather than N file opens.
+    """
+
+    def __init__(self, path=DOCSTORE_PATH, compression=DOCSTORE_COMPRESSION):
+        if compression == "zstd" and zstandard is None:
+            print("⚠️ zstandard not installed, falling back to zlib compression.")
+            compression = "zlib"
+        if compression not in CODEC_IDS:
+            raise ValueError(f"Unknown docstore compression '{compression}'")
+        self.path = path
+        self.codec = CODEC_IDS[compression]
+        self._local = threading.local()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS docs (key TEXT PRIMARY KEY, codec INTEGER NOT NULL, value BLOB NOT NULL)")
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def mget_raw(self, keys):
+        """Returns {key: serialized bytes} for the keys that exist."""
+        found = {}
+        conn = self._connect()
+        for start in range(0, len(keys), SQLITE_MAX_VARIABLES):
+            chunk = list(keys[start:start + SQLITE_MAX_VARIABLES])
+            placeholders = ",".join("?" * len(chunk))
+            rows = conn.execute(f"SELECT key, codec, value FROM docs WHERE key IN ({placeholders})", chunk)
+            for key, codec, value in rows:
+                found[key] = decompress(value, codec)
+        return found
+
+    def mset_raw(self, key_value_pairs):
+        rows = [(key, self.codec, compress(value, self.codec)) for key, value in key_value_pairs]
+        conn = self._connect()
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO docs (key, codec, value) VALUES (?, ?, ?)", rows)
+
+    def mget(self, keys):
+        found = self.mget_raw(keys)
+        return [deserialize_document(found[key]) if key in found else None for key in keys]
+
+    def mset(self, key_value_pairs):
+        self.mset_raw([(key, serialize_document(doc)) for key, doc in key_value_pairs])
+
+    def mdelete(self, keys):
+        conn = self._connect()
+        with conn:
+            for start in range(0, len(keys), SQLITE_MAX_VARIABLES):
+                chunk = list(keys[start:start + SQLITE_MAX_VARIABLES])
+                placeholders = ",".join("?" * len(chunk))
+                conn.execute(f"DELETE FROM docs WHERE key IN ({placeholders})", chunk)
+
+    def yield_keys(self, prefix=None):
+        conn = self._connect()
+        if prefix:
+            rows = conn.execute("SELECT key FROM docs WHERE key >= ? AND key < ? ORDER BY key", (prefix, prefix + "\uffff"))
+        else:
+            rows = conn.execute("SELECT key FROM docs ORDER BY key")
+        for (key,) in rows:
+            yield key
+
+    def clear(self):
+        conn = self._connect()
+        with conn:
+            conn.execute("DELETE FROM docs")
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+# --- 3. Migration ---
+def migrate_legacy_docstore(source_dir=LEGACY_DOCSTORE_DIR, target_path=DOCSTORE_PATH, compression=DOCSTORE_COMPRESSION, batch_size=500):
+    """Copies a LocalFileStore directory (one JSON file per key) into a PackedDocStore."""
+    store = PackedDocStore(target_path, compression)
+    batch = []
+    migrated = 0
+    for root, _, files in os.walk(source_dir):
+        for name in files:
+            path = os.path.join(root, name)
+            key = os.path.relpath(path, source_dir).replace(os.sep, "/")
+            with open(path, "rb") as f:
+                batch.append((key, f.read()))
+            if len(batch) >= batch_size:
+                store.mset_raw(batch)
+                migrated += len(batch)
+                batch = []
+    if batch:
+        store.mset_raw(batch)
+        migrated += len(batch)
+    return migrated
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Docstore maintenance")
+    sub = parser.add_subparsers(dest="command", required=True)
+    migrate = sub.add_parser("migrate", help="Pack a legacy docstore_data/ directory into a single file")
+    migrate.add_argument("--source", default=LEGACY_DOCSTORE_DIR)
+    migrate.add_argument("--target", default=DOCSTORE_PATH)
+    migrate.add_argument("--compression", default=DOCSTORE_COMPRESSION, choices=sorted(CODEC_IDS))
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.source):
+        print(f"❌ No legacy docstore at '{args.source}'")
+        sys.exit(1)
+    count = migrate_legacy_docstore(args.source, args.target, args.compression)
+    print(f"✅ Migrated {count} documents into '{args.target}'")
@@ -0,0 +1,210 @@
+import os
+import time
+import inspect
+import sqlite3
+import hashlib
+import threading
+from array import array
+
+from langchain_core.embeddings import Embeddings
+
+# --- Configuration ---
+EMBEDDING_CACHE_PATH = os.path.join("vector_store", "embedding_cache.db")
+EMBEDDING_CACHE_MAX_BYTES = int(os.getenv("EMBEDDING_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+KEY_BYTES = 32  # sha256 digest
+SQLITE_MAX_VARIABLES = 900
+
+def accepts_task_type(embeddings):
+    """Whether embed_documents takes a Gemini task type; wrappers report their model's answer."""
+    if hasattr(embeddings, "accepts_task_type"):
+        return embeddings.accepts_task_type
+    return "task_type" in inspect.signature(embeddings.embed_documents).parameters
+
+class CachedEmbeddings(Embeddings):
+    """
+    Wraps an Embeddings model with an on-disk cache keyed by
+    (model, query/document, sha256 of the text). Vectors are stored as packed
+    float32 blobs in a single SQLite file; when the cache grows past
+    `max_bytes` the least recently used entries are evicted.
+    """
+
+    def __init__(self, embeddings, model_name, path=EMBEDDING_CACHE_PATH, max_bytes=EMBEDDING_CACHE_MAX_BYTES):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._size = None
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key BLOB PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+
+    # --- Storage ---
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _key(self, kind, text):
+        return hashlib.sha256(f"{self.model_name}\0{kind}\0{text}".encode("utf-8")).digest()
+
+    def _get_many(self, keys):
+        found = {}
+        conn = self._connect()
+        for start in range(0, len(keys), SQLITE_MAX_VARIABLES):
+            chunk = keys[start:start + SQLITE_MAX_VARIABLES]
+            placeholders = ",".join("?" * len(chunk))
+            rows = conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk).fetchall()
+            for key, blob in rows:
+                found[key] = array("f", blob).tolist()
+        if found:
+            now = time.time()
+            with conn:
+                conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+        return found
+
+    def _put_many(self, items):
+        now = time.time()
+        rows = [(key, array("f", vector).tobytes(), now) for key, vector in items]
+        conn = self._connect()
+        with conn:
+            # Rows being replaced (e.g. two workers embedding the same text) give back their size.
+            replaced = 0
+            keys = [key for key, _, _ in rows]
+            for start in range(0, len(keys), SQLITE_MAX_VARIABLES):
+                chunk = keys[start:start + SQLITE_MAX_VARIABLES]
+                placeholders = ",".join("?" * len(chunk))
+                replaced += conn.execute(
+                    f"SELECT COALESCE(SUM(LENGTH(vector)), 0) + COUNT(*) * ? FROM embeddings WHERE key IN ({placeholders})",
+                    [KEY_BYTES] + chunk,
+                ).fetchone()[0]
+            conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", rows)
+        with self._lock:
+            if self._size is not None:
+                self._size += sum(KEY_BYTES + len(blob) for _, blob, _ in rows) - replaced
+        self._evict_if_needed()
+
+    def size_bytes(self):
+        with self._lock:
+            if self._size is None:
+                row = self._connect().execute(
+                    "SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+                ).fetchone()
+                self._size = row[0] * KEY_BYTES + row[1]
+            return self._size
+
+    def _evict_if_needed(self):
+        size = self.size_bytes()
+        if size <= self.max_bytes:
+            return
+        conn = self._connect()
+        row = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        if not row[0]:
+            return
+        # Drop down to 90% of the budget so eviction doesn't run on every insert.
+        row_bytes = size / row[0]
+        excess_rows = int((size - self.max_bytes * 0.9) / row_bytes) + 1
+        with conn:
+            conn.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                (excess_rows,),
+            )
+        with self._lock:
+            self._size = None
+
+    # --- Embeddings Interface ---
+    def embed_documents(self, texts):
+        keys = [self._key("document", text) for text in texts]
+        found = self._get_many(list(set(keys)))
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        with self._lock:
+            self.hits += len(texts) - len(missing)
+
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            with self._lock:
+                self.misses += len(missing)
+            # Round-trip through float32 so a miss returns exactly what a later hit will.
+            computed = {key: array("f", vector).tolist() for key, vector in zip(missing.keys(), vectors)}
+            self._put_many(computed.items())
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    def embed_query(self, text):
+        key = self._key("query", text)
+        found = self._get_many([key])
+        if key in found:
+            with self._lock:
+                self.hits += 1
+            return found[key]
+        vector = array("f", self.embeddings.embed_query(text)).tolist()
+        with self._lock:
+            self.misses += 1
+        self._put_many([(key, vector)])
+        return vector
+
+    async def aembed_query(self, text):
+        # The cache is local SQLite and fast enough to read inline; only a miss awaits the provider.
+        key = self._key("query", text)
+        found = self._get_many([key])
+        if key in found:
+            with self._lock:
+                self.hits += 1
+            return found[key]
+        vector = array("f", await self.embeddings.aembed_query(text)).tolist()
+        with self._lock:
+            self.misses += 1
+        self._put_many([(key, vector)])
+        return vector
+
+    def embed_queries(self, texts):
+        """
+        Batched embed_query: cache misses go to the provider in one request when
+        it accepts a task type (Gemini), so later embed_query calls are all hits.
+        """
+        keys = [self._key("query", text) for text in texts]
+        found = self._get_many(list(set(keys)))
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        with self._lock:
+            self.hits += len(texts) - len(missing)
+
+        if missing:
+            if accepts_task_type(self.embeddings):
+                vectors = self.embeddings.embed_documents(list(missing.values()), task_type="RETRIEVAL_QUERY")
+            else:
+                vectors = [self.embeddings.embed_query(text) for text in missing.values()]
+            with self._lock:
+                self.misses += len(missing)
+            computed = {key: array("f", vector).tolist() for key, vector in zip(missing.keys(), vectors)}
+            self._put_many(computed.items())
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "size_bytes": self.size_bytes(),
+        }
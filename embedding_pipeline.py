@@ -0,0 +1,95 @@
+import os
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# --- Configuration ---
+# Gemini's batchEmbedContents accepts up to 100 texts per request.
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "100"))
+EMBED_BATCH_TOKENS = int(os.getenv("EMBED_BATCH_TOKENS", "20000"))
+EMBED_MAX_INFLIGHT = int(os.getenv("EMBED_MAX_INFLIGHT", "4"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "5"))
+EMBED_BACKOFF_SECONDS = 1.0
+
+class EmbeddingError(Exception):
+    """A batch still failed after all retries."""
+
+def estimate_tokens(text):
+    # ~4 characters per token is close enough for sizing requests.
+    return len(text) // 4 + 1
+
+def build_batches(texts, max_items=EMBED_BATCH_SIZE, max_tokens=EMBED_BATCH_TOKENS):
+    """Splits texts into (start, end) ranges that respect both the item and token limits."""
+    batches = []
+    start = 0
+    tokens = 0
+    for i, text in enumerate(texts):
+        cost = estimate_tokens(text)
+        if i > start and (i - start >= max_items or tokens + cost > max_tokens):
+            batches.append((start, i))
+            start, tokens = i, 0
+        tokens += cost
+    if start < len(texts):
+        batches.append((start, len(texts)))
+    return batches
+
+class EmbeddingPipeline:
+    """
+    Embeds texts in provider-sized batches with several batches in flight.
+    Each batch is retried with jittered exponential backoff.
+
+    When `embeddings` is a CachedEmbeddings, every finished batch is written to
+    the cache as soon as it returns, which doubles as the checkpoint: a re-run
+    after a failure only sends the batches that never completed.
+    """
+
+    def __init__(self, embeddings, batch_size=EMBED_BATCH_SIZE, max_batch_tokens=EMBED_BATCH_TOKENS,
+                 max_inflight=EMBED_MAX_INFLIGHT, max_retries=EMBED_MAX_RETRIES, backoff=EMBED_BACKOFF_SECONDS):
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_inflight = max(1, max_inflight)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.lock = threading.Lock()
+        self.stats = {"chunks": 0, "batches": 0, "retries": 0, "elapsed": 0.0, "chunks_per_sec": 0.0}
+
+    def _embed_batch(self, texts):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.embeddings.embed_documents(texts)
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise EmbeddingError(f"batch of {len(texts)} chunks failed after {attempt + 1} attempts: {e}") from e
+                with self.lock:
+                    self.stats["retries"] += 1
+                time.sleep(self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+    def embed(self, texts, on_batch=None):
+        """
+        Returns one vector per text, in order. `on_batch(done, total)` is called
+        after each batch completes; an exception raised from it aborts the run.
+        """
+        start = time.perf_counter()
+        batches = build_batches(texts, self.batch_size, self.max_batch_tokens)
+        vectors = [None] * len(texts)
+
+        pool = ThreadPoolExecutor(max_workers=self.max_inflight)
+        try:
+            futures = [(lo, hi, pool.submit(self._embed_batch, texts[lo:hi])) for lo, hi in batches]
+            for lo, hi, future in futures:
+                vectors[lo:hi] = future.result()
+                self.stats["batches"] += 1
+                if on_batch:
+                    on_batch(hi, len(texts))
+        finally:
+            # On failure, drop the batches that haven't started; running ones still finish and get cached.
+            pool.shutdown(wait=True, cancel_futures=True)
+
+        elapsed = time.perf_counter() - start
+        self.stats["chunks"] += len(texts)
+        self.stats["elapsed"] = round(self.stats["elapsed"] + elapsed, 3)
+        if self.stats["elapsed"]:
+            self.stats["chunks_per_sec"] = round(self.stats["chunks"] / self.stats["elapsed"], 1)
+        return vectors
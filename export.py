@@ -1,5 +1,15 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
 from fpdf import FPDF
 
+from tracing import span
+
+# --- Configuration ---
+PDF_CACHE_SIZE = int(os.getenv("PDF_CACHE_SIZE", "64"))  # rendered documents kept in memory
+
 class PDF(FPDF):
     def header(self):
         self.set_font('Arial', 'B', 12)
@@ -17,12 +27,75 @@ def clean_text(text):
     # This encodes to latin-1, ignoring errors (dropping emojis), then decodes back to string
     return text.encode('latin-1', 'ignore').decode('latin-1')
 
+# Rendered PDFs keyed by a hash of their content, least recently used evicted first.
+_pdf_cache = OrderedDict()
+_pdf_cache_lock = threading.Lock()
+
+def _cached_render(kind, content, render):
+    key = hashlib.sha256(f"{kind}\0{content}".encode("utf-8")).hexdigest()
+    with _pdf_cache_lock:
+        data = _pdf_cache.get(key)
+        if data is not None:
+            _pdf_cache.move_to_end(key)
+            return data, True
+    data = render()
+    with _pdf_cache_lock:
+        _pdf_cache[key] = data
+        _pdf_cache.move_to_end(key)
+        while len(_pdf_cache) > PDF_CACHE_SIZE:
+            _pdf_cache.popitem(last=False)
+    return data, False
+
 def create_pdf(text):
     """
-    Converts markdown-style text to a simple PDF.
+    Converts markdown-style text to a simple PDF. Rendered documents are
+    cached by content, so asking again for the same text is free.
+    """
+    with span("create_pdf", chars=len(text)) as s:
+        data, cached = _cached_render("answer", text, lambda: render_pdf(text))
+        s.set(bytes=len(data), cached=cached)
+    return data
+
+def create_conversation_pdf(messages):
+    """
+    Renders a whole conversation into one PDF: each assistant answer under a
+    heading with the question that prompted it. `messages` are
+    {"role": ..., "content": ...} dicts in chat order.
     """
+    turns = [(m["role"], m["content"]) for m in messages]
+    with span("create_conversation_pdf", messages=len(turns)) as s:
+        content = "\0".join(f"{role}\0{text}" for role, text in turns)
+        data, cached = _cached_render("conversation", content, lambda: render_conversation_pdf(turns))
+        s.set(bytes=len(data), cached=cached)
+    return data
+
+def render_pdf(text):
     pdf = PDF()
     pdf.add_page()
+    write_markdown(pdf, text)
+    return pdf.output(dest='S').encode('latin-1', 'replace')
+
+def render_conversation_pdf(turns):
+    # Answers are written into the document one after another as they are
+    # read, rather than rendering each to its own PDF first.
+    pdf = PDF()
+    pdf.add_page()
+    question, answered = None, 0
+    for role, text in turns:
+        if role != "assistant":
+            question = text
+            continue
+        answered += 1
+        if answered > 1:
+            pdf.ln(6)
+        pdf.set_font("Arial", 'B', size=12)
+        pdf.multi_cell(0, 7, clean_text(f"{answered}. {question}" if question else f"{answered}. Report"), 0, 1)
+        pdf.ln(2)
+        write_markdown(pdf, text)
+        question = None
+    return pdf.output(dest='S').encode('latin-1', 'replace')
+
+def write_markdown(pdf, text):
     pdf.set_font("Arial", size=11)
     
     # 1. Sanitize the text (CRITICAL FIX)
@@ -53,6 +126,3 @@ def create_pdf(text):
         # Standard text
         else:
             pdf.multi_cell(0, 7, stripped_line, 0, 1)
-            
-    # Output
-    return pdf.output(dest='S').encode('latin-1', 'replace')
\ No newline at end of file
@@ -0,0 +1,308 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+
+from context_builder import count_tokens, CONTEXT_TOKEN_BUDGET, GAP_CONTEXT_TOKEN_BUDGET
+from splitters import PARENT_INDEX_KEY
+import tracing
+from tracing import span
+
+# --- Configuration ---
+GAP_WORKERS = int(os.getenv("GAP_ANALYSIS_WORKERS", "4"))  # concurrent map calls
+GAP_GROUP_TOKEN_BUDGET = GAP_CONTEXT_TOKEN_BUDGET  # parent text per map call
+GAP_REDUCE_TOKEN_BUDGET = CONTEXT_TOKEN_BUDGET  # findings per reduce call
+GAP_CACHE_NAME = "gap_cache.db"  # kept in the vector store dir, shared by all snapshots
+GAP_PROMPT_VERSION = 1  # bump when the map prompt changes, so cached findings are redone
+NO_FINDINGS = "NONE"
+DOCSTORE_BATCH_SIZE = 500
+
+# The whole corpus is analysed in two passes. Map: parent documents are
+# grouped by source (and by section when a source is too large for one call),
+# and each group is asked, concurrently, what it promises and what it says is
+# implemented. Reduce: the per-group findings are compared in a final call
+# (merged in batches first if they don't fit) to produce the report. Map
+# results are cached by a hash of the group's text, so a rerun only calls the
+# LLM for groups whose content changed.
+
+MAP_PROMPT = ChatPromptTemplate.from_template("""
+You are a QA Architect reviewing one part of a project's documentation.
+
+From the excerpt below, list:
+- PROMISE: features, requirements or behaviour the specs commit to
+- STATUS: what is stated as implemented, in progress, pending or missing
+- GAP: contradictions or missing pieces visible within the excerpt itself
+
+One bullet per line, starting with PROMISE, STATUS or GAP, and ending with the
+section it came from in [brackets]. Reply {none} if the excerpt has none.
+
+SOURCE: {label}
+
+EXCERPT:
+{text}
+""")
+
+MERGE_PROMPT = ChatPromptTemplate.from_template("""
+Merge these documentation findings into one list. Keep the PROMISE / STATUS /
+GAP bullet format and the [section] citations; drop exact duplicates but keep
+every distinct item.
+
+{findings}
+""")
+
+REDUCE_PROMPT = ChatPromptTemplate.from_template("""
+You are a QA Architect and "Gap Analysis" Agent.
+
+Below are findings extracted from every part of the project's documentation:
+what the specs promise (PROMISE), what is reported as implemented (STATUS),
+and local gaps (GAP).
+
+FINDINGS:
+{findings}
+
+{extra_context}
+
+Compare the promises against the implementation status across all sources.
+
+OUTPUT REPORT FORMAT:
+1. **🔴 Critical Gaps:** (Features promised in specs but pending or missing)
+2. **⚠️ Inconsistencies:** (Sources that contradict each other)
+3. **✅ Alignment:** (Major modules that match)
+
+Be specific. Cite the sources and sections.
+""")
+
+# --- 1. Corpus Access ---
+def docstore_documents(store, batch_size=DOCSTORE_BATCH_SIZE):
+    """Every parent document in a PackedDocStore."""
+    keys = list(store.yield_keys())
+    for start in range(0, len(keys), batch_size):
+        for doc in store.mget(keys[start:start + batch_size]):
+            if doc is not None:
+                yield doc
+
+def vectorstore_documents(vectorstore, batch_size=DOCSTORE_BATCH_SIZE):
+    """Every chunk stored alongside a FAISS index (for stores without parents)."""
+    ids = list(vectorstore.index_to_docstore_id.values())
+    for start in range(0, len(ids), batch_size):
+        for doc_id in ids[start:start + batch_size]:
+            doc = vectorstore.docstore.search(doc_id)
+            if not isinstance(doc, str):
+                yield doc
+
+# --- 2. Grouping ---
+def section_of(doc):
+    """Top-level section of a parent: the first two parts of its header path."""
+    header_path = doc.metadata.get("header_path", "")
+    return " > ".join(header_path.split(" > ")[:2]) if header_path else ""
+
+def group_documents(docs, budget=GAP_GROUP_TOKEN_BUDGET):
+    """
+    [(label, text)] with one group per source, or several consecutive groups
+    of whole sections when a source doesn't fit in `budget` tokens.
+    """
+    by_source = {}
+    for doc in docs:
+        by_source.setdefault(doc.metadata.get("source", "unknown"), []).append(doc)
+
+    groups = []
+    for source in sorted(by_source):
+        # Parents are stored unordered; their index from ingest restores the reading order.
+        # Chunks from stores without parents have none and fall back to page and header path.
+        parents = sorted(
+            by_source[source],
+            key=lambda d: (d.metadata.get(PARENT_INDEX_KEY, 0), d.metadata.get("page", 0), d.metadata.get("header_path", "")),
+        )
+        name = os.path.basename(source) or source
+        current, sections, used = [], [], 0
+        for doc in parents:
+            cost = count_tokens(doc.page_content)
+            if current and used + cost > budget:
+                groups.append((name, sections, "\n\n".join(current)))
+                current, sections, used = [], [], 0
+            current.append(doc.page_content)
+            used += cost
+            section = section_of(doc)
+            if section and section not in sections:
+                sections.append(section)
+        if current:
+            groups.append((name, sections, "\n\n".join(current)))
+
+    counts = {}
+    for name, _, _ in groups:
+        counts[name] = counts.get(name, 0) + 1
+    labels = []
+    for name, sections, text in groups:
+        label = name if counts[name] == 1 or not sections else f"{name} § {sections[0]}"
+        labels.append((label, text))
+    return labels
+
+# --- 3. Findings Cache ---
+class GapCache:
+    """Map results keyed by a hash of (model, prompt version, group text), in SQLite."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS findings (key TEXT PRIMARY KEY, findings TEXT NOT NULL, created REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connect().execute("SELECT findings FROM findings WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put(self, key, findings):
+        conn = self._connect()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO findings (key, findings, created) VALUES (?, ?, ?)", (key, findings, time.time())
+            )
+
+# --- 4. Analyzer ---
+def model_name(llm):
+    return getattr(llm, "model", None) or getattr(llm, "model_name", None) or type(llm).__name__
+
+class GapAnalyzer:
+    """
+    Map-reduce gap analysis over every document returned by `documents()`.
+    `stream()` yields progress events as groups finish; `run()` returns the
+    final report. `extra_context` (e.g. a status matrix) is given to the
+    reduce pass only.
+    """
+
+    def __init__(self, llm, documents, cache=None, workers=GAP_WORKERS, extra_context=None):
+        self.llm = llm
+        self.documents = documents
+        self.cache = cache
+        self.workers = max(1, workers)
+        self.extra_context = extra_context
+        self.map_chain = MAP_PROMPT | llm | StrOutputParser()
+        self.merge_chain = MERGE_PROMPT | llm | StrOutputParser()
+        self.reduce_chain = REDUCE_PROMPT | llm | StrOutputParser()
+
+    def cache_key(self, text):
+        return hashlib.sha256(f"{model_name(self.llm)}\0{GAP_PROMPT_VERSION}\0{text}".encode("utf-8")).hexdigest()
+
+    def map_group(self, label, text):
+        with span("gap_map", group=label) as s:
+            # Counting tokens isn't free, so only do it for recorded traces.
+            if tracing.enabled():
+                s.set(tokens=count_tokens(text))
+            return self.map_chain.invoke({"label": label, "text": text, "none": NO_FINDINGS}).strip()
+
+    def reduce(self, findings):
+        """Final report from [(label, findings)], merging in batches first if they exceed the budget."""
+        blocks = [f"### {label}\n{text}" for label, text in findings]
+        with span("gap_reduce", groups=len(blocks)) as s:
+            rounds = 0
+            while len(blocks) > 1 and count_tokens("\n\n".join(blocks)) > GAP_REDUCE_TOKEN_BUDGET:
+                batches, batch, used = [], [], 0
+                for block in blocks:
+                    cost = count_tokens(block)
+                    if batch and used + cost > GAP_REDUCE_TOKEN_BUDGET:
+                        batches.append(batch)
+                        batch, used = [], 0
+                    batch.append(block)
+                    used += cost
+                batches.append(batch)
+                if len(batches) == len(blocks):
+                    break  # every block alone is over budget; merging can't shrink the input
+                blocks = [self.merge_chain.invoke({"findings": "\n\n".join(batch)}).strip() for batch in batches]
+                rounds += 1
+            s.set(merge_rounds=rounds)
+            extra = f"PROJECT STATUS:\n{self.extra_context}" if self.extra_context else ""
+            return self.reduce_chain.invoke({"findings": "\n\n".join(blocks), "extra_context": extra})
+
+    def stream(self):
+        """
+        Yields {"type": "plan", "groups", "cached"}, then one
+        {"type": "finding", "label", "text", "cached", "done", "total"} per
+        group as it completes ("error" instead of "text" if it failed), then
+        {"type": "reduce", "groups"} when the comparison starts and finally
+        {"type": "report", "text"}. Failed groups are listed at the end of the
+        report; if every group failed, the report carries "error": True.
+        """
+        with span("gap_analysis") as root:
+            groups = group_documents(self.documents())
+            keys = [self.cache_key(text) for _, text in groups]
+            cached = {i: self.cache.get(key) for i, key in enumerate(keys)} if self.cache else {}
+            cached = {i: findings for i, findings in cached.items() if findings is not None}
+            root.set(groups=len(groups), cached=len(cached))
+            yield {"type": "plan", "groups": len(groups), "cached": len(cached)}
+
+            results = {}
+            failures = []
+            done = 0
+            for i, findings in cached.items():
+                results[i] = findings
+                done += 1
+                yield {"type": "finding", "label": groups[i][0], "text": findings, "cached": True, "done": done, "total": len(groups)}
+
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="gap-map") as pool:
+                futures = {
+                    # Each task gets a copy of this context so its spans join the trace.
+                    pool.submit(contextvars.copy_context().run, self.map_group, label, text): i
+                    for i, (label, text) in enumerate(groups) if i not in cached
+                }
+                try:
+                    for future in as_completed(futures):
+                        i = futures[future]
+                        done += 1
+                        event = {"type": "finding", "label": groups[i][0], "cached": False, "done": done, "total": len(groups)}
+                        try:
+                            results[i] = future.result()
+                        except Exception as e:
+                            event["error"] = str(e)
+                            failures.append((i, str(e)))
+                        else:
+                            event["text"] = results[i]
+                            if self.cache:
+                                self.cache.put(keys[i], results[i])
+                        yield event
+                finally:
+                    # Closed early (e.g. the page was left): don't start groups nobody will read.
+                    for future in futures:
+                        future.cancel()
+
+            root.set(failed=len(failures))
+            # Sections whose map call failed are missing from the comparison; the report has to say so.
+            failed = "\n".join(f"- {groups[i][0]}: {error}" for i, error in sorted(failures))
+            if failures and not results:
+                yield {"type": "report", "error": True,
+                       "text": f"**❌ Gap analysis failed:** none of the {len(groups)} sections could be analysed.\n\n{failed}"}
+                return
+            not_analysed = f"\n\n**⏭️ Not analysed:** (these sections failed and are not part of the comparison)\n{failed}" if failures else ""
+
+            findings = [
+                (groups[i][0], results[i]) for i in sorted(results)
+                if results[i] and results[i].strip().upper() != NO_FINDINGS
+            ]
+            if not findings:
+                yield {"type": "report", "text": "No requirements or implementation details found to compare." + not_analysed}
+                return
+            yield {"type": "reduce", "groups": len(findings)}
+            yield {"type": "report", "text": self.reduce(findings) + not_analysed}
+
+    def run(self):
+        report = ""
+        for event in self.stream():
+            if event["type"] == "report":
+                report = event["text"]
+        return report
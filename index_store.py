@@ -0,0 +1,445 @@
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+import faiss
+import numpy as np
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_community.vectorstores import FAISS
+
+from docstore import PackedDocStore
+
+# --- Configuration ---
+VECTOR_STORE_DIR = "vector_store"
+FAISS_INDEX_NAME = "faiss_index"
+# Zero-copy mmap of the vector codes where this faiss build supports it (>= 1.9).
+MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+# Index policy: exact search while brute force is cheap, then graph, then compressed IVF.
+FAISS_INDEX_KIND = os.getenv("FAISS_INDEX_KIND", "auto")  # auto | flat | hnsw | ivfpq
+HNSW_MIN_VECTORS = 50_000
+IVFPQ_MIN_VECTORS = 1_000_000
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "16"))
+IVF_TRAIN_SAMPLE = 100_000
+IVFPQ_MIN_TRAIN = 256 * 39  # 8-bit PQ codebooks need ~39 points per centroid
+
+def index_paths(folder, index_name):
+    base = os.path.join(folder, index_name)
+    return {
+        "index": base + ".faiss",
+        "ids": base + ".ids.json",
+        "children": base + ".children.db",
+        "meta": base + ".meta.json",
+        "vectors": base + ".vectors.f32",
+        "legacy_pickle": base + ".pkl",
+    }
+
+# --- 1. Child Docstore ---
+class PackedChildDocstore(Docstore, AddableMixin):
+    """
+    The FAISS child-chunk docstore, backed by a PackedDocStore file instead of
+    a pickled InMemoryDocstore. Adds and deletes are buffered in memory and
+    only written when the index is saved with it (see `save_index`).
+    """
+
+    def __init__(self, path):
+        self.store = PackedDocStore(path, compression="none")
+        self.pending_add = {}
+        self.pending_delete = set()
+
+    def add(self, texts):
+        for key, doc in texts.items():
+            self.pending_add[key] = doc
+            self.pending_delete.discard(key)
+
+    def delete(self, ids):
+        for key in ids:
+            self.pending_add.pop(key, None)
+            self.pending_delete.add(key)
+
+    def search(self, search):
+        if search in self.pending_add:
+            return self.pending_add[search]
+        if search in self.pending_delete:
+            return f"ID {search} not found."
+        doc = self.store.mget([search])[0]
+        return doc if doc is not None else f"ID {search} not found."
+
+    def mget(self, ids):
+        """Batched lookup used by callers that already hold many ids."""
+        stored = dict(zip(ids, self.store.mget(ids)))
+        return [self.pending_add.get(key, None if key in self.pending_delete else stored[key]) for key in ids]
+
+    def flush_adds(self):
+        if self.pending_add:
+            self.store.mset(list(self.pending_add.items()))
+        self.pending_add = {}
+
+    def flush_deletes(self):
+        if self.pending_delete:
+            self.store.mdelete(list(self.pending_delete))
+        self.pending_delete = set()
+
+# --- 2. Index Types ---
+def choose_index_kind(ntotal):
+    if FAISS_INDEX_KIND != "auto":
+        return FAISS_INDEX_KIND
+    if ntotal >= IVFPQ_MIN_VECTORS:
+        return "ivfpq"
+    if ntotal >= HNSW_MIN_VECTORS:
+        return "hnsw"
+    return "flat"
+
+def ivfpq_params(ntotal, dimension):
+    nlist = max(1, min(65536, int(4 * np.sqrt(ntotal))))
+    # Sub-quantizers of 4 dims each (must divide the dimension): 768 dims -> 192 bytes per vector.
+    m = next(m for m in (dimension // 4, dimension // 2, dimension, 1) if m and dimension % m == 0)
+    return {"nlist": nlist, "m": m, "nbits": 8, "nprobe": IVF_NPROBE}
+
+def build_index(vectors, kind, params=None):
+    """Builds an index of `kind` over `vectors` (float32, n x d). Returns (index, meta)."""
+    ntotal, dimension = vectors.shape
+    if kind == "ivfpq" and ntotal < IVFPQ_MIN_TRAIN:
+        print(f"⚠️ {ntotal} vectors are too few to train IVF-PQ, using HNSW instead.")
+        kind, params = "hnsw", None
+    if kind == "flat":
+        index = faiss.IndexFlatL2(dimension)
+        params = {}
+    elif kind == "hnsw":
+        params = params or {"M": HNSW_M, "ef_construction": HNSW_EF_CONSTRUCTION, "ef_search": HNSW_EF_SEARCH}
+        index = faiss.IndexHNSWFlat(dimension, params["M"])
+        index.hnsw.efConstruction = params["ef_construction"]
+    elif kind == "ivfpq":
+        params = params or ivfpq_params(ntotal, dimension)
+        index = faiss.IndexIVFPQ(faiss.IndexFlatL2(dimension), dimension, params["nlist"], params["m"], params["nbits"])
+        sample_size = min(ntotal, max(IVF_TRAIN_SAMPLE, params["nlist"] * 39))
+        sample = vectors[np.random.default_rng(0).choice(ntotal, sample_size, replace=False)]
+        index.train(sample)
+    else:
+        raise ValueError(f"Unknown index kind '{kind}'")
+    if ntotal:
+        index.add(vectors)
+    meta = {"kind": kind, "params": params, "ntotal": int(ntotal), "dimension": int(dimension)}
+    apply_search_params(index, meta)
+    return index, meta
+
+def apply_search_params(index, meta):
+    params = meta.get("params", {})
+    if meta.get("kind") == "hnsw":
+        index.hnsw.efSearch = params.get("ef_search", HNSW_EF_SEARCH)
+    elif meta.get("kind") == "ivfpq":
+        faiss.extract_index_ivf(index).nprobe = params.get("nprobe", IVF_NPROBE)
+
+def read_vectors(path, dimension, ntotal):
+    """The raw vectors saved next to an index (read-only memmap), or None if missing or out of step."""
+    if not os.path.exists(path) or os.path.getsize(path) != ntotal * dimension * 4:
+        return None
+    if ntotal == 0:
+        return np.zeros((0, dimension), dtype="float32")
+    return np.memmap(path, dtype="float32", mode="r", shape=(ntotal, dimension))
+
+def flat_vectors(vectorstore, embeddings=None, vectors_path=None):
+    """
+    Exact vectors of every entry, in index order. Flat and HNSW indexes store
+    them verbatim; IVF-PQ only keeps lossy codes, so they come from the raw
+    vectors saved at `vectors_path`, or for snapshots written before that file
+    existed, are re-embedded from the child texts.
+    """
+    index = vectorstore.index
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype="float32")
+    if isinstance(index, (faiss.IndexFlat, faiss.IndexHNSWFlat)):
+        return index.reconstruct_n(0, index.ntotal)
+    saved = read_vectors(vectors_path, index.d, index.ntotal) if vectors_path else None
+    if saved is not None:
+        return np.array(saved)
+    if embeddings is None:
+        raise ValueError("Re-embedding an IVF-PQ index needs an embeddings model")
+    ids = [vectorstore.index_to_docstore_id[i] for i in range(index.ntotal)]
+    docs = vectorstore.docstore.mget(ids)
+    return np.array(embeddings.embed_documents([doc.page_content for doc in docs]), dtype="float32")
+
+def make_mutable(vectorstore, embeddings=None, folder=VECTOR_STORE_DIR, index_name=FAISS_INDEX_NAME):
+    """Swaps in a flat index (HNSW can't delete, IVF-PQ is lossy) so ingest can add and remove freely."""
+    if not isinstance(vectorstore.index, faiss.IndexFlat):
+        vectors = flat_vectors(vectorstore, embeddings, index_paths(folder, index_name)["vectors"])
+        vectorstore.index, _ = build_index(vectors, "flat")
+    return vectorstore
+
+def _previous_index(paths):
+    """(index, meta, ids) of the version currently on disk, or None."""
+    if not all(os.path.exists(paths[name]) for name in ("index", "meta", "ids")):
+        return None
+    with open(paths["meta"], "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    with open(paths["ids"], "r", encoding="utf-8") as f:
+        ids = json.load(f)
+    return faiss.read_index(paths["index"]), meta, ids
+
+def update_index(vectors, ids, kind, previous):
+    """
+    Index of `kind` over `vectors`, reusing the previous on-disk version where
+    possible: if the run only appended entries, just those are added to it
+    (HNSW graphs and IVF-PQ lists both support that); otherwise an IVF-PQ
+    index keeps its trained codebooks and only re-encodes. Returns
+    (index, meta, appended) where `appended` is how many leading entries
+    were kept as they were.
+    """
+    ntotal, dimension = vectors.shape
+    if previous is not None:
+        index, meta, previous_ids = previous
+        same_kind = meta.get("kind") == kind and index.d == dimension and index.ntotal == len(previous_ids)
+        if same_kind and ids[:len(previous_ids)] == previous_ids:
+            index.add(np.ascontiguousarray(vectors[len(previous_ids):]))
+            return index, {**meta, "ntotal": int(ntotal)}, len(previous_ids)
+        if same_kind and kind == "ivfpq":
+            index.reset()
+            index.add(np.ascontiguousarray(vectors))
+            return index, {**meta, "ntotal": int(ntotal)}, 0
+    index, meta = build_index(vectors, kind)
+    return index, meta, 0
+
+def write_vectors(path, vectors, keep=0):
+    """Saves the raw vectors; the first `keep` rows already on disk are left alone and the rest appended."""
+    row_bytes = vectors.shape[1] * 4
+    if keep and os.path.exists(path) and os.path.getsize(path) >= keep * row_bytes:
+        with open(path, "r+b") as f:
+            f.truncate(keep * row_bytes)
+            f.seek(0, os.SEEK_END)
+            f.write(np.ascontiguousarray(vectors[keep:], dtype="float32").tobytes())
+        return
+    with open(path + ".tmp", "wb") as f:
+        f.write(np.ascontiguousarray(vectors, dtype="float32").tobytes())
+    os.replace(path + ".tmp", path)
+
+# --- 3. Save / Load ---
+def new_index(embeddings, dimension, folder=VECTOR_STORE_DIR, index_name=FAISS_INDEX_NAME):
+    """An empty flat index whose child docs live next to it on disk."""
+    paths = index_paths(folder, index_name)
+    os.makedirs(folder, exist_ok=True)
+    docstore = PackedChildDocstore(paths["children"])
+    docstore.store.clear()
+    return FAISS(embeddings, faiss.IndexFlatL2(dimension), docstore, {})
+
+def save_index(vectorstore, folder=VECTOR_STORE_DIR, index_name=FAISS_INDEX_NAME, kind=None, embeddings=None):
+    """
+    Writes the index, the position -> id map (JSON), the child docs, the
+    index metadata and the raw vectors; no pickle involved. The index type
+    follows `choose_index_kind` unless `kind` is given, and is recorded in the
+    metadata so `load_index` can restore its search parameters. HNSW and
+    IVF-PQ indexes are updated from the version already in `folder` rather
+    than rebuilt when possible (see `update_index`).
+    """
+    paths = index_paths(folder, index_name)
+    os.makedirs(folder, exist_ok=True)
+
+    docstore = vectorstore.docstore
+    if not isinstance(docstore, PackedChildDocstore):
+        # e.g. a store loaded from the legacy pickle: copy its docs over.
+        packed = PackedChildDocstore(paths["children"])
+        packed.store.clear()
+        packed.add({key: docstore.search(key) for key in vectorstore.index_to_docstore_id.values()})
+        vectorstore.docstore = docstore = packed
+
+    kind = kind or choose_index_kind(vectorstore.index.ntotal)
+    ids = [vectorstore.index_to_docstore_id[i] for i in range(len(vectorstore.index_to_docstore_id))]
+    if kind == "flat" and isinstance(vectorstore.index, faiss.IndexFlat):
+        index, meta = vectorstore.index, {"kind": "flat", "params": {}, "ntotal": vectorstore.index.ntotal, "dimension": vectorstore.index.d}
+    else:
+        vectors = flat_vectors(vectorstore, embeddings, paths["vectors"])
+        index, meta, kept = update_index(vectors, ids, kind, _previous_index(paths))
+        apply_search_params(index, meta)
+    if meta["kind"] == "ivfpq":
+        # IVF-PQ keeps only lossy codes; the next incremental run starts from these.
+        write_vectors(paths["vectors"], vectors, kept)
+    elif os.path.exists(paths["vectors"]):
+        os.remove(paths["vectors"])
+
+    # New children land before the index that points at them; stale ones go after.
+    docstore.flush_adds()
+
+    faiss.write_index(index, paths["index"] + ".tmp")
+    os.replace(paths["index"] + ".tmp", paths["index"])
+    with open(paths["meta"] + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    os.replace(paths["meta"] + ".tmp", paths["meta"])
+    with open(paths["ids"] + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(ids, f)
+    os.replace(paths["ids"] + ".tmp", paths["ids"])
+    docstore.flush_deletes()
+
+def load_index(embeddings, folder=VECTOR_STORE_DIR, index_name=FAISS_INDEX_NAME, mmap=True):
+    """
+    Loads a FAISS store saved by `save_index`. With mmap=True the vectors are
+    memory-mapped read-only, so processes serving the same index share its
+    pages through the OS cache; use mmap=False for an index you will modify.
+    Falls back to the legacy pickle format when no id map is present.
+    """
+    paths = index_paths(folder, index_name)
+    if not os.path.exists(paths["ids"]):
+        return FAISS.load_local(folder, embeddings, index_name=index_name, allow_dangerous_deserialization=True)
+
+    index = None
+    if mmap:
+        try:
+            index = faiss.read_index(paths["index"], MMAP_FLAGS)
+        except RuntimeError:
+            index = None  # Index type without mmap support
+    if index is None:
+        index = faiss.read_index(paths["index"])
+    if os.path.exists(paths["meta"]):
+        with open(paths["meta"], "r", encoding="utf-8") as f:
+            apply_search_params(index, json.load(f))
+
+    with open(paths["ids"], "r", encoding="utf-8") as f:
+        ids = json.load(f)
+    return FAISS(embeddings, index, PackedChildDocstore(paths["children"]), dict(enumerate(ids)))
+
+# --- 4. Cold Start Measurement ---
+def _rss_kb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+def _measure_child(folder, index_name, mode, queries):
+    from langchain_core.embeddings import DeterministicFakeEmbedding
+
+    placeholder = DeterministicFakeEmbedding(size=1)  # Only needed to build the store
+
+    rss_before = _rss_kb()
+    start = time.perf_counter()
+    if mode == "pickle":
+        store = FAISS.load_local(folder, placeholder, index_name=index_name, allow_dangerous_deserialization=True)
+    else:
+        store = load_index(placeholder, folder, index_name, mmap=(mode == "mmap"))
+    load_seconds = time.perf_counter() - start
+    rss_loaded = _rss_kb()
+
+    embedder = DeterministicFakeEmbedding(size=store.index.d)
+    start = time.perf_counter()
+    for i in range(queries):
+        store.similarity_search_by_vector(embedder.embed_query(f"query {i}"), k=4)
+    query_ms = (time.perf_counter() - start) * 1000 / max(1, queries)
+    print(json.dumps({
+        "mode": mode,
+        "load_seconds": round(load_seconds, 4),
+        "rss_load_kb": rss_loaded - rss_before,
+        "rss_after_queries_kb": _rss_kb() - rss_before,
+        "query_ms": round(query_ms, 3),
+    }))
+
+def measure_cold_start(folder=VECTOR_STORE_DIR, index_name=FAISS_INDEX_NAME, queries=20):
+    """Loads the index in fresh processes, one per available format, and reports time and RSS."""
+    paths = index_paths(folder, index_name)
+    modes = []
+    if os.path.exists(paths["legacy_pickle"]):
+        modes.append("pickle")
+    if os.path.exists(paths["ids"]):
+        modes.extend(["read", "mmap"])
+    results = []
+    for mode in modes:
+        out = subprocess.run(
+            [sys.executable, __file__, "measure", "--child", mode, "--folder", folder,
+             "--index-name", index_name, "--queries", str(queries)],
+            capture_output=True, text=True, check=True,
+        )
+        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    return results
+
+# --- 5. Recall vs Latency Report ---
+def synthetic_vectors(ntotal, dimension, clusters=64, seed=0):
+    """Clustered Gaussian vectors, closer to real embeddings than uniform noise."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dimension)).astype("float32")
+    labels = rng.integers(0, clusters, size=ntotal)
+    return centers[labels] + 0.3 * rng.normal(size=(ntotal, dimension)).astype("float32")
+
+def recall_report(vectors, k=10, queries=200, seed=0):
+    """
+    Recall@k and per-query latency of HNSW (efSearch sweep) and IVF-PQ
+    (nprobe sweep) against exact flat search over the same vectors.
+    """
+    rng = np.random.default_rng(seed)
+    ntotal, dimension = vectors.shape
+    picks = rng.choice(ntotal, min(queries, ntotal), replace=False)
+    query_vectors = vectors[picks] + 0.05 * rng.normal(size=(len(picks), dimension)).astype("float32")
+
+    def run(index, label, param, build_seconds):
+        start = time.perf_counter()
+        _, found = index.search(query_vectors, k)
+        ms = (time.perf_counter() - start) * 1000 / len(query_vectors)
+        recall = np.mean([len(set(row) & set(exact_row)) / k for row, exact_row in zip(found, exact)]) if exact is not None else 1.0
+        return {"kind": label, "param": param, "recall_at_k": round(float(recall), 4),
+                "ms_per_query": round(ms, 4), "build_seconds": round(build_seconds, 3)}
+
+    rows = []
+    exact = None
+    start = time.perf_counter()
+    flat, _ = build_index(vectors, "flat")
+    rows.append(run(flat, "flat", "", time.perf_counter() - start))
+    _, exact = flat.search(query_vectors, k)
+
+    start = time.perf_counter()
+    hnsw, _ = build_index(vectors, "hnsw")
+    build_seconds = time.perf_counter() - start
+    for ef_search in (16, 32, 64, 128, 256):
+        hnsw.hnsw.efSearch = ef_search
+        rows.append(run(hnsw, "hnsw", f"efSearch={ef_search}", build_seconds))
+
+    if ntotal >= 1000:
+        start = time.perf_counter()
+        ivfpq, meta = build_index(vectors, "ivfpq")
+        build_seconds = time.perf_counter() - start
+        ivf = faiss.extract_index_ivf(ivfpq)
+        for nprobe in (1, 4, 16, 64):
+            if nprobe <= meta["params"]["nlist"]:
+                ivf.nprobe = nprobe
+                rows.append(run(ivfpq, "ivfpq", f"nprobe={nprobe}", build_seconds))
+    return rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="FAISS index utilities")
+    sub = parser.add_subparsers(dest="command", required=True)
+    measure = sub.add_parser("measure", help="Compare cold-start time and RSS across load modes")
+    measure.add_argument("--folder", default=VECTOR_STORE_DIR)
+    measure.add_argument("--index-name", default=FAISS_INDEX_NAME)
+    measure.add_argument("--queries", type=int, default=20)
+    measure.add_argument("--child", choices=["pickle", "read", "mmap"], help=argparse.SUPPRESS)
+    report = sub.add_parser("report", help="Recall@k vs latency of HNSW / IVF-PQ against flat search")
+    report.add_argument("--folder", default=VECTOR_STORE_DIR)
+    report.add_argument("--index-name", default=FAISS_INDEX_NAME)
+    report.add_argument("--synthetic", type=int, help="Use N synthetic vectors instead of the saved index")
+    report.add_argument("--dim", type=int, default=768)
+    report.add_argument("--k", type=int, default=10)
+    report.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    if args.command == "report":
+        if args.synthetic:
+            vectors = synthetic_vectors(args.synthetic, args.dim)
+        else:
+            vectors = flat_vectors(
+                load_index(None, args.folder, args.index_name, mmap=False),
+                vectors_path=index_paths(args.folder, args.index_name)["vectors"],
+            )
+        print(f"{len(vectors)} vectors x {vectors.shape[1]} dims, recall@{args.k} over {args.queries} queries")
+        for row in recall_report(vectors, args.k, args.queries):
+            print(f"{row['kind']:>6} {row['param']:<14} recall={row['recall_at_k']:.4f} "
+                  f"{row['ms_per_query']:.4f} ms/query  (build {row['build_seconds']}s)")
+    elif args.child:
+        _measure_child(args.folder, args.index_name, args.child, args.queries)
+    else:
+        for result in measure_cold_start(args.folder, args.index_name, args.queries):
+            print(
+                f"{result['mode']:>7}: load {result['load_seconds']:.4f}s, "
+                f"RSS +{result['rss_load_kb']} KB after load, +{result['rss_after_queries_kb']} KB after queries, "
+                f"{result['query_ms']:.3f} ms/query"
+            )
@@ -1,21 +1,25 @@
 import os
 import sys
-import shutil
-import pickle
 import json
+import uuid
+import hashlib
+import itertools
+from contextlib import closing
 from dotenv import load_dotenv
 
-# --- LangChain Imports ---
-from langchain_community.document_loaders import DirectoryLoader, TextLoader, PyPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain.storage import LocalFileStore, EncoderBackedStore
-from langchain.retrievers import ParentDocumentRetriever
-from langchain_core.documents import Document
-
 # --- Notion Import ---
-from notion_client import Client as NotionClient
+from notion_loader import load_notion_documents, NOTION_CURSOR_NAME
+from local_loader import LocalLoader
+from splitters import split_document, PARENT_CHUNK_SIZE, CHILD_CHUNK_SIZE, SPLITTER_VERSION, PARENT_INDEX_KEY
+from embedding_cache import CachedEmbeddings
+from providers import get_embeddings
+from embedding_pipeline import EmbeddingPipeline, EmbeddingError
+from docstore import PackedDocStore
+from snapshots import begin_snapshot, publish_snapshot, discard_snapshot, snapshot_dir, current_snapshot, DOCSTORE_NAME, MANIFEST_NAME, LEXICAL_INDEX_NAME
+from index_store import index_paths, new_index, load_index, save_index, make_mutable
+from lexical_index import build_from_vectorstore, update_from_vectorstore, load_lexical_index
+from jobs import NullProgress
+from tracing import span
 
 # --- Configuration ---
 env_path = os.path.join(os.path.dirname(__file__), '.env')
@@ -23,201 +27,309 @@ load_dotenv(env_path)
 
 DATA_DIR = "data"
 VECTOR_STORE_DIR = "vector_store"
-DOCSTORE_DIR = "docstore_data"
 FAISS_INDEX_NAME = "faiss_index"
 EMBEDDING_MODEL = "models/text-embedding-004"
+ID_KEY = "doc_id"  # Metadata key ParentDocumentRetriever uses to find the parent
+INGEST_WINDOW = int(os.getenv("INGEST_WINDOW", "2000"))  # child chunks embedded and indexed at a time
 
-# --- 1. Serializers (Must match Backend) ---
-def serialize_document(doc: Document) -> bytes:
-    return json.dumps({
-        "page_content": doc.page_content,
-        "metadata": doc.metadata,
-    }).encode("utf-8")
-
-def deserialize_document(data: bytes) -> Document:
-    obj = json.loads(data.decode("utf-8"))
-    return Document(
-        page_content=obj["page_content"],
-        metadata=obj["metadata"],
-    )
-
-# --- 2. Local Document Loading ---
-def load_local_documents(data_dir):
-    print(f"📂 Scanning '{data_dir}' for local files...")
-    documents = []
-    
-    if not os.path.exists(data_dir):
-        os.makedirs(data_dir)
-        return documents
+# --- 1. Incremental Manifest ---
+# The manifest remembers, per source, the hash of its content and the ids it
+# produced (parents in the docstore, children in FAISS), so a rebuild only
+# touches sources that were added, changed or removed.
+def manifest_settings():
+    return {
+        "embedding_model": EMBEDDING_MODEL,
+        "parent_chunk_size": PARENT_CHUNK_SIZE,
+        "child_chunk_size": CHILD_CHUNK_SIZE,
+        "splitter_version": SPLITTER_VERSION,
+    }
 
+def load_manifest(path):
+    if not os.path.exists(path):
+        return None
     try:
-        txt_loader = DirectoryLoader(data_dir, glob="**/*.txt", loader_cls=TextLoader)
-        documents.extend(txt_loader.load())
-    except Exception: pass
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Ignoring unreadable manifest: {e}")
+        return None
 
-    try:
-        pdf_loader = DirectoryLoader(data_dir, glob="**/*.pdf", loader_cls=PyPDFLoader)
-        documents.extend(pdf_loader.load())
-    except Exception: pass
-        
-    return documents
-
-# --- 3. Notion Logic (The "Greedy" Update) ---
-def extract_text_from_block(block):
+def save_manifest(manifest, path):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, path)
+
+def source_id(doc):
+    """Stable id of the source a document came from (file path or Notion page)."""
+    if doc.metadata.get("type") == "notion" and doc.metadata.get("page_id"):
+        return f"notion:{doc.metadata['page_id']}"
+    return doc.metadata.get("source", "unknown")
+
+def group_by_source(docs):
+    groups = {}
+    for doc in docs:
+        groups.setdefault(source_id(doc), []).append(doc)
+    return groups
+
+def hash_source(docs):
+    digest = hashlib.sha256()
+    for doc in docs:
+        digest.update(doc.page_content.encode("utf-8"))
+        digest.update(json.dumps(doc.metadata, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+def split_source(docs):
+    """Splits one source into parents and children, linked the way ParentDocumentRetriever expects."""
+    parents, parent_ids, children = [], [], []
+    for doc in docs:
+        for parent, parent_children in split_document(doc):
+            parent_id = str(uuid.uuid4())
+            for child in parent_children:
+                child.metadata[ID_KEY] = parent_id
+            # The docstore keeps no order; this lets readers put the source back together.
+            parent.metadata[PARENT_INDEX_KEY] = len(parents)
+            parents.append(parent)
+            parent_ids.append(parent_id)
+            children.extend(parent_children)
+    child_ids = [str(uuid.uuid4()) for _ in children]
+    return parents, parent_ids, children, child_ids
+
+# --- 2. Main Ingestion Logic ---
+def run_ingest(embeddings=None, vector_store_dir=VECTOR_STORE_DIR, progress=None, data_dir=DATA_DIR, include_notion=True):
     """
-    Extracts text from almost any block type (Paragraph, Code, Quote, etc).
+    Builds and publishes a new snapshot. Raises on failure (and IngestCancelled
+    when `progress` requests cancellation); `progress.report(stage, done, total)`
+    is called as the load, split, embed and persist stages advance.
     """
-    block_type = block.get("type")
-    content = ""
-    
-    # 1. Standard Text Blocks (Paragraphs, Headings, Lists, Toggles, Quotes, Callouts)
-    if block_type in [
-        "paragraph", "heading_1", "heading_2", "heading_3", 
-        "bulleted_list_item", "numbered_list_item", "to_do", 
-        "toggle", "quote", "callout"
-    ]:
-        rich_text = block.get(block_type, {}).get("rich_text", [])
-        text = "".join([t.get("plain_text", "") for t in rich_text])
-        if text:
-            content = text + "\n"
-
-    # 2. Code Blocks (Crucial for your use case)
-    elif block_type == "code":
-        rich_text = block.get("code", {}).get("rich_text", [])
-        code = "".join([t.get("plain_text", "") for t in rich_text])
-        if code:
-            content = f"\n```\n{code}\n```\n"
-
-    return content
-
-def fetch_page_content(client, page_id):
-    """Recursively fetches blocks from a page to build text content."""
-    content_parts = []
-    has_more = True
-    start_cursor = None
-
-    while has_more:
-        try:
-            response = client.blocks.children.list(block_id=page_id, start_cursor=start_cursor)
-            blocks = response.get("results", [])
-            
-            for block in blocks:
-                text = extract_text_from_block(block)
-                if text:
-                    content_parts.append(text)
-            
-            has_more = response.get("has_more")
-            start_cursor = response.get("next_cursor")
-        except Exception as e:
-            print(f"   ⚠️ Error fetching blocks for page {page_id}: {e}")
-            has_more = False
-        
-    return "\n".join(content_parts)
-
-def load_notion_documents():
-    token = os.getenv("NOTION_TOKEN")
-    root_page_id = os.getenv("NOTION_PAGE_ID")
-
-    if not token or not root_page_id:
-        print("⚠️ Skipped Notion: Missing credentials in .env")
-        return []
-
-    print(f"🔍 Scanning Notion from Root ID: {root_page_id}...")
-    client = NotionClient(auth=token)
-    docs = []
-    
-    # Queue: [ID, Title]
-    pages_to_visit = [(root_page_id, "Root Page")]
-    visited_pages = set()
-
-    while pages_to_visit:
-        current_id, current_title = pages_to_visit.pop(0)
-        
-        if current_id in visited_pages: continue
-        visited_pages.add(current_id)
-
-        try:
-            # A. Fetch Page Title
-            page_obj = client.pages.retrieve(page_id=current_id)
-            title = current_title
-            props = page_obj.get("properties", {})
-            for p in props.values():
-                if p["type"] == "title" and p.get("title"):
-                    title = "".join([t.get("plain_text", "") for t in p.get("title")])
-            
-            print(f"   -> Processing: {title}")
-
-            # B. Fetch ALL Content (including Code Blocks now)
-            page_text = fetch_page_content(client, current_id)
-            
-            if page_text.strip():
-                docs.append(Document(page_content=page_text, metadata={"source": title, "type": "notion"}))
-
-            # C. Find Child Pages (Recursion)
-            has_more = True
-            cursor = None
-            while has_more:
-                children = client.blocks.children.list(block_id=current_id, start_cursor=cursor)
-                for block in children["results"]:
-                    if block["type"] == "child_page":
-                        child_id = block["id"]
-                        child_title = block.get("child_page", {}).get("title", "Untitled")
-                        pages_to_visit.append((child_id, child_title))
-                has_more = children.get("has_more")
-                cursor = children.get("next_cursor")
-
-        except Exception as e:
-            print(f"   ❌ Error processing page {current_id}: {e}")
-
-    print(f"✅ Loaded {len(docs)} Notion pages.")
-    return docs
-
-# --- 4. Main Ingestion Logic ---
-def ingest_documents():
-    local_docs = load_local_documents(DATA_DIR)
-    notion_docs = load_notion_documents()
-    all_docs = local_docs + notion_docs
+    with span("ingest", data_dir=data_dir) as s:
+        report = _run_ingest(embeddings, vector_store_dir, progress or NullProgress(), data_dir, include_notion)
+        s.set(**(report or {}))
+    return report
+
+def _run_ingest(embeddings, vector_store_dir, progress, data_dir, include_notion):
+    # Local files are only listed here; they are read on the loader's worker
+    # pool while the sources are split and embedded below.
+    progress.report("load", 0, 2, "Scanning local files")
+    loader = LocalLoader(data_dir)
+    with span("scan_local", data_dir=data_dir) as s:
+        files = loader.scan()
+        s.set(files=len(files), skipped=loader.skipped)
+    progress.report("load", 1, 2, "Syncing Notion")
+    with span("load_notion", enabled=include_notion) as s:
+        # The cursor belongs to this store, so a scratch index never advances the real one.
+        cursor_path = os.path.join(vector_store_dir, NOTION_CURSOR_NAME)
+        notion_docs = load_notion_documents(cursor_path=cursor_path) if include_notion else []
+        s.set(documents=len(notion_docs))
+    progress.report("load", 2, 2, f"{len(files)} files, {len(notion_docs)} Notion pages")
+    progress.check_cancelled()
     
-    if not all_docs:
+    if not files and not notion_docs:
         print("❌ No documents found.")
         return
 
-    print(f"📦 Total Documents: {len(all_docs)}")
+    print(f"📦 Total Sources: {len(files)} files, {len(notion_docs)} Notion pages")
 
-    if "GOOGLE_API_KEY" not in os.environ:
-        print("❌ Error: GOOGLE_API_KEY missing.")
-        return
-    embeddings = GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL)
-
-    # Clean previous store
-    if os.path.exists(DOCSTORE_DIR):
-        shutil.rmtree(DOCSTORE_DIR)
-    os.makedirs(DOCSTORE_DIR)
-
-    fs_store = LocalFileStore(DOCSTORE_DIR)
-    store = EncoderBackedStore(
-        store=fs_store,
-        key_encoder=lambda k: str(k),
-        value_serializer=serialize_document,
-        value_deserializer=deserialize_document,
-    )
+    if embeddings is None:
+        if "GOOGLE_API_KEY" not in os.environ:
+            raise RuntimeError("GOOGLE_API_KEY missing.")
+        embeddings = get_embeddings("gemini", EMBEDDING_MODEL)
+    embeddings = CachedEmbeddings(embeddings, EMBEDDING_MODEL, path=os.path.join(vector_store_dir, "embedding_cache.db"))
+    pipeline = EmbeddingPipeline(embeddings)
 
-    vectorstore = FAISS.from_texts(["init"], embeddings)
-    
-    retriever = ParentDocumentRetriever(
-        vectorstore=vectorstore,
-        docstore=store,
-        child_splitter=RecursiveCharacterTextSplitter(chunk_size=400),
-        parent_splitter=RecursiveCharacterTextSplitter(chunk_size=2000),
+    # Changes are worked out against the published snapshot, read-only. The
+    # build snapshot (seeded from it) is only created once something changed,
+    # so an ingest with nothing to do copies nothing.
+    current = current_snapshot(vector_store_dir)
+    current_dir = snapshot_dir(current, vector_store_dir) if current else None
+    manifest = load_manifest(os.path.join(current_dir, MANIFEST_NAME)) if current else None
+    paths = index_paths(current_dir, FAISS_INDEX_NAME) if current else None
+    full_rebuild = (
+        manifest is None
+        or manifest.get("settings") != manifest_settings()
+        or not os.path.exists(paths["index"])
+        or not os.path.exists(paths["ids"])
     )
+    if full_rebuild:
+        print("🧹 No usable manifest found, rebuilding from scratch...")
+        manifest = {"settings": manifest_settings(), "sources": {}}
+
+    snapshot = build_dir = store = vectorstore = None
+    published = False
+
+    def open_build():
+        # Readers keep using the published snapshot until this one is complete.
+        nonlocal snapshot, build_dir, store, vectorstore
+        if snapshot is not None:
+            return
+        snapshot = begin_snapshot(vector_store_dir, base=current, seed=not full_rebuild)
+        build_dir = snapshot_dir(snapshot, vector_store_dir)
+        print(f"📸 Building snapshot {snapshot}")
+        store = PackedDocStore(os.path.join(build_dir, DOCSTORE_NAME))
+        if not full_rebuild:
+            vectorstore = make_mutable(
+                load_index(embeddings, build_dir, FAISS_INDEX_NAME, mmap=False), embeddings, build_dir, FAISS_INDEX_NAME
+            )
+
+    try:
+        old_sources = manifest["sources"]
+        new_sources = {}
+        report = {"unchanged": 0, "updated": 0, "added": 0, "removed": 0, "failed": 0}
+        stale_parent_ids, stale_child_ids, added_child_ids = [], [], []
+        # Chunks of changed sources collect here until a window is full and are
+        # then embedded and indexed, so memory holds one window, not the corpus.
+        window_parents, window_children, window_child_ids = [], [], []
+        counts = {"parents": 0, "children": 0, "embedded": 0}
+
+        def on_batch(done, total):
+            progress.report("embed", counts["embedded"] + done, counts["children"])
+            progress.check_cancelled()
+
+        def flush_window():
+            nonlocal vectorstore
+            if window_parents:
+                store.mset(window_parents)
+            if window_children:
+                print(f"🧮 Embedding {len(window_children)} chunks...")
+                with span("embed", chunks=len(window_children)) as s:
+                    vectors = pipeline.embed([child.page_content for child in window_children], on_batch=on_batch)
+                    s.set(batches=pipeline.stats["batches"], retries=pipeline.stats["retries"])
+                text_embeddings = [(child.page_content, vector) for child, vector in zip(window_children, vectors)]
+                metadatas = [child.metadata for child in window_children]
+                if vectorstore is None:
+                    vectorstore = new_index(embeddings, len(vectors[0]), build_dir, FAISS_INDEX_NAME)
+                vectorstore.add_embeddings(text_embeddings, metadatas=metadatas, ids=list(window_child_ids))
+                counts["embedded"] += len(window_children)
+            window_parents.clear()
+            window_children.clear()
+            window_child_ids.clear()
+
+        print("⏳ Processing documents...")
+        # Each file's documents arrive together, so grouping consecutive
+        # documents by source yields one group per file or Notion page.
+        total_sources = len(files) + len(notion_docs)
+        with span("process_sources", sources=total_sources) as process_span, closing(loader.load()) as local_docs:
+            sources = itertools.groupby(itertools.chain(local_docs, notion_docs), key=source_id)
+            for done, (sid, docs) in enumerate(sources, 1):
+                docs = list(docs)
+                progress.report("split", done, max(done, total_sources), sid)
+                progress.check_cancelled()
+                content_hash = hash_source(docs)
+                previous = old_sources.get(sid)
+                if previous and previous["hash"] == content_hash:
+                    new_sources[sid] = previous
+                    report["unchanged"] += 1
+                    continue
+
+                open_build()
+                if previous:
+                    stale_parent_ids.extend(previous["parent_ids"])
+                    stale_child_ids.extend(previous["child_ids"])
+                    report["updated"] += 1
+                else:
+                    report["added"] += 1
+
+                parents, parent_ids, children, child_ids = split_source(docs)
+                window_parents.extend(zip(parent_ids, parents))
+                window_children.extend(children)
+                window_child_ids.extend(child_ids)
+                counts["parents"] += len(parents)
+                counts["children"] += len(children)
+                new_sources[sid] = {"hash": content_hash, "parent_ids": parent_ids, "child_ids": child_ids}
+                added_child_ids.extend(child_ids)
+                if len(window_children) >= INGEST_WINDOW:
+                    flush_window()
+            flush_window()
+            process_span.set(parents=counts["parents"], children=counts["children"], failed=len(loader.failures))
+        progress.report("split", total_sources, total_sources)
+        progress.report("embed", counts["embedded"], counts["children"])
+        if counts["embedded"]:
+            stats = pipeline.stats
+            print(f"   {stats['batches']} batches, {stats['retries']} retries, {stats['chunks_per_sec']} chunks/sec")
+
+        failed = {path for path, _ in loader.failures}
+        report["failed"] = len(failed)
+        for sid, previous in old_sources.items():
+            if sid in new_sources:
+                continue
+            if sid in failed:
+                # Keep what was indexed last time rather than dropping a file that
+                # merely failed to load this time.
+                new_sources[sid] = previous
+                continue
+            stale_parent_ids.extend(previous["parent_ids"])
+            stale_child_ids.extend(previous["child_ids"])
+            report["removed"] += 1
+        progress.check_cancelled()
+
+        # Past this point the build runs to completion: a half-persisted
+        # snapshot would be thrown away anyway, so cancelling gains nothing.
+        progress.report("persist", 0, 4, "Checking for changes")
+
+        if snapshot is None and not full_rebuild and not report["removed"] and os.path.exists(os.path.join(current_dir, LEXICAL_INDEX_NAME)):
+            progress.report("persist", 4, 4, "Already up to date")
+            print(f"✅ Knowledge base already up to date ({report['unchanged']} sources unchanged).")
+            return report
+        open_build()
+
+        if vectorstore is None:
+            raise RuntimeError("Documents produced no chunks to index.")
+
+        lexical_path = os.path.join(build_dir, LEXICAL_INDEX_NAME)
+
+        known_ids = set(vectorstore.index_to_docstore_id.values())
+        stale_child_ids = [i for i in stale_child_ids if i in known_ids]
+        if stale_child_ids:
+            vectorstore.delete(stale_child_ids)
+        progress.report("persist", 1, 4, "Writing index")
+        with span("save_index", vectors=vectorstore.index.ntotal):
+            save_index(vectorstore, build_dir, FAISS_INDEX_NAME, embeddings=embeddings)
+        if stale_parent_ids:
+            store.mdelete(stale_parent_ids)
+
+        progress.report("persist", 2, 4, "Building lexical index")
+        with span("build_lexical_index") as s:
+            # Only the changed chunks are tokenized; a missing or out-of-step index is rebuilt from every chunk.
+            lexical = None if full_rebuild else load_lexical_index(lexical_path)
+            if lexical is not None:
+                lexical = update_from_vectorstore(lexical, vectorstore, stale_child_ids, added_child_ids)
+            incremental = lexical is not None and len(lexical) == vectorstore.index.ntotal
+            if not incremental:
+                lexical = build_from_vectorstore(vectorstore)
+            s.set(incremental=incremental, added=len(added_child_ids), removed=len(stale_child_ids))
+            lexical.save(lexical_path)
+
+        progress.report("persist", 3, 4, "Publishing snapshot")
+        manifest["sources"] = new_sources
+        save_manifest(manifest, os.path.join(build_dir, MANIFEST_NAME))
+        publish_snapshot(snapshot, vector_store_dir)
+        published = True
+        progress.report("persist", 4, 4, f"Published {snapshot}")
+        cache_stats = embeddings.stats()
+        print(f"🧠 Embedding cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
+        print(
+            f"✅ Ingestion Complete! snapshot={snapshot} unchanged={report['unchanged']} updated={report['updated']} "
+            f"added={report['added']} removed={report['removed']} failed={report['failed']}"
+        )
+        return report
+    finally:
+        if snapshot is not None and not published:
+            discard_snapshot(snapshot, vector_store_dir)
 
-    print("⏳ Processing documents...")
+def ingest_documents(embeddings=None, vector_store_dir=VECTOR_STORE_DIR, data_dir=DATA_DIR, include_notion=True):
+    """Runs the ingest in the foreground, printing failures instead of raising."""
     try:
-        retriever.add_documents(all_docs, ids=None)
-        vectorstore.save_local(VECTOR_STORE_DIR, FAISS_INDEX_NAME)
-        print("✅ Ingestion Complete!")
+        return run_ingest(embeddings, vector_store_dir, data_dir=data_dir, include_notion=include_notion)
+    except EmbeddingError as e:
+        print(f"❌ Embedding failed: {e}")
+        print("   Finished batches are cached; re-run the ingest to resume from there.")
     except Exception as e:
         print(f"❌ Error: {e}")
 
 if __name__ == "__main__":
-    ingest_documents()
\ No newline at end of file
+    if "--fake-embeddings" in sys.argv:
+        # Deterministic offline embeddings, for testing the pipeline without an API key.
+        from langchain_core.embeddings import DeterministicFakeEmbedding
+        ingest_documents(DeterministicFakeEmbedding(size=768))
+    else:
+        ingest_documents()
\ No newline at end of file
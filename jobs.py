@@ -0,0 +1,122 @@
+import time
+import uuid
+import threading
+from dataclasses import dataclass, field, asdict
+from concurrent.futures import ThreadPoolExecutor
+
+INGEST_STAGES = ["load", "split", "embed", "persist"]
+
+class IngestCancelled(Exception):
+    """Raised inside a job once cancellation has been requested."""
+
+@dataclass
+class ProgressEvent:
+    stage: str
+    done: int
+    total: int
+    rate: float = 0.0  # items/second since the stage started
+    eta: float = None  # seconds, when it can be estimated
+    message: str = ""
+    time: float = field(default_factory=time.time)
+
+class NullProgress:
+    """Progress sink for runs outside the job runner (CLI, scripts)."""
+
+    def report(self, stage, done, total, message=""):
+        pass
+
+    def check_cancelled(self):
+        pass
+
+class IngestJob:
+    """
+    One background ingest run. The worker reports progress through `report`
+    and polls `check_cancelled`; the UI reads `status()` from another thread.
+    """
+
+    def __init__(self, max_events=200):
+        self.id = uuid.uuid4().hex[:8]
+        self.state = "queued"  # queued | running | succeeded | failed | cancelled
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self.stages = {}
+        self.events = []
+        self.max_events = max_events
+        self._stage_started = {}
+        self._cancel = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self.state in ("queued", "running")
+
+    def report(self, stage, done, total, message=""):
+        now = time.time()
+        with self._lock:
+            started = self._stage_started.setdefault(stage, now)
+            elapsed = now - started
+            rate = done / elapsed if elapsed > 0 and done else 0.0
+            eta = (total - done) / rate if rate and total else None
+            event = ProgressEvent(stage, done, total, round(rate, 2), None if eta is None else round(eta, 1), message, now)
+            self.stages[stage] = event
+            self.events.append(event)
+            del self.events[:-self.max_events]
+
+    def cancel(self):
+        self._cancel.set()
+
+    def check_cancelled(self):
+        if self._cancel.is_set():
+            raise IngestCancelled()
+
+    def status(self):
+        with self._lock:
+            return {
+                "id": self.id,
+                "state": self.state,
+                "cancel_requested": self._cancel.is_set(),
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "result": self.result,
+                "error": self.error,
+                "stages": {name: asdict(event) for name, event in self.stages.items()},
+            }
+
+    def run(self, fn, *args, **kwargs):
+        self.state = "running"
+        self.started_at = time.time()
+        try:
+            self.result = fn(*args, progress=self, **kwargs)
+            self.state = "succeeded"
+        except IngestCancelled:
+            self.state = "cancelled"
+        except Exception as e:
+            self.error = str(e)
+            self.state = "failed"
+        finally:
+            self.finished_at = time.time()
+        return self.result
+
+class JobRunner:
+    """
+    Runs ingest jobs one at a time on a background thread. Submitting while a
+    job is queued or running returns that job instead of starting another, so
+    concurrent rebuild clicks collapse into one run.
+    """
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest")
+        self._lock = threading.Lock()
+        self.current = None
+
+    def submit(self, fn, *args, **kwargs):
+        """Returns (job, started) where started is False when an existing job was reused."""
+        with self._lock:
+            if self.current is not None and self.current.running:
+                return self.current, False
+            job = IngestJob()
+            self.current = job
+            self._executor.submit(job.run, fn, *args, **kwargs)
+            return job, True
@@ -0,0 +1,257 @@
+import os
+import re
+import uuid
+from collections import Counter
+from typing import Any
+
+import numpy as np
+from langchain_core.retrievers import BaseRetriever
+
+from tracing import span
+
+# --- Configuration ---
+BM25_K1 = 1.2
+BM25_B = 0.75
+HYBRID_FETCH_K = int(os.getenv("HYBRID_FETCH_K", "20"))  # candidates taken from each retriever
+HYBRID_TOP_K = int(os.getenv("HYBRID_TOP_K", "6"))  # fused child chunks mapped to parents
+RRF_K = 60
+ID_KEY = "doc_id"
+
+# --- 1. Tokenizer ---
+# Identifiers are kept whole (so `/api/v1/users`, `user_id` or `DATABASE_URL`
+# match exactly) and also split into their word parts for partial matches.
+IDENTIFIER_PATTERN = re.compile(r"[A-Za-z0-9_][A-Za-z0-9_./:{}-]*[A-Za-z0-9_}]|[A-Za-z0-9]")
+PART_PATTERN = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+")
+
+def tokenize(text):
+    tokens = []
+    for identifier in IDENTIFIER_PATTERN.findall(text):
+        parts = [part.lower() for part in PART_PATTERN.findall(identifier)]
+        if len(parts) != 1:
+            tokens.append(identifier.lower())
+        tokens.extend(parts)
+    return tokens
+
+# --- 2. BM25 Index ---
+class LexicalIndex:
+    """
+    BM25 over the child chunks, stored as a term -> postings CSR matrix
+    (numpy arrays), so a query touches only the postings of its own terms.
+    Rows are child chunks; `parent_ids` maps each to its parent document.
+    """
+
+    def __init__(self, ids, parent_ids, vocabulary, indptr, postings, frequencies, lengths):
+        self.ids = list(ids)
+        self.parent_ids = list(parent_ids)
+        self.term_ids = {term: i for i, term in enumerate(vocabulary)}
+        self.indptr = indptr
+        self.postings = postings
+        self.frequencies = frequencies
+        self.lengths = lengths
+        self.rows = {child_id: row for row, child_id in enumerate(self.ids)}
+
+        n_docs = len(self.ids)
+        doc_freq = np.diff(indptr).astype("float32")
+        self.idf = np.log1p((n_docs - doc_freq + 0.5) / (doc_freq + 0.5)).astype("float32")
+        avg_length = float(lengths.mean()) if n_docs else 1.0
+        self.norm = (BM25_K1 * (1 - BM25_B + BM25_B * lengths / max(avg_length, 1.0))).astype("float32")
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, ids, parent_ids, texts):
+        vocabulary = {}
+        term_column, doc_column, counts = [], [], []
+        lengths = np.zeros(len(ids), dtype="float32")
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths[row] = len(tokens)
+            for term, count in Counter(tokens).items():
+                term_column.append(vocabulary.setdefault(term, len(vocabulary)))
+                doc_column.append(row)
+                counts.append(count)
+
+        term_column = np.asarray(term_column, dtype="int64")
+        order = np.argsort(term_column, kind="stable")
+        indptr = np.zeros(len(vocabulary) + 1, dtype="int64")
+        np.cumsum(np.bincount(term_column, minlength=len(vocabulary)), out=indptr[1:])
+        return cls(
+            ids, parent_ids, list(vocabulary), indptr,
+            np.asarray(doc_column, dtype="int32")[order],
+            np.asarray(counts, dtype="float32")[order],
+            lengths,
+        )
+
+    def update(self, removed_ids, ids, parent_ids, texts):
+        """
+        A copy without the rows of `removed_ids` and with the given chunks
+        appended. Only the new texts are tokenized; existing postings are
+        filtered and renumbered as arrays.
+        """
+        removed = set(removed_ids)
+        keep = np.array([child_id not in removed for child_id in self.ids], dtype=bool)
+        added = LexicalIndex.build(ids, parent_ids, texts)
+
+        # Postings as (term, row, frequency) triples; kept rows are renumbered
+        # and the new rows follow them.
+        vocabulary = sorted(self.term_ids, key=self.term_ids.get)
+        term_ids = dict(self.term_ids)
+        for term in sorted(added.term_ids, key=added.term_ids.get):
+            if term not in term_ids:
+                term_ids[term] = len(vocabulary)
+                vocabulary.append(term)
+        added_terms = np.array([term_ids[term] for term in sorted(added.term_ids, key=added.term_ids.get)], dtype="int64")
+        old_terms = np.repeat(np.arange(len(self.term_ids), dtype="int64"), np.diff(self.indptr))
+        kept = keep[self.postings]
+        terms = np.concatenate([old_terms[kept], added_terms[np.repeat(np.arange(len(added_terms)), np.diff(added.indptr))]])
+        rows = np.concatenate([(np.cumsum(keep) - 1)[self.postings[kept]], added.postings + int(keep.sum())])
+        frequencies = np.concatenate([self.frequencies[kept], added.frequencies])
+
+        # Terms whose every chunk was removed are dropped from the vocabulary.
+        counts = np.bincount(terms, minlength=len(vocabulary))
+        used = counts > 0
+        terms = (np.cumsum(used) - 1)[terms]
+        order = np.argsort(terms, kind="stable")
+        indptr = np.zeros(int(used.sum()) + 1, dtype="int64")
+        np.cumsum(counts[used], out=indptr[1:])
+        return LexicalIndex(
+            [child_id for child_id, k in zip(self.ids, keep) if k] + list(ids),
+            [parent_id for parent_id, k in zip(self.parent_ids, keep) if k] + list(parent_ids),
+            [term for term, u in zip(vocabulary, used) if u], indptr,
+            rows[order].astype("int32"), frequencies[order].astype("float32"),
+            np.concatenate([self.lengths[keep], added.lengths]),
+        )
+
+    def search(self, query, k=HYBRID_FETCH_K):
+        """Returns [(row, score)] for the top k rows, best first."""
+        term_ids = {self.term_ids[term] for term in tokenize(query) if term in self.term_ids}
+        if not term_ids:
+            return []
+        scores = np.zeros(len(self.ids), dtype="float32")
+        for term_id in term_ids:
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            rows = self.postings[start:end]
+            tf = self.frequencies[start:end]
+            scores[rows] += self.idf[term_id] * tf * (BM25_K1 + 1) / (tf + self.norm[rows])
+
+        candidates = np.flatnonzero(scores)
+        k = min(k, len(candidates))
+        if k == 0:
+            return []
+        top = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        top = top[np.argsort(-scores[top])]
+        return [(int(row), float(scores[row])) for row in top]
+
+    def save(self, path):
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        vocabulary = sorted(self.term_ids, key=self.term_ids.get)
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                ids=np.array(self.ids, dtype=str),
+                parent_ids=np.array(self.parent_ids, dtype=str),
+                vocabulary=np.array(vocabulary, dtype=str),
+                indptr=self.indptr,
+                postings=self.postings,
+                frequencies=self.frequencies,
+                lengths=self.lengths,
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(
+                data["ids"].tolist(), data["parent_ids"].tolist(), data["vocabulary"].tolist(),
+                data["indptr"], data["postings"], data["frequencies"], data["lengths"],
+            )
+
+def _child_texts(vectorstore, ids, batch_size):
+    parent_ids, texts = [], []
+    for start in range(0, len(ids), batch_size):
+        for doc in vectorstore.docstore.mget(ids[start:start + batch_size]):
+            parent_ids.append(doc.metadata.get(ID_KEY, "") if doc else "")
+            texts.append(doc.page_content if doc else "")
+    return parent_ids, texts
+
+def build_from_vectorstore(vectorstore, batch_size=5000):
+    """Indexes every child chunk of a FAISS store (after `save_index` has flushed it)."""
+    ids = [vectorstore.index_to_docstore_id[i] for i in range(len(vectorstore.index_to_docstore_id))]
+    return LexicalIndex.build(ids, *_child_texts(vectorstore, ids, batch_size))
+
+def update_from_vectorstore(index, vectorstore, removed_ids, added_ids, batch_size=5000):
+    """`index` brought in line with a FAISS store that lost `removed_ids` and gained `added_ids`."""
+    added_ids = list(added_ids)
+    return index.update(removed_ids, added_ids, *_child_texts(vectorstore, added_ids, batch_size))
+
+def load_lexical_index(path):
+    """The saved index, or None for snapshots built before lexical indexing existed."""
+    if not os.path.exists(path):
+        return None
+    try:
+        return LexicalIndex.load(path)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"⚠️ Ignoring unreadable lexical index: {e}")
+        return None
+
+# --- 3. Hybrid Retriever ---
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """Fuses ranked id lists; an id's score is the sum of 1 / (k + rank) over the lists it appears in."""
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+class HybridRetriever(BaseRetriever):
+    """
+    Drop-in replacement for ParentDocumentRetriever: child chunks are ranked by
+    FAISS and BM25 separately, fused with reciprocal rank fusion, and the top
+    chunks are resolved to their parent documents.
+    """
+
+    vectorstore: Any
+    docstore: Any
+    lexical_index: Any
+    fetch_k: int = HYBRID_FETCH_K
+    top_k: int = HYBRID_TOP_K
+
+    def dense_child_ids(self, query, embedding=None):
+        if embedding is None:
+            with span("embed_query"):
+                embedding = self.vectorstore.embedding_function.embed_query(query)
+        vector = np.array([embedding], dtype="float32")
+        with span("faiss_search", k=self.fetch_k) as s:
+            _, positions = self.vectorstore.index.search(vector, self.fetch_k)
+            ids = [self.vectorstore.index_to_docstore_id[int(i)] for i in positions[0] if i >= 0]
+            s.set(hits=len(ids))
+        return ids
+
+    def lexical_child_ids(self, query):
+        with span("bm25_search", k=self.fetch_k) as s:
+            ids = [self.lexical_index.ids[row] for row, _ in self.lexical_index.search(query, self.fetch_k)]
+            s.set(hits=len(ids))
+        return ids
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        return self.parents(query, self.dense_child_ids(query))
+
+    async def _aget_relevant_documents(self, query, *, run_manager=None):
+        # Only the query embedding leaves the process; the searches are local and fast.
+        with span("embed_query"):
+            embedding = await self.vectorstore.embedding_function.aembed_query(query)
+        return self.parents(query, self.dense_child_ids(query, embedding))
+
+    def parents(self, query, dense_ids):
+        fused = reciprocal_rank_fusion([dense_ids, self.lexical_child_ids(query)])
+        parent_ids = []
+        for child_id in fused[:self.top_k]:
+            row = self.lexical_index.rows.get(child_id)
+            parent_id = self.lexical_index.parent_ids[row] if row is not None else None
+            if parent_id and parent_id not in parent_ids:
+                parent_ids.append(parent_id)
+        with span("docstore_mget", requested=len(parent_ids)) as s:
+            docs = [doc for doc in self.docstore.mget(parent_ids) if doc is not None]
+            s.set(hits=len(docs))
+        return docs
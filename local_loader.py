@@ -0,0 +1,137 @@
+import os
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from langchain_core.documents import Document
+from pypdf import PdfReader
+
+# --- Configuration ---
+LOADER_WORKERS = int(os.getenv("LOADER_WORKERS", str(min(8, (os.cpu_count() or 1) + 4))))
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(os.cpu_count() or 1)))
+PDF_PARALLEL_MIN_PAGES = 16  # smaller PDFs are parsed in the loader thread
+PDF_PAGES_PER_TASK = 8
+
+# Supported extensions and the format recorded as `file_type` metadata.
+FILE_TYPES = {
+    ".md": "markdown",
+    ".markdown": "markdown",
+    ".yaml": "yaml",
+    ".yml": "yaml",
+    ".json": "json",
+    ".py": "python",
+    ".txt": "text",
+    ".pdf": "pdf",
+}
+
+# --- 1. Per-Format Loaders ---
+def read_text(path):
+    with open(path, "rb") as f:
+        raw = f.read()
+    try:
+        return raw.decode("utf-8")
+    except UnicodeDecodeError:
+        return raw.decode("latin-1")
+
+def extract_pdf_pages(path, start, stop):
+    """Text of pages [start, stop); module-level so the process pool can pickle it."""
+    reader = PdfReader(path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+# --- 2. Directory Loader ---
+class LocalLoader:
+    """
+    Walks `data_dir` once and loads every supported file on a thread pool,
+    yielding Documents in walk order (all of a file's documents together).
+    At most `2 * workers` files are loaded ahead of the consumer, so memory
+    stays bounded on large corpora. PDFs with many pages are split across a
+    process pool. Files that fail to load are skipped and recorded in
+    `failures` as (path, error).
+    """
+
+    def __init__(self, data_dir, workers=LOADER_WORKERS, pdf_workers=PDF_WORKERS):
+        self.data_dir = data_dir
+        self.workers = max(1, workers)
+        self.pdf_workers = pdf_workers
+        self.paths = None
+        self.skipped = 0
+        self.failures = []
+        self._pdf_pool = None
+        self._lock = threading.Lock()
+
+    def scan(self):
+        """Supported files under `data_dir` in a stable order (the walk happens once)."""
+        if self.paths is None:
+            self.paths = []
+            if not os.path.exists(self.data_dir):
+                os.makedirs(self.data_dir)
+            for root, dirs, names in os.walk(self.data_dir):
+                dirs.sort()
+                for name in sorted(names):
+                    if os.path.splitext(name)[1].lower() in FILE_TYPES:
+                        self.paths.append(os.path.join(root, name))
+                    else:
+                        self.skipped += 1
+        return self.paths
+
+    def load_file(self, path):
+        file_type = FILE_TYPES[os.path.splitext(path)[1].lower()]
+        if file_type == "pdf":
+            return self.load_pdf(path)
+        return [Document(page_content=read_text(path), metadata={"source": path, "file_type": file_type})]
+
+    def load_pdf(self, path):
+        page_count = len(PdfReader(path).pages)
+        if page_count < PDF_PARALLEL_MIN_PAGES or self.pdf_workers <= 1:
+            texts = extract_pdf_pages(path, 0, page_count)
+        else:
+            pool = self._process_pool()
+            futures = [
+                pool.submit(extract_pdf_pages, path, start, min(start + PDF_PAGES_PER_TASK, page_count))
+                for start in range(0, page_count, PDF_PAGES_PER_TASK)
+            ]
+            texts = [text for future in futures for text in future.result()]
+        return [
+            Document(page_content=text, metadata={"source": path, "page": page, "file_type": "pdf"})
+            for page, text in enumerate(texts)
+        ]
+
+    def _process_pool(self):
+        with self._lock:
+            if self._pdf_pool is None:
+                # spawn, not fork: forking a process that has threads running is unsafe.
+                self._pdf_pool = ProcessPoolExecutor(
+                    max_workers=self.pdf_workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._pdf_pool
+
+    def _result(self, path, future):
+        try:
+            return future.result()
+        except Exception as e:
+            self.failures.append((path, f"{type(e).__name__}: {e}"))
+            print(f"⚠️ Could not load '{path}': {e}")
+            return []
+
+    def load(self):
+        paths = self.scan()
+        print(f"📂 Loading {len(paths)} local files from '{self.data_dir}'...")
+        pending = deque()
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="loader") as pool:
+                try:
+                    for path in paths:
+                        pending.append((path, pool.submit(self.load_file, path)))
+                        if len(pending) >= 2 * self.workers:
+                            yield from self._result(*pending.popleft())
+                    while pending:
+                        yield from self._result(*pending.popleft())
+                finally:
+                    # Closed early: don't start files nobody will read.
+                    for _, future in pending:
+                        future.cancel()
+        finally:
+            if self._pdf_pool is not None:
+                self._pdf_pool.shutdown(cancel_futures=True)
+                self._pdf_pool = None
@@ -0,0 +1,454 @@
+import os
+import json
+import time
+import threading
+from datetime import datetime, timedelta, timezone
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from langchain_core.documents import Document
+from notion_client import Client as NotionClient
+
+# --- Configuration ---
+# Notion allows an average of 3 requests/second per integration (bursts are tolerated).
+NOTION_REQUESTS_PER_SECOND = float(os.getenv("NOTION_REQUESTS_PER_SECOND", "3"))
+NOTION_MAX_WORKERS = int(os.getenv("NOTION_MAX_WORKERS", "4"))
+NOTION_MAX_RETRIES = 3
+# Parallel child-block listings per page when descending into nested blocks.
+NOTION_BLOCK_CONCURRENCY = int(os.getenv("NOTION_BLOCK_CONCURRENCY", "4"))
+# Per-page last_edited_time cursor (plus cached text) from the previous sync,
+# kept in the vector store it was ingested into.
+NOTION_CURSOR_NAME = "notion_cursor.json"
+NOTION_CURSOR_PATH = os.path.join("vector_store", NOTION_CURSOR_NAME)
+
+# --- 1. Rate Limiting ---
+class RateLimiter:
+    """Thread-safe token bucket: `rate` requests/second with a small burst allowance."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_for = (1 - self.tokens) / self.rate
+            time.sleep(wait_for)
+
+# --- 2. Block Text Extraction ---
+# Blocks whose children are separate pages, crawled on their own.
+PAGE_BLOCK_TYPES = {"child_page", "child_database"}
+
+def extract_text_from_block(block):
+    """
+    Extracts text from almost any block type (Paragraph, Code, Quote, etc).
+    Container blocks (columns, tables, synced blocks) carry no text themselves;
+    their content comes from their children.
+    """
+    block_type = block.get("type")
+    content = ""
+
+    # 1. Standard Text Blocks (Paragraphs, Headings, Lists, Toggles, Quotes, Callouts)
+    if block_type in [
+        "paragraph", "heading_1", "heading_2", "heading_3",
+        "bulleted_list_item", "numbered_list_item", "to_do",
+        "toggle", "quote", "callout"
+    ]:
+        rich_text = block.get(block_type, {}).get("rich_text", [])
+        text = "".join([t.get("plain_text", "") for t in rich_text])
+        if text:
+            content = text + "\n"
+
+    # 2. Code Blocks (Crucial for your use case)
+    elif block_type == "code":
+        rich_text = block.get("code", {}).get("rich_text", [])
+        code = "".join([t.get("plain_text", "") for t in rich_text])
+        if code:
+            content = f"\n```\n{code}\n```\n"
+
+    # 3. Table Rows (children of a "table" block)
+    elif block_type == "table_row":
+        cells = block.get("table_row", {}).get("cells", [])
+        row = [" ".join(t.get("plain_text", "") for t in cell).strip() for cell in cells]
+        if any(row):
+            content = "| " + " | ".join(row) + " |\n"
+
+    return content
+
+def needs_children(block):
+    return bool(block.get("has_children")) and block.get("type") not in PAGE_BLOCK_TYPES
+
+def children_source_id(block):
+    """Synced-block copies list their content under the original block."""
+    if block.get("type") == "synced_block":
+        synced_from = block.get("synced_block", {}).get("synced_from")
+        if synced_from and synced_from.get("block_id"):
+            return synced_from["block_id"]
+    return block["id"]
+
+def page_title(page_obj, default="Untitled"):
+    for p in page_obj.get("properties", {}).values():
+        if p.get("type") == "title" and p.get("title"):
+            return "".join([t.get("plain_text", "") for t in p.get("title")])
+    return default
+
+# --- 3. Delta Cursor ---
+def load_cursor(path=NOTION_CURSOR_PATH):
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Ignoring unreadable Notion cursor: {e}")
+        return {}
+
+def save_cursor(cursor, path=NOTION_CURSOR_PATH):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(cursor, f)
+    os.replace(tmp_path, path)
+
+def notion_timestamp(dt):
+    """Formats a datetime the way Notion does, so timestamps compare as strings."""
+    return dt.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+class PageGone(Exception):
+    """The page was deleted, archived or is no longer shared with the integration."""
+
+# --- 4. Crawler ---
+class NotionCrawler:
+    """
+    Walks a Notion page tree breadth-first. Each page's blocks are listed once
+    and give both its text and its child pages; sibling pages are fetched
+    concurrently by a bounded worker pool, and every API call goes through a
+    shared rate limiter.
+
+    With a `cursor` from a previous sync, pages whose last_edited_time has not
+    moved are served from the cursor without listing their blocks. Timestamps
+    come from one paginated search over the workspace where possible, falling
+    back to `pages.retrieve` per page.
+    """
+
+    def __init__(self, client, max_workers=NOTION_MAX_WORKERS, requests_per_second=NOTION_REQUESTS_PER_SECOND, cursor=None,
+                 block_concurrency=NOTION_BLOCK_CONCURRENCY):
+        self.client = client
+        self.max_workers = max_workers
+        self.block_concurrency = max(1, block_concurrency)
+        self.limiter = RateLimiter(requests_per_second)
+        self.previous = (cursor or {}).get("pages", {})
+        # Notion timestamps have minute precision: anything edited in the minute
+        # the last sync started may have changed after it was read.
+        self.recent_since = None
+        if cursor and cursor.get("synced_at"):
+            synced_at = datetime.strptime(cursor["synced_at"], "%Y-%m-%dT%H:%M:%S.000Z").replace(tzinfo=timezone.utc)
+            self.recent_since = notion_timestamp(synced_at.replace(second=0) - timedelta(minutes=1))
+        self.edited_times = {}
+        self.pages_state = {}
+        self.stats_lock = threading.Lock()
+        self.stats = {
+            "pages": 0, "fetched": 0, "skipped": 0, "removed": 0,
+            "requests": 0, "errors": 0, "elapsed": 0.0, "pages_per_sec": 0.0,
+        }
+
+    def _count(self, key):
+        with self.stats_lock:
+            self.stats[key] += 1
+
+    def _call(self, fn, **kwargs):
+        for attempt in range(NOTION_MAX_RETRIES + 1):
+            self.limiter.acquire()
+            self._count("requests")
+            try:
+                return fn(**kwargs)
+            except Exception as e:
+                if getattr(e, "status", None) != 429 or attempt == NOTION_MAX_RETRIES:
+                    raise
+                time.sleep(2 ** attempt)
+
+    def load_edited_times(self):
+        """One paginated search for (last_edited_time, title) of every page shared with us."""
+        if not hasattr(self.client, "search"):
+            return
+        edited_times = {}
+        cursor = None
+        try:
+            while True:
+                response = self._call(
+                    self.client.search,
+                    filter={"property": "object", "value": "page"},
+                    start_cursor=cursor,
+                    page_size=100,
+                )
+                for page in response.get("results", []):
+                    if not page.get("archived") and not page.get("in_trash"):
+                        edited_times[page["id"]] = (page.get("last_edited_time"), page_title(page, None))
+                if not response.get("has_more"):
+                    break
+                cursor = response.get("next_cursor")
+        except Exception as e:
+            print(f"   ⚠️ Notion search failed, checking pages one by one: {e}")
+            return
+        self.edited_times = edited_times
+
+    def page_metadata(self, page_id):
+        if page_id in self.edited_times:
+            return self.edited_times[page_id]
+        # Missing from search: brand new (search lags), unshared or deleted.
+        try:
+            page_obj = self._call(self.client.pages.retrieve, page_id=page_id)
+        except Exception as e:
+            if getattr(e, "status", None) in (403, 404):
+                raise PageGone(page_id) from e
+            raise
+        if page_obj.get("archived") or page_obj.get("in_trash"):
+            raise PageGone(page_id)
+        return page_obj.get("last_edited_time"), page_title(page_obj, None)
+
+    def is_unchanged(self, cached, edited_time):
+        if not cached or not edited_time or cached.get("last_edited_time") != edited_time:
+            return False
+        return self.recent_since is None or edited_time < self.recent_since
+
+    def list_blocks(self, block_id):
+        blocks = []
+        cursor = None
+        while True:
+            response = self._call(self.client.blocks.children.list, block_id=block_id, start_cursor=cursor)
+            blocks.extend(response.get("results", []))
+            if not response.get("has_more"):
+                return blocks
+            cursor = response.get("next_cursor")
+
+    def expand_nested(self, blocks):
+        """
+        Attaches the children of every nested block as block["children"], one
+        depth level at a time. Each level's listings run in parallel (up to
+        `block_concurrency`); results stay attached to their parent, so
+        document order is preserved.
+        """
+        level = [block for block in blocks if needs_children(block)]
+        if not level:
+            return
+        with ThreadPoolExecutor(max_workers=self.block_concurrency) as pool:
+            while level:
+                listings = list(pool.map(self.list_blocks, [children_source_id(block) for block in level]))
+                next_level = []
+                for block, nested in zip(level, listings):
+                    block["children"] = nested
+                    next_level.extend(child for child in nested if needs_children(child))
+                level = next_level
+
+    def fetch_page(self, page_id):
+        """Returns (text, [(child_id, child_title), ...]) from one listing per block that has children."""
+        blocks = self.list_blocks(page_id)
+        self.expand_nested(blocks)
+
+        content_parts = []
+        children = []
+        stack = [iter(blocks)]
+        while stack:
+            block = next(stack[-1], None)
+            if block is None:
+                stack.pop()
+                continue
+            if block.get("type") == "child_page":
+                children.append((block["id"], block.get("child_page", {}).get("title", "Untitled")))
+                continue
+            text = extract_text_from_block(block)
+            if text:
+                content_parts.append(text)
+            if block.get("children"):
+                stack.append(iter(block["children"]))
+        return "\n".join(content_parts), children
+
+    def visit_page(self, page_id, title):
+        """Returns (Document or None, children), skipping the block listing when the page is unchanged."""
+        edited_time, live_title = self.page_metadata(page_id)
+        cached = self.previous.get(page_id)
+        if self.is_unchanged(cached, edited_time):
+            entry = dict(cached, title=live_title or cached["title"])
+            self._count("skipped")
+        else:
+            print(f"   -> Processing: {live_title or title}")
+            text, children = self.fetch_page(page_id)
+            entry = {
+                "last_edited_time": edited_time,
+                "title": live_title or title or "Untitled",
+                "children": children,
+                "text": text,
+            }
+            self._count("fetched")
+        return self.use_entry(page_id, entry)
+
+    def use_entry(self, page_id, entry):
+        self.pages_state[page_id] = entry
+        doc = None
+        if entry["text"].strip():
+            doc = Document(page_content=entry["text"], metadata={"source": entry["title"], "type": "notion", "page_id": page_id})
+        return doc, [tuple(child) for child in entry["children"]]
+
+    def crawl(self, root_page_id):
+        start = time.perf_counter()
+        self.load_edited_times()
+
+        docs = []
+        frontier = deque([(root_page_id, "Root Page")])
+        visited = {root_page_id}
+        in_flight = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while frontier or in_flight:
+                while frontier and len(in_flight) < self.max_workers:
+                    page_id, title = frontier.popleft()
+                    in_flight[pool.submit(self.visit_page, page_id, title)] = page_id
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    page_id = in_flight.pop(future)
+                    try:
+                        doc, children = future.result()
+                    except PageGone:
+                        continue
+                    except Exception as e:
+                        print(f"   ❌ Error processing page {page_id}: {e}")
+                        self.stats["errors"] += 1
+                        # Keep serving the last good copy rather than dropping the page.
+                        if page_id not in self.previous:
+                            continue
+                        doc, children = self.use_entry(page_id, self.previous[page_id])
+                    self.stats["pages"] += 1
+                    if doc:
+                        docs.append(doc)
+                    for child_id, child_title in children:
+                        if child_id not in visited:
+                            visited.add(child_id)
+                            frontier.append((child_id, child_title))
+
+        self.stats["removed"] = len(set(self.previous) - set(self.pages_state))
+        elapsed = time.perf_counter() - start
+        self.stats["elapsed"] = round(elapsed, 3)
+        self.stats["pages_per_sec"] = round(self.stats["pages"] / elapsed, 2) if elapsed else 0.0
+        return docs
+
+def fetch_page_content(client, page_id):
+    """Fetches the text of a single page (child pages are not followed)."""
+    text, _ = NotionCrawler(client).fetch_page(page_id)
+    return text
+
+def load_notion_documents(client=None, root_page_id=None, cursor_path=NOTION_CURSOR_PATH):
+    token = os.getenv("NOTION_TOKEN")
+    root_page_id = root_page_id or os.getenv("NOTION_PAGE_ID")
+
+    if client is None:
+        if not token or not root_page_id:
+            print("⚠️ Skipped Notion: Missing credentials in .env")
+            return []
+        client = NotionClient(auth=token)
+
+    print(f"🔍 Scanning Notion from Root ID: {root_page_id}...")
+    cursor = load_cursor(cursor_path) if cursor_path else {}
+    if cursor.get("root") != root_page_id:
+        cursor = {}
+    synced_at = notion_timestamp(datetime.now(timezone.utc))
+
+    crawler = NotionCrawler(client, cursor=cursor)
+    docs = crawler.crawl(root_page_id)
+    if cursor_path:
+        save_cursor({"root": root_page_id, "synced_at": synced_at, "pages": crawler.pages_state}, cursor_path)
+
+    stats = crawler.stats
+    print(
+        f"✅ Loaded {len(docs)} Notion pages "
+        f"({stats['fetched']} fetched, {stats['skipped']} unchanged, {stats['removed']} removed; "
+        f"{stats['requests']} requests, {stats['pages_per_sec']} pages/sec)."
+    )
+    return docs
+
+# --- 5. Fake Client (tests & benchmarks) ---
+class FakeNotionClient:
+    """
+    In-memory stand-in for notion_client.Client exposing the endpoints the
+    crawler uses. `pages` maps page_id -> {"title": str, "blocks": [block, ...],
+    "last_edited_time": str (optional)}, where blocks use the Notion API shape
+    (see `paragraph_block`, `child_page_block`). As in the real API, nested
+    blocks list their children by block id, so they go in the same dict.
+    """
+
+    def __init__(self, pages, page_size=100, latency=0.0):
+        self._pages = pages
+        self.page_size = page_size
+        self.latency = latency
+        self.calls = 0
+        self.lock = threading.Lock()
+        self.pages = _FakeEndpoint(retrieve=self._retrieve_page)
+        self.search = self._search
+        self.blocks = _FakeEndpoint(children=_FakeEndpoint(list=self._list_children))
+
+    def _tick(self):
+        with self.lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _not_found(self, object_id):
+        error = Exception(f"Could not find block with ID: {object_id}")
+        error.status = 404
+        return error
+
+    def _page_object(self, page_id):
+        page = self._pages[page_id]
+        return {
+            "object": "page",
+            "id": page_id,
+            "last_edited_time": page.get("last_edited_time", "2024-01-01T00:00:00.000Z"),
+            "archived": page.get("archived", False),
+            "properties": {"title": {"type": "title", "title": [{"plain_text": page["title"]}]}},
+        }
+
+    def _retrieve_page(self, page_id):
+        self._tick()
+        if page_id not in self._pages:
+            raise self._not_found(page_id)
+        return self._page_object(page_id)
+
+    def _search(self, filter=None, start_cursor=None, page_size=100):
+        self._tick()
+        page_ids = sorted(self._pages)
+        start = int(start_cursor or 0)
+        end = start + page_size
+        has_more = end < len(page_ids)
+        results = [self._page_object(page_id) for page_id in page_ids[start:end]]
+        return {"results": results, "has_more": has_more, "next_cursor": str(end) if has_more else None}
+
+    def _list_children(self, block_id, start_cursor=None, page_size=None):
+        self._tick()
+        if block_id not in self._pages:
+            raise self._not_found(block_id)
+        blocks = self._pages[block_id]["blocks"]
+        start = int(start_cursor or 0)
+        end = start + (page_size or self.page_size)
+        has_more = end < len(blocks)
+        return {"results": blocks[start:end], "has_more": has_more, "next_cursor": str(end) if has_more else None}
+
+class _FakeEndpoint:
+    def __init__(self, **attrs):
+        self.__dict__.update(attrs)
+
+def paragraph_block(text):
+    return {"object": "block", "type": "paragraph", "has_children": False,
+            "paragraph": {"rich_text": [{"plain_text": text}]}}
+
+def child_page_block(page_id, title):
+    return {"object": "block", "id": page_id, "type": "child_page", "has_children": True,
+            "child_page": {"title": title}}
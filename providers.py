@@ -0,0 +1,231 @@
+import os
+import asyncio
+import hashlib
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager, asynccontextmanager
+
+from langchain_core.embeddings import Embeddings, DeterministicFakeEmbedding
+from langchain_core.rate_limiters import InMemoryRateLimiter
+
+from embedding_cache import accepts_task_type
+
+# --- Configuration ---
+# One bucket per provider, shared by every chat and embedding client in the
+# process: parallel sessions queue here instead of tripping the provider's limit.
+PROVIDER_REQUESTS_PER_SECOND = {
+    "gemini": float(os.getenv("GEMINI_REQUESTS_PER_SECOND", "5")),
+    "ollama": float(os.getenv("OLLAMA_REQUESTS_PER_SECOND", "50")),
+    "fake": float(os.getenv("FAKE_REQUESTS_PER_SECOND", "1000")),
+}
+PROVIDER_BURST = int(os.getenv("PROVIDER_BURST", "10"))  # bucket size: requests allowed back to back
+PROVIDER_MAX_INFLIGHT = int(os.getenv("PROVIDER_MAX_INFLIGHT", "8"))  # concurrent embedding requests per provider
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL")  # None: the client's default (localhost:11434)
+KEEPALIVE_SECONDS = 60
+FAKE_EMBEDDING_SIZE = 768
+
+# Clients are built once per (provider, model, settings) and shared, so every
+# Streamlit session, ingest job and script reuses the same keep-alive
+# connections (Gemini's gRPC channel, Ollama's httpx pool). Embeddings are
+# wrapped in ProviderEmbeddings, which also merges identical requests that
+# are already in flight; chat models take the bucket as their rate_limiter.
+
+_clients = {}
+_limiters = {}
+_lock = threading.Lock()
+
+class ProviderLimits:
+    """Token bucket plus an in-flight cap for one provider, usable from threads and coroutines."""
+
+    def __init__(self, requests_per_second, burst=PROVIDER_BURST, max_inflight=PROVIDER_MAX_INFLIGHT):
+        self.bucket = InMemoryRateLimiter(
+            requests_per_second=requests_per_second, check_every_n_seconds=0.05, max_bucket_size=burst
+        )
+        self.max_inflight = max(1, max_inflight)
+        self._slots = threading.BoundedSemaphore(self.max_inflight)
+        # Coroutines wait for a slot on these threads, so the event loop (and the default executor) stay free.
+        self._waiters = ThreadPoolExecutor(max_workers=self.max_inflight, thread_name_prefix="provider-slot")
+
+    @contextmanager
+    def slot(self):
+        self._slots.acquire()
+        try:
+            self.bucket.acquire()
+            yield
+        finally:
+            self._slots.release()
+
+    @asynccontextmanager
+    async def aslot(self):
+        acquired = self._waiters.submit(self._slots.acquire)
+        try:
+            await asyncio.wrap_future(acquired)
+        except asyncio.CancelledError:
+            # A blocking acquire can't be interrupted; hand the slot back once it goes through.
+            acquired.add_done_callback(self._release_abandoned)
+            raise
+        try:
+            await self.bucket.aacquire()
+            yield
+        finally:
+            self._slots.release()
+
+    def _release_abandoned(self, future):
+        if not future.cancelled():
+            self._slots.release()
+
+def limits(provider):
+    with _lock:
+        if provider not in _limiters:
+            _limiters[provider] = ProviderLimits(PROVIDER_REQUESTS_PER_SECOND[provider])
+        return _limiters[provider]
+
+def _shared(key, build):
+    with _lock:
+        client = _clients.get(key)
+    if client is None:
+        # Built outside the lock (constructors may do network I/O); a rare
+        # duplicate is harmless and the first one stored wins.
+        client = build()
+        with _lock:
+            client = _clients.setdefault(key, client)
+    return client
+
+def _ollama_client_kwargs():
+    import httpx
+    limit = limits("ollama").max_inflight
+    return {"limits": httpx.Limits(max_connections=limit, max_keepalive_connections=limit, keepalive_expiry=KEEPALIVE_SECONDS)}
+
+# --- 1. Request Coalescing ---
+class ProviderEmbeddings(Embeddings):
+    """
+    Shared embedding client for one provider model. Requests pass through the
+    provider's limits; a request identical to one already in flight (same
+    kind and texts) waits for that result instead of calling the provider.
+    """
+
+    def __init__(self, embeddings, provider):
+        self.embeddings = embeddings
+        self.provider = provider
+        self.limits = limits(provider)
+        self.coalesced = 0
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    @property
+    def accepts_task_type(self):
+        return accepts_task_type(self.embeddings)
+
+    def _key(self, kind, texts, kwargs):
+        digest = hashlib.sha256(kind.encode("utf-8"))
+        for name in sorted(kwargs):
+            digest.update(f"\0{name}={kwargs[name]}".encode("utf-8"))
+        for text in texts:
+            digest.update(b"\0" + text.encode("utf-8"))
+        return digest.digest()
+
+    def _join(self, key):
+        """(future, leader): the leader makes the call and resolves the future for everyone else."""
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = self._inflight[key] = Future()
+            return future, True
+
+    def _resolve(self, key, future, result=None, error=None):
+        with self._lock:
+            del self._inflight[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def _call(self, key, call):
+        future, leader = self._join(key)
+        if not leader:
+            return future.result()
+        try:
+            with self.limits.slot():
+                result = call()
+        except BaseException as e:
+            self._resolve(key, future, error=e)
+            raise
+        self._resolve(key, future, result)
+        return result
+
+    async def _acall(self, key, call):
+        future, leader = self._join(key)
+        if not leader:
+            return await asyncio.wrap_future(future)
+        try:
+            async with self.limits.aslot():
+                result = await call()
+        except BaseException as e:
+            self._resolve(key, future, error=e)
+            raise
+        self._resolve(key, future, result)
+        return result
+
+    # --- Embeddings Interface ---
+    def embed_documents(self, texts, **kwargs):
+        key = self._key("document", texts, kwargs)
+        return self._call(key, lambda: self.embeddings.embed_documents(texts, **kwargs))
+
+    def embed_query(self, text):
+        return self._call(self._key("query", [text], {}), lambda: self.embeddings.embed_query(text))
+
+    async def aembed_documents(self, texts):
+        return await self._acall(self._key("document", texts, {}), lambda: self.embeddings.aembed_documents(texts))
+
+    async def aembed_query(self, text):
+        return await self._acall(self._key("query", [text], {}), lambda: self.embeddings.aembed_query(text))
+
+# --- 2. Client Registry ---
+_fake_lock = threading.Lock()
+
+class LockedFakeEmbedding(DeterministicFakeEmbedding):
+    """DeterministicFakeEmbedding seeds numpy's global RNG for every text; threads take turns so vectors stay deterministic."""
+
+    def _get_embedding(self, seed):
+        with _fake_lock:
+            return super()._get_embedding(seed)
+
+def get_embeddings(provider, model, **settings):
+    """Shared, rate-limited embeddings for `model` on `provider` ("gemini", "ollama" or "fake")."""
+    def build():
+        if provider == "gemini":
+            from langchain_google_genai import GoogleGenerativeAIEmbeddings
+            base = GoogleGenerativeAIEmbeddings(model=model, **settings)
+        elif provider == "ollama":
+            from langchain_ollama import OllamaEmbeddings
+            base = OllamaEmbeddings(model=model, base_url=OLLAMA_BASE_URL, client_kwargs=_ollama_client_kwargs(), **settings)
+        elif provider == "fake":
+            base = LockedFakeEmbedding(size=settings.get("size", FAKE_EMBEDDING_SIZE))
+        else:
+            raise ValueError(f"Unknown provider '{provider}'")
+        return ProviderEmbeddings(base, provider)
+    return _shared(("embeddings", provider, model, repr(sorted(settings.items()))), build)
+
+def get_chat_model(provider, model, **settings):
+    """
+    Shared chat model for `model` on `provider`, drawing from the provider's
+    token bucket. The fake provider takes `responses` (a list of replies).
+    """
+    def build():
+        rate_limiter = limits(provider).bucket
+        if provider == "gemini":
+            from langchain_google_genai import ChatGoogleGenerativeAI
+            return ChatGoogleGenerativeAI(model=model, rate_limiter=rate_limiter, **settings)
+        if provider == "ollama":
+            from langchain_ollama import ChatOllama
+            return ChatOllama(
+                model=model, base_url=OLLAMA_BASE_URL, client_kwargs=_ollama_client_kwargs(),
+                rate_limiter=rate_limiter, **settings,
+            )
+        if provider == "fake":
+            from langchain_core.language_models import FakeListChatModel
+            return FakeListChatModel(rate_limiter=rate_limiter, **settings)
+        raise ValueError(f"Unknown provider '{provider}'")
+    return _shared(("chat", provider, model, repr(sorted(settings.items()))), build)
@@ -1,11 +1,11 @@
 import sys
-from langchain_ollama import OllamaEmbeddings
 from langchain_community.vectorstores import FAISS
-from langchain_ollama import ChatOllama
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables import RunnablePassthrough
 from langchain_core.output_parsers import StrOutputParser
 
+from providers import get_embeddings, get_chat_model
+
 # --- Configuration ---
 VECTOR_STORE_DIR = "vector_store/faiss_index"
 LLM_MODEL = "llama3.2:3b"
@@ -23,11 +23,11 @@ def get_rag_chain():
     try:
         # 1. Load the LLM
         # This connects to your local Ollama server
-        llm = ChatOllama(model=LLM_MODEL, temperature=0.3)
+        llm = get_chat_model("ollama", LLM_MODEL, temperature=0.3)
         
         # 2. Load the Vector Store
         # This loads the FAISS index from your local disk
-        embeddings = OllamaEmbeddings(model=EMBEDDING_MODEL)
+        embeddings = get_embeddings("ollama", EMBEDDING_MODEL)
         vector_store = FAISS.load_local(
             VECTOR_STORE_DIR, 
             embeddings,
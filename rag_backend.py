@@ -1,140 +1,433 @@
 import os
-import json
+import time
+import asyncio
+import hashlib
+import threading
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st
 from operator import itemgetter
 from dotenv import load_dotenv
 
 # --- LangChain Imports (Updated for Cloud/v0.3) ---
-from langchain_community.vectorstores import FAISS
-from langchain_google_genai import GoogleGenerativeAIEmbeddings, ChatGoogleGenerativeAI
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.runnables import RunnableLambda
 from langchain_core.output_parsers import StrOutputParser
 
-# --- STORAGE FIX: These moved in new LangChain versions ---
+from langchain.retrievers import MultiVectorRetriever
 
-# --- SAFE IMPORT BLOCK ---
-# Tries the new location first (Cloud), falls back to old (Local)
-try:
-    from langchain_community.storage import LocalFileStore
-except ImportError:
-    from langchain.storage import LocalFileStore
-
-from langchain.storage import EncoderBackedStore
-
-from langchain.retrievers import ParentDocumentRetriever
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_core.documents import Document
+from embedding_cache import CachedEmbeddings
+from providers import get_embeddings, get_chat_model
+from answer_cache import AnswerCache, ANSWER_CACHE_ENABLED
+from context_builder import build_context, count_tokens
+from index_store import load_index
+from snapshots import current_snapshot, snapshot_dir, DOCSTORE_NAME, LEXICAL_INDEX_NAME
+from lexical_index import HybridRetriever, load_lexical_index
+from reranker import RerankingRetriever, make_scorer, RERANK_FETCH_K
+from docstore import PackedDocStore, LEGACY_DOCSTORE_DIR, migrate_legacy_docstore
+from gap_analyzer import GapAnalyzer, GapCache, GAP_CACHE_NAME, docstore_documents
+import tracing
+from tracing import span
 
 # --- Configuration ---
 env_path = os.path.join(os.path.dirname(__file__), '.env')
 load_dotenv(env_path)
 
 VECTOR_STORE_DIR = "vector_store"
-DOCSTORE_DIR = "docstore_data"
 FAISS_INDEX_NAME = "faiss_index"
 EMBEDDING_MODEL = "models/text-embedding-004"
 LLM_MODEL = "gemini-2.5-flash" 
+CONDENSE_CACHE_SIZE = 256
+# Retrieve on the raw question while the rewrite is in flight; costs one extra
+# query embedding whenever the rewrite does change the question.
+SPECULATIVE_RETRIEVAL = os.getenv("RAG_SPECULATIVE_RETRIEVAL", "1") == "1"
 
-# --- 1. JSON Serializers (MUST MATCH INGEST.PY EXACTLY) ---
-def serialize_document(doc: Document) -> bytes:
-    return json.dumps({
-        "page_content": doc.page_content,
-        "metadata": doc.metadata,
-    }).encode("utf-8")
-
-def deserialize_document(data: bytes) -> Document:
-    obj = json.loads(data.decode("utf-8"))
-    return Document(
-        page_content=obj["page_content"],
-        metadata=obj["metadata"],
-    )
+# Shared by every chain in the process; entries are tied to the snapshot they were answered from.
+ANSWER_CACHE = AnswerCache() if ANSWER_CACHE_ENABLED else None
+
+def format_docs(docs):
+    return build_context(docs)[0]
+
+def elapsed_ms(start):
+    return round((time.perf_counter() - start) * 1000, 1)
+
+def log_timings(timings, context=None):
+    line = "⏱️ RAG request: " + " ".join(f"{stage}={value}ms" for stage, value in timings.items())
+    if context:
+        line += f" context_tokens={context['tokens']}/{context['budget']} chunks={context['chunks']}/{context['retrieved']}"
+    print(line)
+
+def traced_context(docs, budget=None):
+    with span("build_context") as s:
+        context_text, context = build_context(docs) if budget is None else build_context(docs, budget)
+        s.set(**context)
+    return context_text, context
+
+def history_digest(chat_history):
+    digest = hashlib.sha256()
+    for message in chat_history:
+        digest.update(f"{message.type}\0{message.content}\0".encode("utf-8"))
+    return digest.hexdigest()
+
+def same_question(a, b):
+    normalize = lambda text: " ".join(text.split()).casefold().rstrip("?.! ")
+    return normalize(a) == normalize(b)
+
+class ContextRetriever:
+    """
+    Retrieval with follow-up questions condensed against the chat history.
+
+    The condensing LLM call is skipped on the first turn, its result is cached
+    per (history digest, input), and with `speculative` the raw question is
+    retrieved concurrently so an unchanged rewrite costs no extra round-trip.
+    `retrieve` returns (docs, timings) with per-stage latency in ms.
+    """
+
+    def __init__(self, condense_chain, retriever, cache_size=CONDENSE_CACHE_SIZE, speculative=SPECULATIVE_RETRIEVAL):
+        self.condense_chain = condense_chain
+        self.retriever = retriever
+        self.cache_size = cache_size
+        self.speculative = speculative
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="speculative")
+        self.stats = {"skipped": 0, "cache_hits": 0, "condensed": 0, "speculative_hits": 0}
+
+    def _count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def _cached(self, key):
+        with self.lock:
+            question = self.cache.get(key)
+            if question is not None:
+                self.cache.move_to_end(key)
+            return question
+
+    def _remember(self, key, question):
+        with self.lock:
+            self.cache[key] = question
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def condense(self, input_dict):
+        """
+        Returns (standalone question, pending speculative retrieval or None, timings).
+        Pass the result to `fetch` to get the documents.
+        """
+        with span("condense") as s:
+            return self._condense(input_dict, s)
+
+    def _condense(self, input_dict, s):
+        question = input_dict["input"]
+        chat_history = input_dict.get("chat_history") or []
+        if not chat_history:
+            self._count("skipped")
+            s.set(outcome="skipped")
+            return question, None, {}
+
+        start = time.perf_counter()
+        key = (history_digest(chat_history), question)
+        standalone = self._cached(key)
+        if standalone is not None:
+            self._count("cache_hits")
+            s.set(outcome="cache_hit")
+            return standalone, None, {"condense": 0.0}
+
+        # Run in a copy of this context so its spans land in the current trace.
+        speculative = (
+            self.pool.submit(contextvars.copy_context().run, self._speculate, question)
+            if self.speculative else None
+        )
+        standalone = self.condense_chain.invoke(input_dict)
+        self._count("condensed")
+        self._remember(key, standalone)
+        s.set(outcome="condensed", speculative=speculative is not None)
+        return standalone, speculative, {"condense": elapsed_ms(start)}
+
+    def _speculate(self, question):
+        with span("speculative_retrieve"):
+            return self.retriever.invoke(question)
+
+    def fetch(self, input_dict, standalone, speculative, timings):
+        start = time.perf_counter()
+        with span("retrieve") as s:
+            if speculative is not None and same_question(standalone, input_dict["input"]):
+                self._count("speculative_hits")
+                s.set(speculative_hit=True)
+                docs = speculative.result()
+            else:
+                if speculative is not None:
+                    speculative.cancel()
+                docs = self.retriever.invoke(standalone)
+            s.set(documents=len(docs))
+        timings["retrieve"] = elapsed_ms(start)
+        return docs
+
+    def retrieve(self, input_dict):
+        standalone, speculative, timings = self.condense(input_dict)
+        return self.fetch(input_dict, standalone, speculative, timings), timings
 
-# --- 2. The Wrapper Class ---
+    async def acondense(self, input_dict):
+        with span("condense") as s:
+            return await self._acondense(input_dict, s)
+
+    async def _acondense(self, input_dict, s):
+        question = input_dict["input"]
+        chat_history = input_dict.get("chat_history") or []
+        if not chat_history:
+            self._count("skipped")
+            s.set(outcome="skipped")
+            return question, None, {}
+
+        start = time.perf_counter()
+        key = (history_digest(chat_history), question)
+        standalone = self._cached(key)
+        if standalone is not None:
+            self._count("cache_hits")
+            s.set(outcome="cache_hit")
+            return standalone, None, {"condense": 0.0}
+
+        speculative = asyncio.ensure_future(self.retriever.ainvoke(question)) if self.speculative else None
+        standalone = await self.condense_chain.ainvoke(input_dict)
+        self._count("condensed")
+        self._remember(key, standalone)
+        s.set(outcome="condensed", speculative=speculative is not None)
+        return standalone, speculative, {"condense": elapsed_ms(start)}
+
+    async def afetch(self, input_dict, standalone, speculative, timings):
+        start = time.perf_counter()
+        with span("retrieve") as s:
+            if speculative is not None and same_question(standalone, input_dict["input"]):
+                self._count("speculative_hits")
+                s.set(speculative_hit=True)
+                docs = await speculative
+            else:
+                if speculative is not None:
+                    speculative.cancel()
+                docs = await self.retriever.ainvoke(standalone)
+            s.set(documents=len(docs))
+        timings["retrieve"] = elapsed_ms(start)
+        return docs
+
+    async def aretrieve(self, input_dict):
+        standalone, speculative, timings = await self.acondense(input_dict)
+        return await self.afetch(input_dict, standalone, speculative, timings), timings
+
+    def as_runnable(self):
+        """Docs-only view for composing into LCEL chains."""
+        async def aretrieve_docs(input_dict):
+            return (await self.aretrieve(input_dict))[0]
+        return RunnableLambda(lambda input_dict: self.retrieve(input_dict)[0], afunc=aretrieve_docs)
+
+# --- 1. The Wrapper Class ---
 # This fixes the "RunnableSequence object has no field" error
 class RAGApplication:
-    def __init__(self, retrieval_chain, retriever, llm):
+    def __init__(self, retrieval_chain, retriever, llm, context_retriever=None, answer_chain=None,
+                 embeddings=None, answer_cache=None, snapshot=None, gap_analyzer=None):
         self.chain = retrieval_chain
         self.retriever = retriever
         self.llm = llm
+        # The two halves of `chain` (a ContextRetriever and the answer stage),
+        # kept separately so stream() can emit the sources before generation starts.
+        self.context_retriever = context_retriever
+        self.answer_chain = answer_chain
+        self.embeddings = embeddings
+        self.answer_cache = answer_cache
+        self.snapshot = snapshot
+        self.gap_analyzer = gap_analyzer
+        self.last_timings = {}
+        self.last_context = {}
 
     def invoke(self, input_dict):
-        return self.chain.invoke(input_dict)
+        return "".join(event["text"] for event in self.stream(input_dict) if event["type"] == "token")
 
-    def analyze_gaps(self):
-        def format_docs(docs):
-            return "\n\n".join(doc.page_content for doc in docs)
-            
-        docs = self.retriever.invoke("project requirements specifications vs implementation details")
-        context_text = format_docs(docs)
-        
-        gap_prompt = f"""
-        You are a QA Architect. Analyze the technical context below.
-        Task: Identify promises made in 'Overview' vs implementation in 'Technical Details'.
-        
-        Context:
-        {context_text[:12000]} 
-        
-        Output a bulleted list of "Gaps Detected":
+    def _finish(self, timings, start, context=None):
+        timings["total"] = elapsed_ms(start)
+        self.last_timings = timings
+        self.last_context = context or {}
+        log_timings(timings, context)
+
+    def use_answer_cache(self, input_dict):
+        # A follow-up's answer depends on the conversation, not only on its
+        # condensed question, so only first questions are cached.
+        return self.answer_cache is not None and not input_dict.get("chat_history")
+
+    def _cached_events(self, cached, timings, start):
+        self._finish(timings, start)
+        return [
+            {"type": "sources", "documents": cached["documents"], "cached": True},
+            {"type": "token", "text": cached["answer"]},
+            {"type": "done", "timings": timings, "cached": True},
+        ]
+
+    def stream(self, input_dict):
+        """
+        Yields {"type": "sources", "documents": [...]} once retrieval is done,
+        then one {"type": "token", "text": ...} per generated chunk, and finally
+        {"type": "done", "timings": {...}, "context": {...}} with per-stage latency
+        in ms and the context tokens sent.
+        A semantic answer-cache hit yields the stored answer as a single token
+        event, with "cached": True on the sources and done events.
         """
-        return self.llm.invoke(gap_prompt).content
+        with span("rag_request", history_messages=len(input_dict.get("chat_history") or [])) as request:
+            start = time.perf_counter()
+            question, speculative, timings = self.context_retriever.condense(input_dict)
+
+            vector = None
+            if self.use_answer_cache(input_dict):
+                lookup_start = time.perf_counter()
+                with span("answer_cache") as s:
+                    vector = self.embeddings.embed_query(question)
+                    cached = self.answer_cache.get(self.snapshot, vector)
+                    s.set(hit=bool(cached))
+                timings["answer_cache"] = elapsed_ms(lookup_start)
+                if cached:
+                    if speculative is not None:
+                        speculative.cancel()
+                    request.set(cached=True)
+                    yield from self._cached_events(cached, timings, start)
+                    return
+
+            docs = self.context_retriever.fetch(input_dict, question, speculative, timings)
+            timings["retrieval"] = elapsed_ms(start)
+            yield {"type": "sources", "documents": docs}
+
+            context_text, context = traced_context(docs)
+            chunks = []
+            with span("generate", model=LLM_MODEL) as s:
+                for chunk in self.answer_chain.stream({**input_dict, "context": context_text}):
+                    timings.setdefault("ttft", elapsed_ms(start))
+                    chunks.append(chunk)
+                    yield {"type": "token", "text": chunk}
+                answer = "".join(chunks)
+                self._trace_answer(s, chunks, answer, timings)
+            if vector is not None and answer.strip():
+                self.answer_cache.put(self.snapshot, vector, question, answer, docs)
+            self._finish(timings, start, context)
+            yield {"type": "done", "timings": timings, "context": context}
+
+    async def astream(self, input_dict):
+        """Async counterpart of stream(), yielding the same events."""
+        with span("rag_request", history_messages=len(input_dict.get("chat_history") or [])) as request:
+            start = time.perf_counter()
+            question, speculative, timings = await self.context_retriever.acondense(input_dict)
+
+            vector = None
+            if self.use_answer_cache(input_dict):
+                lookup_start = time.perf_counter()
+                with span("answer_cache") as s:
+                    vector = await self.embeddings.aembed_query(question)
+                    cached = self.answer_cache.get(self.snapshot, vector)
+                    s.set(hit=bool(cached))
+                timings["answer_cache"] = elapsed_ms(lookup_start)
+                if cached:
+                    if speculative is not None:
+                        speculative.cancel()
+                    request.set(cached=True)
+                    for event in self._cached_events(cached, timings, start):
+                        yield event
+                    return
+
+            docs = await self.context_retriever.afetch(input_dict, question, speculative, timings)
+            timings["retrieval"] = elapsed_ms(start)
+            yield {"type": "sources", "documents": docs}
+
+            context_text, context = traced_context(docs)
+            chunks = []
+            with span("generate", model=LLM_MODEL) as s:
+                async for chunk in self.answer_chain.astream({**input_dict, "context": context_text}):
+                    timings.setdefault("ttft", elapsed_ms(start))
+                    chunks.append(chunk)
+                    yield {"type": "token", "text": chunk}
+                answer = "".join(chunks)
+                self._trace_answer(s, chunks, answer, timings)
+            if vector is not None and answer.strip():
+                self.answer_cache.put(self.snapshot, vector, question, answer, docs)
+            self._finish(timings, start, context)
+            yield {"type": "done", "timings": timings, "context": context}
+
+    def _trace_answer(self, s, chunks, answer, timings):
+        # Counting tokens isn't free, so only do it for recorded traces.
+        if tracing.enabled():
+            s.set(chunks=len(chunks), answer_tokens=count_tokens(answer), ttft_ms=timings.get("ttft"))
+
+    def stream_gaps(self):
+        """Progress events from the map-reduce gap analysis; see GapAnalyzer.stream."""
+        return self.gap_analyzer.stream()
+
+    def analyze_gaps(self):
+        return self.gap_analyzer.run()
 
-@st.cache_resource
 def get_rag_chain():
-    # 1. Safety Check
-    if not os.path.exists(VECTOR_STORE_DIR) or not os.path.exists(DOCSTORE_DIR):
-        # We don't return None here immediately to avoid crashing app on first load if empty
-        # But generally, ingestion should have happened.
-        pass
+    """
+    Returns the chain for the currently published snapshot. Reading the
+    pointer is cheap; the chain is only rebuilt when the pointer changes, and
+    sessions still holding the previous chain keep working on its snapshot.
+    """
+    return load_rag_chain(current_snapshot(VECTOR_STORE_DIR))
 
-    # 2. Initialize Embeddings
+@st.cache_resource(max_entries=2)
+def load_rag_chain(snapshot):
+    # Initialize Embeddings and LLM (Gemini)
     if "GOOGLE_API_KEY" not in os.environ:
         st.error("❌ GOOGLE_API_KEY not found. Check your .env (or Secrets on Cloud).")
         return None
         
-    embeddings = GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL)
+    # Shared clients: every snapshot and session reuses the same connections and rate limit.
+    embeddings = CachedEmbeddings(get_embeddings("gemini", EMBEDDING_MODEL), EMBEDDING_MODEL)
+    llm = get_chat_model("gemini", LLM_MODEL, temperature=0.3, max_output_tokens=2048)
 
     try:
-        # 3. Load Vector Store
-        vectorstore = FAISS.load_local(
-            VECTOR_STORE_DIR, 
-            embeddings, 
-            index_name=FAISS_INDEX_NAME,
-            allow_dangerous_deserialization=True
-        )
-        
-        # 4. Load Doc Store
-        fs_store = LocalFileStore(DOCSTORE_DIR)
-        store = EncoderBackedStore(
-            store=fs_store,
-            key_encoder=lambda k: str(k),
-            value_serializer=serialize_document,
-            value_deserializer=deserialize_document
-        )
-        
+        return build_rag_application(embeddings, llm, snapshot)
     except Exception as e:
         st.error(f"❌ Failed to load knowledge base: {e}")
         return None
 
-    # 5. Reconstruct Retriever
-    child_splitter = RecursiveCharacterTextSplitter(chunk_size=400)
-    parent_splitter = RecursiveCharacterTextSplitter(chunk_size=2000)
+def build_rag_application(embeddings, llm, snapshot=None, vector_store_dir=VECTOR_STORE_DIR, answer_cache=ANSWER_CACHE):
+    """
+    Assembles the RAG application over `snapshot` (or the pre-snapshot layout)
+    without any Streamlit state, so scripts can use it with their own models.
+    Raises if the knowledge base can't be loaded.
+    """
+    # 1. Locate the snapshot (or the pre-snapshot layout directly under vector_store/)
+    if snapshot:
+        index_dir = snapshot_dir(snapshot, vector_store_dir)
+        docstore_path = os.path.join(index_dir, DOCSTORE_NAME)
+    else:
+        index_dir = vector_store_dir
+        docstore_path = os.path.join(vector_store_dir, DOCSTORE_NAME)
 
-    retriever = ParentDocumentRetriever(
-        vectorstore=vectorstore,
-        docstore=store,
-        child_splitter=child_splitter,
-        parent_splitter=parent_splitter,
-    )
+    # 2. Load Vector Store (memory-mapped, shared across processes via the OS cache)
+    vectorstore = load_index(embeddings, index_dir, FAISS_INDEX_NAME, mmap=True)
 
-    # 6. Initialize LLM (Gemini)
-    llm = ChatGoogleGenerativeAI(
-        model=LLM_MODEL, 
-        temperature=0.3,
-        max_output_tokens=2048
-    )
+    # 3. Load Doc Store (packing a pre-existing docstore_data/ on first use)
+    if not snapshot and not os.path.exists(docstore_path) and os.path.isdir(LEGACY_DOCSTORE_DIR):
+        migrate_legacy_docstore(LEGACY_DOCSTORE_DIR, docstore_path)
+    store = PackedDocStore(docstore_path)
+
+    # 4. Built at ingest next to the FAISS index; older snapshots don't have one.
+    lexical_index = load_lexical_index(os.path.join(index_dir, LEXICAL_INDEX_NAME))
 
-    # 7. Define Prompts
+    # 5. Reconstruct Retriever (dense + BM25 when a lexical index exists)
+    # With a reranker configured, over-fetch here and let it pick the best few.
+    scorer = make_scorer()
+    fetch_kwargs = {"top_k": RERANK_FETCH_K} if scorer else {}
+    if lexical_index is not None:
+        retriever = HybridRetriever(vectorstore=vectorstore, docstore=store, lexical_index=lexical_index, **fetch_kwargs)
+    else:
+        # Read-only parent lookup; the splitting side lives in ingest/splitters.
+        retriever = MultiVectorRetriever(
+            vectorstore=vectorstore,
+            docstore=store,
+            search_kwargs={"k": RERANK_FETCH_K} if scorer else {},
+        )
+    if scorer:
+        retriever = RerankingRetriever(base_retriever=retriever, scorer=scorer)
+
+    # 6. Define Prompts
     contextualize_q_system_prompt = """Given a chat history and the latest user question 
     which might reference context in the chat history, formulate a standalone question 
     which can be understood without the chat history. Do NOT answer the question, 
@@ -163,28 +456,33 @@ def get_rag_chain():
         ("human", "{input}"),
     ])
 
-    # 8. Build the Chain
-    def format_docs(docs):
-        return "\n\n".join(doc.page_content for doc in docs)
-
-    history_aware_retriever = (
-        contextualize_q_prompt 
-        | llm 
-        | StrOutputParser() 
-        | retriever
+    # 7. Build the Chain
+    context_retriever = ContextRetriever(
+        contextualize_q_prompt
+        | llm
+        | StrOutputParser(),
+        retriever,
     )
 
+    answer_chain = qa_prompt | llm | StrOutputParser()
+
     # Dictionary input wrapper using itemgetter
     rag_chain_runnable = (
         {
-            "context": history_aware_retriever | format_docs, 
+            "context": context_retriever.as_runnable() | format_docs, 
             "input": itemgetter("input"), 
             "chat_history": itemgetter("chat_history")
         }
-        | qa_prompt
-        | llm
-        | StrOutputParser()
+        | answer_chain
+    )
+
+    # 8. Gap analysis reads every parent, not just what a query retrieves
+    gap_analyzer = GapAnalyzer(
+        llm, lambda: docstore_documents(store), cache=GapCache(os.path.join(vector_store_dir, GAP_CACHE_NAME))
     )
 
     # 9. Return the Wrapper
-    return RAGApplication(rag_chain_runnable, retriever, llm)
\ No newline at end of file
+    return RAGApplication(
+        rag_chain_runnable, retriever, llm, context_retriever, answer_chain,
+        embeddings=embeddings, answer_cache=answer_cache, snapshot=snapshot, gap_analyzer=gap_analyzer,
+    )
\ No newline at end of file
@@ -0,0 +1,211 @@
+import os
+import time
+import asyncio
+import threading
+from typing import Any
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import numpy as np
+from langchain_core.retrievers import BaseRetriever
+
+from lexical_index import tokenize, BM25_K1, BM25_B
+from tracing import span
+
+# --- Optional cross-encoder support ---
+try:
+    from sentence_transformers import CrossEncoder
+except ImportError:
+    CrossEncoder = None
+
+# --- Configuration ---
+RERANKER = os.getenv("RERANKER", "lexical")  # lexical | cross-encoder | none
+RERANK_MODEL = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_FETCH_K = int(os.getenv("RERANK_FETCH_K", "15"))  # candidates fetched before reranking
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", "4"))  # documents kept after reranking
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "150"))
+RERANK_BATCH_SIZE = 32
+RERANK_WORKERS = 2
+
+# --- 1. Scorers ---
+class LexicalOverlapScorer:
+    """
+    Scores candidates by BM25-weighted overlap with the query terms, with the
+    term statistics taken from the candidate set itself. All candidates are
+    scored at once as a (candidates x query terms) matrix.
+    """
+
+    name = "lexical"
+
+    def score(self, query, texts):
+        terms = sorted(set(tokenize(query)))
+        if not terms or not texts:
+            return np.zeros(len(texts), dtype="float32")
+        columns = {term: i for i, term in enumerate(terms)}
+
+        tf = np.zeros((len(texts), len(terms)), dtype="float32")
+        lengths = np.zeros(len(texts), dtype="float32")
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths[row] = len(tokens)
+            for token in tokens:
+                column = columns.get(token)
+                if column is not None:
+                    tf[row, column] += 1
+
+        present = tf > 0
+        doc_freq = present.sum(axis=0)
+        idf = np.log1p((len(texts) - doc_freq + 0.5) / (doc_freq + 0.5))
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / max(float(lengths.mean()), 1.0))
+        saturated = tf * (BM25_K1 + 1) / (tf + norm[:, None])
+        # Reward covering more of the query, so one repeated term can't dominate.
+        coverage = present @ idf / max(float(idf.sum()), 1e-6)
+        return (saturated @ idf) * (1.0 + coverage)
+
+class CrossEncoderScorer:
+    """CPU cross-encoder (sentence-transformers); scores (query, text) pairs in batches."""
+
+    name = "cross-encoder"
+
+    def __init__(self, model_name=RERANK_MODEL, batch_size=RERANK_BATCH_SIZE):
+        self.model = CrossEncoder(model_name, device="cpu")
+        self.batch_size = batch_size
+
+    def score(self, query, texts):
+        if not texts:
+            return np.zeros(0, dtype="float32")
+        return np.asarray(self.model.predict([(query, text) for text in texts], batch_size=self.batch_size))
+
+def make_scorer(kind=RERANKER):
+    """The configured scorer, or None to disable reranking."""
+    if kind == "none":
+        return None
+    if kind == "cross-encoder":
+        if CrossEncoder is None:
+            print("⚠️ sentence-transformers not installed, using lexical reranking instead.")
+            return LexicalOverlapScorer()
+        try:
+            return CrossEncoderScorer()
+        except Exception as e:
+            print(f"⚠️ Could not load reranker model ({e}), using lexical reranking instead.")
+            return LexicalOverlapScorer()
+    if kind == "lexical":
+        return LexicalOverlapScorer()
+    raise ValueError(f"Unknown reranker '{kind}'")
+
+# --- 2. Reranking Retriever ---
+class RerankingRetriever(BaseRetriever):
+    """
+    Wraps a retriever that over-fetches candidates and keeps the `top_n` best
+    according to `scorer`. Scoring runs under a per-query time budget; if it
+    overruns or fails, the first `top_n` candidates in retrieval order are
+    returned instead.
+    """
+
+    base_retriever: Any
+    scorer: Any
+    top_n: int = RERANK_TOP_N
+    budget_ms: float = RERANK_BUDGET_MS
+    stats: dict = {}
+    pool: Any = None
+    lock: Any = None
+    abandoned: int = 0  # jobs still running after their query gave up on them
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.stats = {"reranked": 0, "fallbacks": 0, "skipped": 0, "last_ms": 0.0}
+        self.pool = ThreadPoolExecutor(max_workers=RERANK_WORKERS, thread_name_prefix="rerank")
+        self.lock = threading.Lock()
+
+    def rerank(self, query, docs):
+        if self.scorer is None or len(docs) <= 1:
+            return docs[:self.top_n]
+        with span("rerank", scorer=self.scorer.name, candidates=len(docs)) as s:
+            reranked = self._rerank(query, docs)
+            s.set(fallback=reranked is None)
+        return reranked if reranked is not None else docs[:self.top_n]
+
+    async def arerank(self, query, docs):
+        if self.scorer is None or len(docs) <= 1:
+            return docs[:self.top_n]
+        with span("rerank", scorer=self.scorer.name, candidates=len(docs)) as s:
+            reranked = await self._arerank(query, docs)
+            s.set(fallback=reranked is None)
+        return reranked if reranked is not None else docs[:self.top_n]
+
+    def _submit(self, query, docs):
+        """
+        Queues scoring on the pool, or returns None while every worker is held
+        by a job that already overran its budget (nothing queued would start in time).
+        """
+        with self.lock:
+            if self.abandoned >= RERANK_WORKERS:
+                self.stats["skipped"] += 1
+                return None
+        return self.pool.submit(self.scorer.score, query, [doc.page_content for doc in docs])
+
+    def _abandon(self, future):
+        """Gives up on an overrun job: a queued one is cancelled, a running one holds its worker until done."""
+        if future.cancel():
+            return
+        with self.lock:
+            self.abandoned += 1
+        future.add_done_callback(self._release)
+
+    def _release(self, future):
+        with self.lock:
+            self.abandoned -= 1
+
+    def _order(self, scores, docs):
+        # Stable sort, so ties keep their retrieval order.
+        order = np.argsort(-np.asarray(scores), kind="stable")[:self.top_n]
+        return [docs[i] for i in order]
+
+    def _finish(self, start, reranked):
+        with self.lock:
+            self.stats["last_ms"] = round((time.perf_counter() - start) * 1000, 1)
+            self.stats["reranked" if reranked is not None else "fallbacks"] += 1
+        return reranked
+
+    def _rerank(self, query, docs):
+        start = time.perf_counter()
+        future = self._submit(query, docs)
+        if future is None:
+            print("⚠️ Reranker busy, keeping retrieval order.")
+            return self._finish(start, None)
+        try:
+            reranked = self._order(future.result(timeout=self.budget_ms / 1000), docs)
+        except FutureTimeout:
+            self._abandon(future)
+            reranked = None
+            print(f"⚠️ Reranking exceeded {self.budget_ms:.0f}ms, keeping retrieval order.")
+        except Exception as e:
+            reranked = None
+            print(f"⚠️ Reranking failed ({e}), keeping retrieval order.")
+        return self._finish(start, reranked)
+
+    async def _arerank(self, query, docs):
+        start = time.perf_counter()
+        future = self._submit(query, docs)
+        if future is None:
+            print("⚠️ Reranker busy, keeping retrieval order.")
+            return self._finish(start, None)
+        waiter = asyncio.wrap_future(future)
+        try:
+            done, _ = await asyncio.wait([waiter], timeout=self.budget_ms / 1000)
+            if done:
+                reranked = self._order(waiter.result(), docs)
+            else:
+                waiter.cancel()
+                self._abandon(future)
+                reranked = None
+                print(f"⚠️ Reranking exceeded {self.budget_ms:.0f}ms, keeping retrieval order.")
+        except Exception as e:
+            reranked = None
+            print(f"⚠️ Reranking failed ({e}), keeping retrieval order.")
+        return self._finish(start, reranked)
+
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        return self.rerank(query, self.base_retriever.invoke(query))
+
+    async def _aget_relevant_documents(self, query, *, run_manager=None):
+        return await self.arerank(query, await self.base_retriever.ainvoke(query))
@@ -0,0 +1,106 @@
+import os
+import uuid
+import shutil
+import sqlite3
+from datetime import datetime, timezone
+
+# --- Configuration ---
+VECTOR_STORE_DIR = "vector_store"
+SNAPSHOT_DIRNAME = "snapshots"
+CURRENT_POINTER = "CURRENT"
+SNAPSHOT_RETENTION = int(os.getenv("SNAPSHOT_RETENTION", "3"))
+DOCSTORE_NAME = "docstore.db"
+MANIFEST_NAME = "ingest_manifest.json"
+LEXICAL_INDEX_NAME = "lexical_index.npz"
+IN_PLACE_SUFFIXES = (".db", ".f32")  # files builds modify in place; the rest are only ever replaced whole
+
+# Each build writes a complete knowledge base (index, child docs, docstore,
+# manifest) into its own directory under vector_store/snapshots/. Readers
+# follow vector_store/CURRENT, which is replaced atomically once a build is
+# complete, so they only ever see a finished snapshot. A new build shares
+# (hardlinks) the previous snapshot's files that are only replaced whole and
+# copies the ones it may modify in place.
+
+def snapshots_root(root=VECTOR_STORE_DIR):
+    return os.path.join(root, SNAPSHOT_DIRNAME)
+
+def snapshot_dir(name, root=VECTOR_STORE_DIR):
+    return os.path.join(snapshots_root(root), name)
+
+def current_snapshot(root=VECTOR_STORE_DIR):
+    """Name of the published snapshot, or None if nothing has been published yet."""
+    try:
+        with open(os.path.join(root, CURRENT_POINTER), "r", encoding="utf-8") as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return name if name and os.path.isdir(snapshot_dir(name, root)) else None
+
+def _copy_file(source, target):
+    if source.endswith(".db"):
+        # The SQLite backup API copies a consistent image, including pages still in the WAL.
+        src = sqlite3.connect(source)
+        dst = sqlite3.connect(target)
+        try:
+            src.backup(dst)
+        finally:
+            src.close()
+            dst.close()
+    elif source.endswith(IN_PLACE_SUFFIXES):
+        shutil.copy2(source, target)
+    elif not source.endswith(("-wal", "-shm")):
+        # Written via a temp file and os.replace, so the two snapshots can share it until then.
+        try:
+            os.link(source, target)
+        except OSError:
+            shutil.copy2(source, target)
+
+def begin_snapshot(root=VECTOR_STORE_DIR, base=None, seed=True):
+    """
+    Creates a new snapshot directory, seeded with the files of `base`
+    (default: the current snapshot) so an incremental build can start from
+    it, or empty when `seed` is False. Returns its name; nothing is visible
+    to readers until `publish_snapshot`.
+    """
+    name = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ") + "-" + uuid.uuid4().hex[:6]
+    target = snapshot_dir(name, root)
+    os.makedirs(target)
+
+    base = (base or current_snapshot(root)) if seed else None
+    if base:
+        source = snapshot_dir(base, root)
+        for filename in os.listdir(source):
+            _copy_file(os.path.join(source, filename), os.path.join(target, filename))
+    return name
+
+def publish_snapshot(name, root=VECTOR_STORE_DIR, retention=SNAPSHOT_RETENTION):
+    """Atomically points CURRENT at `name`, then garbage-collects old snapshots."""
+    pointer = os.path.join(root, CURRENT_POINTER)
+    tmp_path = f"{pointer}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(name)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, pointer)
+    gc_snapshots(root, retention)
+
+def discard_snapshot(name, root=VECTOR_STORE_DIR):
+    """Removes an unpublished (e.g. failed) build."""
+    if name != current_snapshot(root):
+        shutil.rmtree(snapshot_dir(name, root), ignore_errors=True)
+
+def gc_snapshots(root=VECTOR_STORE_DIR, retention=SNAPSHOT_RETENTION):
+    """
+    Keeps the `retention` newest published-or-older snapshots (always
+    including CURRENT) and deletes the rest. Builds newer than CURRENT are
+    left alone, since they may still be in progress.
+    """
+    current = current_snapshot(root)
+    if not current:
+        return []
+    names = sorted(os.listdir(snapshots_root(root)))
+    older = [name for name in names if name <= current]
+    removed = older[:-max(1, retention)]
+    for name in removed:
+        shutil.rmtree(snapshot_dir(name, root), ignore_errors=True)
+    return removed
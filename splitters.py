@@ -0,0 +1,207 @@
+import os
+import ast
+
+import yaml
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter, MarkdownHeaderTextSplitter, Language
+
+# --- Configuration ---
+PARENT_CHUNK_SIZE = 2000
+CHILD_CHUNK_SIZE = 400
+STRUCTURED_CHILD_OVERLAP = 50
+MIN_SECTION_SIZE = 300  # a section shorter than this takes its first subsection's header path
+SPLITTER_VERSION = 3  # bump whenever splitting changes, so the next ingest rebuilds
+HEADER_PATH_KEY = "header_path"
+HEADER_PATH_SEPARATOR = " > "
+PARENT_INDEX_KEY = "parent_index"  # position of a parent within its source, set at ingest
+MARKDOWN_HEADERS = [("#", "h1"), ("##", "h2"), ("###", "h3")]
+HTTP_METHODS = ("get", "put", "post", "delete", "options", "head", "patch", "trace")
+
+# Each document is split into parents (what the LLM reads) and, per parent,
+# children (what is embedded and searched). Parents follow the structure of
+# the format -- a Markdown section, an OpenAPI operation, a Python function
+# or class -- and carry their position as `header_path` metadata, e.g.
+# "System Architecture Document > 4. Security Architecture" or
+# "E-Commerce Platform API > POST /auth/login". Formats without usable
+# structure fall back to fixed-size character splitting.
+
+PLAIN_PARENT_SPLITTER = RecursiveCharacterTextSplitter(chunk_size=PARENT_CHUNK_SIZE)
+PLAIN_CHILD_SPLITTER = RecursiveCharacterTextSplitter(chunk_size=CHILD_CHUNK_SIZE)
+MARKDOWN_PARENT_SPLITTER = RecursiveCharacterTextSplitter.from_language(
+    Language.MARKDOWN, chunk_size=PARENT_CHUNK_SIZE, chunk_overlap=STRUCTURED_CHILD_OVERLAP
+)
+MARKDOWN_CHILD_SPLITTER = RecursiveCharacterTextSplitter.from_language(
+    Language.MARKDOWN, chunk_size=CHILD_CHUNK_SIZE, chunk_overlap=STRUCTURED_CHILD_OVERLAP
+)
+CODE_SPLITTER = RecursiveCharacterTextSplitter.from_language(
+    Language.PYTHON, chunk_size=PARENT_CHUNK_SIZE, chunk_overlap=STRUCTURED_CHILD_OVERLAP
+)
+YAML_SPLITTER = RecursiveCharacterTextSplitter(
+    chunk_size=PARENT_CHUNK_SIZE, chunk_overlap=STRUCTURED_CHILD_OVERLAP, separators=["\n\n", "\n", " ", ""]
+)
+
+def _document(text, metadata, header_path=None):
+    metadata = dict(metadata)
+    if header_path:
+        metadata[HEADER_PATH_KEY] = HEADER_PATH_SEPARATOR.join(header_path)
+    return Document(page_content=text, metadata=metadata)
+
+def _with_children(parents, child_splitter):
+    return [(parent, child_splitter.split_documents([parent])) for parent in parents]
+
+def _whole_units(parents, oversize_splitter):
+    """Parents that are self-contained units (an operation, a function) are embedded whole."""
+    pairs = []
+    for parent in parents:
+        pieces = [parent] if len(parent.page_content) <= PARENT_CHUNK_SIZE else oversize_splitter.split_documents([parent])
+        pairs.extend((piece, [_document(piece.page_content, piece.metadata)]) for piece in pieces)
+    return pairs
+
+# --- 1. Markdown ---
+def split_markdown(doc):
+    sections = MarkdownHeaderTextSplitter(MARKDOWN_HEADERS, strip_headers=False).split_text(doc.page_content)
+    groups = []  # [headers, texts, size]
+    for section in sections:
+        headers = [section.metadata[key] for _, key in MARKDOWN_HEADERS if key in section.metadata]
+        size = len(section.page_content)
+        if groups:
+            previous = groups[-1]
+            nested = len(headers) > len(previous[0]) and headers[:len(previous[0])] == previous[0]
+            if nested and previous[2] + size <= PARENT_CHUNK_SIZE:
+                # A subsection stays with its section. When the section so far
+                # is only a title or an intro line, the subsection names the group.
+                if previous[2] < MIN_SECTION_SIZE:
+                    previous[0] = headers
+                previous[1].append(section.page_content)
+                previous[2] += size
+                continue
+        groups.append([headers, [section.page_content], size])
+
+    parents = []
+    for headers, texts, _ in groups:
+        parent = _document("\n\n".join(texts), doc.metadata, headers)
+        if len(parent.page_content) > PARENT_CHUNK_SIZE:
+            parents.extend(MARKDOWN_PARENT_SPLITTER.split_documents([parent]))
+        else:
+            parents.append(parent)
+    return _with_children(parents, MARKDOWN_CHILD_SPLITTER)
+
+# --- 2. OpenAPI ---
+def _dump(value):
+    return yaml.safe_dump(value, sort_keys=False, allow_unicode=True, default_flow_style=False)
+
+def split_openapi(doc):
+    """One parent per operation (plus the API overview and each component section); None if not a spec."""
+    try:
+        spec = yaml.safe_load(doc.page_content)
+    except yaml.YAMLError:
+        return None
+    if not isinstance(spec, dict) or not ("openapi" in spec or "swagger" in spec) or not isinstance(spec.get("paths"), dict):
+        return None
+
+    title = str((spec.get("info") or {}).get("title") or os.path.basename(doc.metadata.get("source", "API")))
+    parents = []
+    overview = {key: value for key, value in spec.items() if key not in ("paths", "components")}
+    if overview:
+        parents.append(_document(_dump(overview), doc.metadata, [title]))
+
+    for path, item in spec["paths"].items():
+        if not isinstance(item, dict):
+            continue
+        # Path-level fields (shared parameters, summary) apply to every operation.
+        shared = {key: value for key, value in item.items() if key not in HTTP_METHODS}
+        for method in HTTP_METHODS:
+            if method not in item:
+                continue
+            operation = f"{method.upper()} {path}"
+            text = f"{operation}\n" + _dump({path: {**shared, method: item[method]}})
+            parents.append(_document(text, doc.metadata, [title, operation]))
+
+    for section, entries in (spec.get("components") or {}).items():
+        text = _dump({"components": {section: entries}})
+        if len(text) <= PARENT_CHUNK_SIZE or not isinstance(entries, dict):
+            parents.append(_document(text, doc.metadata, [title, "components", section]))
+            continue
+        for name, value in entries.items():
+            parents.append(_document(_dump({"components": {section: {name: value}}}), doc.metadata, [title, section, name]))
+    return _whole_units(parents, YAML_SPLITTER)
+
+# --- 3. Python ---
+DEFINITIONS = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+
+def _first_line(node):
+    """0-based first line of a statement, decorators included."""
+    return min([decorator.lineno for decorator in getattr(node, "decorator_list", [])] + [node.lineno]) - 1
+
+def split_python(doc):
+    """
+    One parent per top-level function or class; a class too large for one
+    parent is split into its header (docstring, attributes) and its methods.
+    Runs of small neighbours (one-line helpers, constants) are merged.
+    """
+    source = doc.page_content
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        return None
+    lines = source.splitlines(keepends=True)
+    module = os.path.basename(doc.metadata.get("source", "module.py"))
+
+    def units(nodes, start, stop, prefix):
+        # Each unit runs from the end of the previous one, so comments above a
+        # definition stay with it; consecutive plain statements form one unit.
+        spans = []  # [node or None, first line, last line]
+        for node in nodes:
+            if not isinstance(node, DEFINITIONS) and spans and spans[-1][0] is None:
+                spans[-1][2] = node.end_lineno
+            else:
+                spans.append([node if isinstance(node, DEFINITIONS) else None, start, node.end_lineno])
+            start = node.end_lineno
+        if spans:
+            spans[-1][2] = max(spans[-1][2], stop)
+
+        found = []  # (prefix, names, text)
+        for node, first, last in spans:
+            text = "".join(lines[first:last])
+            names = [node.name] if node is not None else []
+            methods = [i for i, child in enumerate(getattr(node, "body", [])) if isinstance(child, DEFINITIONS)]
+            if isinstance(node, ast.ClassDef) and len(text) > PARENT_CHUNK_SIZE and methods:
+                first_method = methods[0]
+                body_start = node.body[first_method - 1].end_lineno if first_method else _first_line(node.body[0])
+                found.append((prefix, names, "".join(lines[first:body_start])))
+                found.extend(units(node.body[first_method:], body_start, last, prefix + names))
+            elif text.strip():
+                found.append((prefix, names, text))
+        return found
+
+    merged = []
+    for prefix, names, text in units(tree.body, 0, len(lines), [module]):
+        previous = merged[-1] if merged else None
+        siblings = previous and previous[0] == prefix and bool(previous[1]) == bool(names)
+        if siblings and len(previous[2]) + len(text) <= CHILD_CHUNK_SIZE:
+            previous[1].extend(names)
+            previous[2] += text
+        else:
+            merged.append([prefix, list(names), text])
+    parents = [
+        _document(text, doc.metadata, prefix + ([", ".join(names)] if names else []))
+        for prefix, names, text in merged
+    ]
+    return _whole_units(parents, CODE_SPLITTER)
+
+# --- 4. Dispatch ---
+def split_plain(doc):
+    return _with_children(PLAIN_PARENT_SPLITTER.split_documents([doc]), PLAIN_CHILD_SPLITTER)
+
+STRUCTURED_SPLITTERS = {
+    "markdown": split_markdown,
+    "yaml": split_openapi,
+    "json": split_openapi,
+    "python": split_python,
+}
+
+def split_document(doc):
+    """[(parent, [children])] for one document, using its format's splitter when it has one."""
+    splitter = STRUCTURED_SPLITTERS.get(doc.metadata.get("file_type"))
+    pairs = splitter(doc) if splitter else None
+    return pairs if pairs else split_plain(doc)
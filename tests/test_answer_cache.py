@@ -0,0 +1,34 @@
+from answer_cache import AnswerCache
+from rag_backend import RAGApplication
+
+def test_snapshots_keep_separate_entries():
+    cache = AnswerCache(threshold=0.9)
+    cache.put("old", [1.0, 0.0], "q", "old answer", [])
+    cache.put("new", [1.0, 0.0], "q", "new answer", [])
+
+    # Sessions on either snapshot keep their own answers.
+    assert cache.get("old", [1.0, 0.0])["answer"] == "old answer"
+    assert cache.get("new", [1.0, 0.0])["answer"] == "new answer"
+    assert cache.get("other", [1.0, 0.0]) is None
+    assert cache.stats()["entries"] == 2
+
+def test_least_recently_used_snapshot_is_dropped():
+    cache = AnswerCache(threshold=0.9, max_snapshots=2)
+    for snapshot in ("a", "b"):
+        cache.put(snapshot, [1.0, 0.0], "q", snapshot, [])
+    cache.get("a", [1.0, 0.0])
+    cache.put("c", [1.0, 0.0], "q", "c", [])
+    assert cache.stats()["snapshots"] == ["a", "c"]
+    assert cache.get("b", [1.0, 0.0]) is None
+
+def test_entries_are_bounded_per_snapshot():
+    cache = AnswerCache(threshold=0.9, max_entries=1)
+    cache.put("a", [1.0, 0.0], "first", "1", [])
+    cache.put("a", [0.0, 1.0], "second", "2", [])
+    assert cache.get("a", [1.0, 0.0]) is None
+    assert cache.get("a", [0.0, 1.0])["answer"] == "2"
+
+def test_follow_up_questions_skip_the_cache():
+    app = RAGApplication(None, None, None, answer_cache=AnswerCache())
+    assert app.use_answer_cache({"input": "What database is used?", "chat_history": []})
+    assert not app.use_answer_cache({"input": "What about the second one?", "chat_history": ["earlier turn"]})
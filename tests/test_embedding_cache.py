@@ -0,0 +1,58 @@
+import itertools
+
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+import embedding_cache
+from embedding_cache import CachedEmbeddings, KEY_BYTES
+
+DIMENSION = 8
+ROW_BYTES = KEY_BYTES + DIMENSION * 4
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A strictly increasing clock, so last_used never ties."""
+    ticks = itertools.count(1)
+    monkeypatch.setattr(embedding_cache.time, "time", lambda: float(next(ticks)))
+
+def cache(tmp_path, **kwargs):
+    return CachedEmbeddings(DeterministicFakeEmbedding(size=DIMENSION), "fake", path=str(tmp_path / "cache.db"), **kwargs)
+
+def cached_keys(embeddings):
+    return {row[0] for row in embeddings._connect().execute("SELECT key FROM embeddings")}
+
+def test_hits_and_misses(tmp_path):
+    embeddings = cache(tmp_path)
+    first = embeddings.embed_documents(["a", "b", "a"])
+    assert (embeddings.hits, embeddings.misses) == (1, 2)
+    assert embeddings.embed_documents(["a", "b", "a"]) == first
+    assert (embeddings.hits, embeddings.misses) == (4, 2)
+    # Queries are keyed separately from documents.
+    embeddings.embed_query("a")
+    assert (embeddings.hits, embeddings.misses) == (4, 3)
+    assert embeddings.stats()["size_bytes"] == 3 * ROW_BYTES
+
+def test_replacing_a_key_keeps_the_size_exact(tmp_path):
+    embeddings = cache(tmp_path)
+    embeddings.embed_documents(["a"])
+    key = embeddings._key("document", "a")
+    embeddings._put_many([(key, [1.0] * DIMENSION)])
+    assert embeddings.size_bytes() == ROW_BYTES
+    embeddings._size = None  # recount from the table
+    assert embeddings.size_bytes() == ROW_BYTES
+
+def test_evicts_least_recently_used(tmp_path, clock):
+    embeddings = cache(tmp_path, max_bytes=5 * ROW_BYTES)
+    for text in ["a", "b", "c", "d", "e"]:
+        embeddings.embed_documents([text])
+    embeddings.embed_documents(["a"])  # now the most recently used
+    embeddings.embed_documents(["f"])
+
+    assert embeddings.size_bytes() <= 5 * ROW_BYTES
+    keys = cached_keys(embeddings)
+    assert embeddings._key("document", "a") in keys
+    assert embeddings._key("document", "f") in keys
+    # Filling up evicts down to 90% of the budget, oldest first: b and c.
+    assert embeddings._key("document", "b") not in keys
+    assert embeddings._key("document", "c") not in keys
+    assert embeddings._key("document", "d") in keys
@@ -0,0 +1,54 @@
+import threading
+
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from embedding_pipeline import EmbeddingPipeline, EmbeddingError, build_batches
+
+class FlakyEmbeddings:
+    """
+    Fails the first `failures` calls, then embeds with a deterministic fake.
+    The fake seeds numpy's global RNG, so concurrent batches take turns.
+    """
+
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = []
+        self.lock = threading.Lock()
+        self.fake = DeterministicFakeEmbedding(size=8)
+
+    def embed_documents(self, texts):
+        with self.lock:
+            self.calls.append(len(texts))
+            if len(self.calls) <= self.failures:
+                raise RuntimeError("429 Resource exhausted")
+            return self.fake.embed_documents(texts)
+
+def test_batches_respect_item_and_token_caps():
+    texts = ["x" * 40] * 5  # 11 estimated tokens each
+    assert build_batches(texts, max_items=2, max_tokens=1000) == [(0, 2), (2, 4), (4, 5)]
+    assert build_batches(texts, max_items=100, max_tokens=25) == [(0, 2), (2, 4), (4, 5)]
+    # A text over the token cap still gets a batch of its own.
+    assert build_batches(["x" * 400, "y"], max_items=100, max_tokens=25) == [(0, 1), (1, 2)]
+    assert build_batches([]) == []
+
+def test_vectors_come_back_in_input_order():
+    texts = [f"chunk {i}" for i in range(23)]
+    embeddings = FlakyEmbeddings(failures=0)
+    vectors = EmbeddingPipeline(embeddings, batch_size=5, max_inflight=4, backoff=0).embed(texts)
+    assert vectors == embeddings.fake.embed_documents(texts)
+    assert sorted(embeddings.calls) == [3, 5, 5, 5, 5]
+
+def test_failed_batch_is_retried():
+    embeddings = FlakyEmbeddings(failures=2)
+    pipeline = EmbeddingPipeline(embeddings, max_inflight=1, max_retries=2, backoff=0)
+    assert len(pipeline.embed(["a", "b"])) == 2
+    assert pipeline.stats["retries"] == 2
+    assert len(embeddings.calls) == 3
+
+def test_gives_up_after_max_retries():
+    embeddings = FlakyEmbeddings(failures=10)
+    pipeline = EmbeddingPipeline(embeddings, max_inflight=1, max_retries=1, backoff=0)
+    with pytest.raises(EmbeddingError):
+        pipeline.embed(["a", "b"])
+    assert len(embeddings.calls) == 2
@@ -0,0 +1,44 @@
+import random
+
+from langchain_core.documents import Document
+from langchain_core.runnables import RunnableLambda
+
+from gap_analyzer import GapAnalyzer, group_documents
+from ingest import split_source
+
+def test_groups_follow_the_source_order():
+    paragraphs = [f"Paragraph {i}: " + " ".join(f"word{i}-{j}" for j in range(60)) for i in range(40)]
+    doc = Document(page_content="\n\n".join(paragraphs), metadata={"source": "data/notes.txt", "file_type": "txt"})
+    parents, _, _, _ = split_source([doc])
+    assert len(parents) > 1
+
+    shuffled = list(parents)
+    random.Random(0).shuffle(shuffled)
+    expected = group_documents(parents, budget=10**9)
+    assert group_documents(shuffled, budget=10**9) == expected
+    assert expected[0][1].index("Paragraph 0:") < expected[0][1].index("Paragraph 39:")
+
+def fake_llm(failing):
+    """Map calls fail for sources in `failing`; everything else gets a canned answer."""
+    def call(prompt):
+        text = prompt.to_string()
+        if "EXCERPT:" not in text:
+            return "REPORT"
+        if any(f"SOURCE: {name}" in text for name in failing):
+            raise RuntimeError("quota exceeded")
+        return "- PROMISE: login [Auth]"
+    return RunnableLambda(call)
+
+DOCS = [Document(page_content=f"{name} text", metadata={"source": name}) for name in ["a.md", "b.md"]]
+
+def test_report_lists_failed_sections():
+    report = GapAnalyzer(fake_llm({"b.md"}), lambda: DOCS, workers=1).run()
+    assert report.startswith("REPORT")
+    assert "Not analysed" in report and "b.md: quota exceeded" in report
+
+def test_report_is_an_error_when_every_section_failed():
+    events = list(GapAnalyzer(fake_llm({"a.md", "b.md"}), lambda: DOCS, workers=1).stream())
+    report = events[-1]
+    assert report["type"] == "report" and report["error"]
+    assert "No requirements" not in report["text"]
+    assert "a.md: quota exceeded" in report["text"]
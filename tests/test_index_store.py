@@ -0,0 +1,80 @@
+import os
+
+import faiss
+import numpy as np
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+import index_store
+from index_store import index_paths, new_index, load_index, save_index, make_mutable, synthetic_vectors
+
+DIMENSION = 16
+
+def add_vectors(vectorstore, vectors, start):
+    ids = [f"child-{i}" for i in range(start, start + len(vectors))]
+    vectorstore.add_embeddings([(f"text {i}", list(map(float, v))) for i, v in zip(ids, vectors)], ids=ids)
+
+def reopen(folder):
+    """What an incremental ingest does: load the saved store and make it mutable, with no embedder."""
+    return make_mutable(load_index(None, folder, "idx", mmap=False), None, folder, "idx")
+
+@pytest.fixture
+def count_builds(monkeypatch):
+    builds = []
+    original = index_store.build_index
+
+    def build_index(vectors, kind, params=None):
+        builds.append(kind)
+        return original(vectors, kind, params)
+
+    monkeypatch.setattr(index_store, "build_index", build_index)
+    return builds
+
+def test_ivfpq_incremental_run_reuses_saved_vectors_and_codebooks(tmp_path, count_builds):
+    folder = str(tmp_path)
+    vectors = synthetic_vectors(index_store.IVFPQ_MIN_TRAIN + 100, DIMENSION)
+    store = new_index(DeterministicFakeEmbedding(size=DIMENSION), DIMENSION, folder, "idx")
+    add_vectors(store, vectors, 0)
+    save_index(store, folder, "idx", kind="ivfpq")
+    assert count_builds == ["ivfpq"]
+    paths = index_paths(folder, "idx")
+    assert os.path.getsize(paths["vectors"]) == vectors.nbytes
+
+    # Re-opening needs no embedder: the exact vectors come from the saved file.
+    store = reopen(folder)
+    np.testing.assert_array_equal(store.index.reconstruct_n(0, store.index.ntotal), vectors)
+
+    # Appending only adds the new entries to the trained index.
+    extra = synthetic_vectors(10, DIMENSION, seed=1)
+    add_vectors(store, extra, len(vectors))
+    save_index(store, folder, "idx", kind="ivfpq")
+    assert count_builds == ["ivfpq", "flat"]  # the flat one is make_mutable's working copy
+    assert faiss.read_index(paths["index"]).ntotal == len(vectors) + len(extra)
+    assert os.path.getsize(paths["vectors"]) == vectors.nbytes + extra.nbytes
+
+    # Deleting re-encodes with the existing codebooks instead of retraining.
+    store = reopen(folder)
+    store.delete(["child-0", "child-1"])
+    save_index(store, folder, "idx", kind="ivfpq")
+    assert count_builds == ["ivfpq", "flat", "flat"]
+    assert faiss.read_index(paths["index"]).ntotal == len(vectors) + len(extra) - 2
+    assert os.path.getsize(paths["vectors"]) == (len(vectors) + len(extra) - 2) * DIMENSION * 4
+
+def test_hnsw_append_extends_the_saved_graph(tmp_path, count_builds):
+    folder = str(tmp_path)
+    store = new_index(DeterministicFakeEmbedding(size=DIMENSION), DIMENSION, folder, "idx")
+    add_vectors(store, synthetic_vectors(500, DIMENSION), 0)
+    save_index(store, folder, "idx", kind="hnsw")
+
+    store = reopen(folder)
+    add_vectors(store, synthetic_vectors(20, DIMENSION, seed=1), 500)
+    save_index(store, folder, "idx", kind="hnsw")
+    assert count_builds == ["hnsw", "flat"]
+    assert faiss.read_index(index_paths(folder, "idx")["index"]).ntotal == 520
+    assert not os.path.exists(index_paths(folder, "idx")["vectors"])
+
+    # A deletion can't be applied to a graph, so that run rebuilds it.
+    store = reopen(folder)
+    store.delete(["child-3"])
+    save_index(store, folder, "idx", kind="hnsw")
+    assert count_builds == ["hnsw", "flat", "flat", "hnsw"]
@@ -0,0 +1,47 @@
+import os
+
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from ingest import run_ingest, FAISS_INDEX_NAME
+from index_store import load_index
+from lexical_index import load_lexical_index
+from snapshots import current_snapshot, snapshot_dir, snapshots_root, LEXICAL_INDEX_NAME
+
+def write(path, text):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+def indexed_sources(store_dir):
+    folder = snapshot_dir(current_snapshot(store_dir), store_dir)
+    vectorstore = load_index(None, folder, FAISS_INDEX_NAME, mmap=False)
+    # The lexical index is updated incrementally and must hold exactly the FAISS chunks.
+    lexical = load_lexical_index(os.path.join(folder, LEXICAL_INDEX_NAME))
+    assert sorted(lexical.ids) == sorted(vectorstore.index_to_docstore_id.values())
+    docs = [vectorstore.docstore.search(i) for i in vectorstore.index_to_docstore_id.values()]
+    return {os.path.basename(doc.metadata["source"]) for doc in docs}
+
+def ingest(data_dir, store_dir):
+    return run_ingest(DeterministicFakeEmbedding(size=16), vector_store_dir=store_dir, data_dir=data_dir, include_notion=False)
+
+def test_manifest_tracks_added_updated_removed_and_unchanged(tmp_path):
+    data_dir, store_dir = str(tmp_path / "data"), str(tmp_path / "store")
+    os.makedirs(data_dir)
+    write(os.path.join(data_dir, "a.md"), "# Alpha\n\nThe login flow issues tokens.\n")
+    write(os.path.join(data_dir, "b.txt"), "Deployment runs on docker.\n")
+
+    report = ingest(data_dir, store_dir)
+    assert (report["added"], report["updated"], report["removed"], report["unchanged"]) == (2, 0, 0, 0)
+    assert indexed_sources(store_dir) == {"a.md", "b.txt"}
+
+    snapshots = os.listdir(snapshots_root(store_dir))
+    report = ingest(data_dir, store_dir)
+    assert (report["added"], report["updated"], report["removed"], report["unchanged"]) == (0, 0, 0, 2)
+    # Nothing changed, so no snapshot was built.
+    assert os.listdir(snapshots_root(store_dir)) == snapshots
+
+    write(os.path.join(data_dir, "a.md"), "# Alpha\n\nThe login flow issues refresh tokens.\n")
+    os.remove(os.path.join(data_dir, "b.txt"))
+    write(os.path.join(data_dir, "c.txt"), "Payments are pending.\n")
+    report = ingest(data_dir, store_dir)
+    assert (report["added"], report["updated"], report["removed"], report["unchanged"]) == (1, 1, 1, 0)
+    assert indexed_sources(store_dir) == {"a.md", "c.txt"}
@@ -0,0 +1,38 @@
+import pytest
+
+from lexical_index import LexicalIndex
+
+TEXTS = {
+    "c1": "The login flow issues JWT tokens via /auth/login",
+    "c2": "Deployment runs on docker with postgres",
+    "c3": "Payments are pending; the refund endpoint is missing",
+    "c4": "user_id is required on /api/v1/users",
+    "c5": "Docker images are built in CI and pushed to the registry",
+}
+QUERIES = ["login tokens", "docker postgres", "refund", "user_id", "registry CI", "missing endpoint"]
+
+def build(ids):
+    return LexicalIndex.build(ids, [f"parent-{i}" for i in ids], [TEXTS[i] for i in ids])
+
+def ranked(index, query):
+    return [(index.ids[row], round(score, 5)) for row, score in index.search(query)]
+
+def test_update_matches_a_full_rebuild(tmp_path):
+    updated = build(["c1", "c2", "c3"]).update(["c2"], ["c4", "c5"], ["parent-c4", "parent-c5"], [TEXTS["c4"], TEXTS["c5"]])
+    rebuilt = build(["c1", "c3", "c4", "c5"])
+
+    assert sorted(updated.ids) == sorted(rebuilt.ids)
+    assert updated.parent_ids[updated.rows["c5"]] == "parent-c5"
+    for query in QUERIES:
+        assert ranked(updated, query) == pytest.approx(ranked(rebuilt, query))
+    # Terms that only the removed chunk had are gone.
+    assert "postgres" not in updated.term_ids
+
+    path = str(tmp_path / "lexical.npz")
+    updated.save(path)
+    assert ranked(LexicalIndex.load(path), "docker") == ranked(updated, "docker")
+
+def test_update_can_remove_everything():
+    index = build(["c1", "c2"]).update(["c1", "c2"], [], [], [])
+    assert len(index) == 0
+    assert index.search("login") == []
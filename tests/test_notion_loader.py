@@ -0,0 +1,67 @@
+from notion_loader import NotionCrawler, FakeNotionClient, paragraph_block, child_page_block
+
+SYNCED_AT = "2024-06-01T00:00:00.000Z"
+
+def toggle_block(block_id, text):
+    return {"object": "block", "id": block_id, "type": "toggle", "has_children": True,
+            "toggle": {"rich_text": [{"plain_text": text}]}}
+
+def workspace():
+    """A root page with two child pages; the root nests toggles two levels deep."""
+    return {
+        "root": {"title": "Root", "blocks": [
+            paragraph_block("intro"),
+            toggle_block("toggle-a", "toggle a"),
+            toggle_block("toggle-b", "toggle b"),
+            child_page_block("child-1", "Child 1"),
+            child_page_block("child-2", "Child 2"),
+            paragraph_block("outro"),
+        ]},
+        "toggle-a": {"title": "", "blocks": [toggle_block("toggle-a1", "inner a1"), paragraph_block("after a1")]},
+        "toggle-a1": {"title": "", "blocks": [paragraph_block("deepest")]},
+        "toggle-b": {"title": "", "blocks": [paragraph_block("inside b")]},
+        "child-1": {"title": "Child 1", "blocks": [paragraph_block("first child")]},
+        "child-2": {"title": "Child 2", "blocks": [paragraph_block("second child")]},
+    }
+
+def crawl(client, cursor=None):
+    crawler = NotionCrawler(client, requests_per_second=1_000_000, cursor=cursor)
+    docs = crawler.crawl("root")
+    return crawler, {doc.metadata["page_id"]: doc.page_content for doc in docs}
+
+def test_nested_blocks_keep_document_order():
+    client = FakeNotionClient(workspace(), page_size=2)
+    crawler, docs = crawl(client)
+
+    lines = [line for line in docs["root"].split("\n") if line]
+    assert lines == ["intro", "toggle a", "inner a1", "deepest", "after a1", "toggle b", "inside b", "outro"]
+    assert docs["child-1"] == "first child\n"
+    assert set(docs) == {"root", "child-1", "child-2"}
+    assert crawler.stats["fetched"] == 3
+    assert crawler.stats["requests"] == client.calls
+
+def test_unchanged_workspace_costs_one_request():
+    client = FakeNotionClient(workspace())
+    first, docs = crawl(client)
+
+    client.calls = 0
+    second, cached_docs = crawl(client, {"synced_at": SYNCED_AT, "pages": first.pages_state})
+    assert cached_docs == docs
+    assert client.calls == 1  # the search for edit times
+    assert second.stats["skipped"] == 3
+    assert second.stats["fetched"] == 0
+
+def test_removed_page_is_dropped_on_delta_crawl():
+    pages = workspace()
+    client = FakeNotionClient(pages)
+    first, _ = crawl(client)
+
+    del pages["child-2"]
+    pages["root"]["blocks"] = [b for b in pages["root"]["blocks"] if b.get("id") != "child-2"]
+    pages["root"]["last_edited_time"] = "2024-07-01T00:00:00.000Z"
+    second, docs = crawl(client, {"synced_at": SYNCED_AT, "pages": first.pages_state})
+
+    assert set(docs) == {"root", "child-1"}
+    assert second.stats["removed"] == 1
+    assert second.stats["fetched"] == 1
+    assert "child-2" not in second.pages_state
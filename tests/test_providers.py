@@ -0,0 +1,48 @@
+import asyncio
+
+import pytest
+
+from providers import ProviderLimits
+
+def test_async_slot_waits_for_a_thread_to_release():
+    limits = ProviderLimits(requests_per_second=1000, max_inflight=1)
+    order = []
+
+    async def use_slot():
+        async with limits.aslot():
+            order.append("coroutine")
+
+    async def main():
+        with limits.slot():
+            task = asyncio.create_task(use_slot())
+            await asyncio.sleep(0.05)
+            assert not task.done()
+            order.append("thread")
+        await asyncio.wait_for(task, 1)
+
+    asyncio.run(main())
+    assert order == ["thread", "coroutine"]
+
+def test_cancelled_waiter_gives_its_slot_back():
+    limits = ProviderLimits(requests_per_second=1000, max_inflight=1)
+
+    async def main():
+        async def wait_for_slot():
+            async with limits.aslot():
+                pass
+
+        with limits.slot():
+            task = asyncio.create_task(wait_for_slot())
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+    asyncio.run(main())
+    # The abandoned acquire completes on its worker thread and is released again.
+    for _ in range(100):
+        if limits._slots.acquire(timeout=0.01):
+            break
+    else:
+        pytest.fail("slot was never released")
+    limits._slots.release()
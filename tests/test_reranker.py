@@ -0,0 +1,86 @@
+import asyncio
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import langchain_core.retrievers
+
+from langchain_core.documents import Document
+
+from reranker import RerankingRetriever, LexicalOverlapScorer, RERANK_WORKERS
+
+DOCS = [Document(page_content=text) for text in ["unrelated text", "login flow", "login tokens and the login flow"]]
+
+class ListRetriever:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def invoke(self, query):
+        return list(self.docs)
+
+    async def ainvoke(self, query):
+        return list(self.docs)
+
+class BlockingScorer:
+    """Scores nothing until released, so every job overruns the budget."""
+
+    name = "blocking"
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.calls = 0
+
+    def score(self, query, texts):
+        self.calls += 1
+        self.release.wait(5)
+        return [0.0] * len(texts)
+
+def test_reranks_within_budget():
+    retriever = RerankingRetriever(base_retriever=ListRetriever(DOCS), scorer=LexicalOverlapScorer(), top_n=2, budget_ms=1000)
+    docs = retriever.invoke("login flow")
+    # The unrelated first candidate is dropped in favour of the two matches.
+    assert [doc.page_content for doc in docs] == ["login flow", "login tokens and the login flow"]
+    assert retriever.stats["reranked"] == 1
+
+def test_timed_out_jobs_block_new_scoring():
+    scorer = BlockingScorer()
+    retriever = RerankingRetriever(base_retriever=ListRetriever(DOCS), scorer=scorer, top_n=2, budget_ms=20)
+    try:
+        for _ in range(RERANK_WORKERS + 2):
+            assert retriever.invoke("login") == DOCS[:2]
+        # Only one job per worker was started; later queries fell back without queueing.
+        assert scorer.calls == RERANK_WORKERS
+        assert retriever.stats["skipped"] == 2
+        assert retriever.stats["fallbacks"] == RERANK_WORKERS + 2
+    finally:
+        scorer.release.set()
+        retriever.pool.shutdown(wait=True)
+    assert retriever.abandoned == 0
+
+class SlowScorer(LexicalOverlapScorer):
+    def score(self, query, texts):
+        time.sleep(0.01)
+        return super().score(query, texts)
+
+def test_concurrent_queries_queue_within_budget():
+    retriever = RerankingRetriever(base_retriever=ListRetriever(DOCS), scorer=SlowScorer(), top_n=2, budget_ms=2000)
+    with ThreadPoolExecutor(max_workers=RERANK_WORKERS * 4) as pool:
+        results = list(pool.map(retriever.invoke, ["login flow"] * 16))
+    assert all(docs[0].page_content == "login flow" for docs in results)
+    assert retriever.stats["reranked"] == 16
+    assert retriever.stats["skipped"] == 0
+
+def test_async_path_does_not_use_the_default_executor(monkeypatch):
+    calls = []
+    original = langchain_core.retrievers.run_in_executor
+
+    async def run_in_executor(*args, **kwargs):
+        calls.append(args)
+        return await original(*args, **kwargs)
+
+    monkeypatch.setattr(langchain_core.retrievers, "run_in_executor", run_in_executor)
+    retriever = RerankingRetriever(base_retriever=ListRetriever(DOCS), scorer=LexicalOverlapScorer(), top_n=2, budget_ms=1000)
+    docs = asyncio.run(retriever.ainvoke("login flow"))
+    assert [doc.page_content for doc in docs] == ["login flow", "login tokens and the login flow"]
+    assert calls == []
+    assert retriever.stats["reranked"] == 1
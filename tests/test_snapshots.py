@@ -0,0 +1,32 @@
+import os
+
+from snapshots import begin_snapshot, publish_snapshot, snapshot_dir, snapshots_root
+
+def write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+def test_new_snapshot_shares_replaced_files_and_copies_in_place_ones(tmp_path):
+    root = str(tmp_path)
+    first = begin_snapshot(root)
+    source = snapshot_dir(first, root)
+    for name in ["faiss_index.faiss", "faiss_index.ids.json", "faiss_index.vectors.f32"]:
+        write(os.path.join(source, name), b"data")
+    publish_snapshot(first, root)
+
+    target = snapshot_dir(begin_snapshot(root), root)
+
+    def same_file(name):
+        return os.path.samefile(os.path.join(source, name), os.path.join(target, name))
+
+    assert same_file("faiss_index.faiss") and same_file("faiss_index.ids.json")
+    assert not same_file("faiss_index.vectors.f32")
+
+def test_unseeded_snapshot_starts_empty(tmp_path):
+    root = str(tmp_path)
+    first = begin_snapshot(root)
+    write(os.path.join(snapshot_dir(first, root), "faiss_index.faiss"), b"data")
+    publish_snapshot(first, root)
+
+    assert os.listdir(snapshot_dir(begin_snapshot(root, seed=False), root)) == []
+    assert len(os.listdir(snapshots_root(root))) == 2
@@ -0,0 +1,135 @@
+import os
+import json
+import time
+import uuid
+import threading
+import contextvars
+from collections import deque
+
+# --- Configuration ---
+TRACE_ENABLED = os.getenv("RAG_TRACE", "0") == "1"
+TRACE_FILE = os.getenv("RAG_TRACE_FILE")  # optional JSONL export, one span per line
+TRACE_BUFFER_SIZE = int(os.getenv("RAG_TRACE_BUFFER", "100"))  # finished traces kept in memory
+
+# Spans nest through a context variable, so any code running inside a span
+# (including helpers several calls down) attaches its own spans to it. A span
+# with no parent starts a new trace, which is finished when that span ends.
+# Records follow the OpenTelemetry span shape (ids, unix-nano timestamps,
+# attributes, status) so the JSONL export can be loaded by OTel tooling.
+
+_enabled = TRACE_ENABLED
+_current = contextvars.ContextVar("current_span", default=None)
+_finished = deque(maxlen=TRACE_BUFFER_SIZE)
+_lock = threading.Lock()
+
+def enabled():
+    return _enabled
+
+def set_enabled(flag):
+    global _enabled
+    _enabled = bool(flag)
+
+class Span:
+    __slots__ = ("name", "parent", "trace_id", "span_id", "attributes", "records", "status",
+                 "start_ns", "_start", "_token")
+
+    def __init__(self, name, parent, attributes):
+        self.name = name
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.attributes = attributes
+        self.records = parent.records if parent else []
+        self.status = "OK"
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self.start_ns = time.time_ns()
+        self._start = time.perf_counter()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration_ms = (time.perf_counter() - self._start) * 1000
+        if exc_type is not None:
+            self.status = "ERROR"
+            self.attributes["error"] = f"{exc_type.__name__}: {exc}"
+        try:
+            _current.reset(self._token)
+        except ValueError:
+            # Exited in a different context (e.g. a generator closed elsewhere).
+            _current.set(self.parent)
+        self.records.append({
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent.span_id if self.parent else None,
+            "name": self.name,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.start_ns + int(duration_ms * 1_000_000),
+            "durationMs": round(duration_ms, 3),
+            "attributes": self.attributes,
+            "status": {"code": self.status},
+        })
+        if self.parent is None:
+            _finish_trace(self.records)
+        return False
+
+class _NoopSpan:
+    """Returned by `span` while tracing is disabled; every operation is a no-op."""
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+NOOP_SPAN = _NoopSpan()
+
+def span(name, **attributes):
+    """Context manager timing a block: `with span("faiss_search", k=4) as s: ...; s.set(hits=3)`."""
+    if not _enabled:
+        return NOOP_SPAN
+    return Span(name, _current.get(), attributes)
+
+def _finish_trace(records):
+    records.sort(key=lambda record: record["startTimeUnixNano"])
+    with _lock:
+        _finished.append(records)
+        if TRACE_FILE:
+            with open(TRACE_FILE, "a", encoding="utf-8") as f:
+                for record in records:
+                    f.write(json.dumps(record, default=str) + "\n")
+
+# --- Reading Traces ---
+def recent_traces(limit=20):
+    """Most recent finished traces first; each is a list of span records in start order."""
+    with _lock:
+        return list(_finished)[-limit:][::-1]
+
+def clear():
+    with _lock:
+        _finished.clear()
+
+def span_tree(records):
+    """(depth, record) pairs in tree order, children by start time, for indented display."""
+    children = {}
+    for record in records:
+        children.setdefault(record["parentSpanId"], []).append(record)
+    known = {record["spanId"] for record in records}
+    # Spans whose parent never finished are shown at the top level.
+    roots = [record for record in records if record["parentSpanId"] is None or record["parentSpanId"] not in known]
+    ordered, stack = [], [(0, record) for record in reversed(roots)]
+    while stack:
+        depth, record = stack.pop()
+        ordered.append((depth, record))
+        stack.extend((depth + 1, child) for child in reversed(children.get(record["spanId"], [])))
+    return ordered
+
+def export_jsonl(traces=None):
+    traces = recent_traces(TRACE_BUFFER_SIZE)[::-1] if traces is None else traces
+    return "".join(json.dumps(record, default=str) + "\n" for records in traces for record in records)